@@ -11,6 +11,7 @@
 #
 
 DEFAULT_OPENOFFICE_PORT = 8100
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
 RESOLVESTR = "uno:socket,host=%s,port=%s;urp;StarOffice.ComponentContext"
 
 ################## For CSV documents #######################
@@ -23,13 +24,21 @@ CSVFilterOptions = "59,34,76,1"
 # Cell format codes for the different columns (optional)
 ############################################################
 
+# Filter options used by saveByStream, by export filter name
+FilterOptions = {'Text - txt - csv (StarCalc)': CSVFilterOptions}
+
+import os
 from os.path import abspath
+import socket
 import sys
 import traceback
 import time
 import subprocess
 import logging
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from io import BufferedReader
+import mmap
+from threading import Lock
 
 import uno
 import unohelper
@@ -37,13 +46,19 @@ from com.sun.star.beans import PropertyValue
 from com.sun.star.connection import NoConnectException, ConnectionSetupException
 from com.sun.star.beans import UnknownPropertyException
 from com.sun.star.lang import IllegalArgumentException, DisposedException
-from com.sun.star.io import XOutputStream
+from com.sun.star.io import XOutputStream, XInputStream, XSeekable
 from com.sun.star.document.UpdateDocMode import QUIET_UPDATE
 from com.sun.star.document.MacroExecMode import NEVER_EXECUTE
 from com.sun.star.style.BreakType import PAGE_AFTER, PAGE_BEFORE, PAGE_BOTH
-from com.sun.star.text.ControlCharacter import PARAGRAPH_BREAK, APPEND_PARAGRAPH
+from com.sun.star.text.ControlCharacter import PARAGRAPH_BREAK
+import aeroo_docs_office
+from aeroo_docs_office import start_append, append_document, update_document
 
-SECTIONMAXLEVEL = 10 # Just to make sure we do not go into endless loop
+SPOOL_THRESHOLD = 16 * 1024 * 1024 # Output bigger than this goes to temp file
+MAXRETRIES = 2 # Reconnects to office after its connection got disposed
+MAX_BATCH_STREAMS = 32 # Files appended by one office script call, each held open
+# Scripts of aeroo_docs_office module, once deployed into office user profile
+SCRIPT_URI = "vnd.sun.star.script:aeroo_docs_office.py$%s?language=Python&location=user"
 
 class DocumentConversionException(Exception):
 
@@ -53,16 +68,78 @@ class DocumentConversionException(Exception):
     def __str__(self):
         return self.message
 
+class BridgeCounter():
+    """
+    Counts calls crossing UNO bridge, both those made on office objects and
+    those office makes back on our streams. Every one is a round-trip.
+    """
+    def __init__(self):
+        self.calls = 0
+
+    def wrap(self, value):
+        # interfaces, unlike structs and plain values, live in office
+        if hasattr(value, 'queryInterface'):
+            return BridgeProxy(value, self)
+        return value
+
+def _unwrap(value):
+    if isinstance(value, BridgeProxy):
+        return value._target
+    if isinstance(value, tuple):
+        return tuple(_unwrap(item) for item in value)
+    return value
+
+class BridgeProxy():
+    """
+    Stands for office object, counting property accesses and method calls
+    on it. Objects it returns are wrapped too.
+    """
+    __slots__ = ('_target', '_counter')
+
+    def __init__(self, target, counter):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_counter', counter)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            return BridgeMethod(value, self._counter)
+        self._counter.calls += 1
+        return self._counter.wrap(value)
+
+    def __setattr__(self, name, value):
+        self._counter.calls += 1
+        setattr(self._target, name, _unwrap(value))
+
+class BridgeMethod():
+    __slots__ = ('_method', '_counter')
+
+    def __init__(self, method, counter):
+        self._method = method
+        self._counter = counter
+
+    def __call__(self, *args):
+        self._counter.calls += 1
+        return self._counter.wrap(self._method(*_unwrap(args)))
+
 class OutputStreamWrapper(unohelper.Base, XOutputStream):
-    """ Minimal Implementation of XOutputStream """
-    def __init__(self, debug=True):
+    """
+    Minimal Implementation of XOutputStream. Writes into given file object,
+    or into temporary file which stays in memory up to max_memory bytes.
+    """
+    def __init__(self, debug=True, fileobj=None, max_memory=SPOOL_THRESHOLD,
+                 counter=None):
         self.debug = debug
-        self.data = BytesIO()
+        self.counter = counter or BridgeCounter()
+        if fileobj is None:
+            fileobj = SpooledTemporaryFile(max_size=max_memory)
+        self.data = fileobj
         self.position = 0
         if self.debug:
             sys.stderr.write("__init__ OutputStreamWrapper.\n")
 
     def writeBytes(self, bytes):
+        self.counter.calls += 1
         if self.debug:
             sys.stderr.write("writeBytes %i bytes.\n" % len(bytes.value))
         self.data.write(bytes.value)
@@ -74,31 +151,99 @@ class OutputStreamWrapper(unohelper.Base, XOutputStream):
         self.data.close()
 
     def flush(self):
+        self.counter.calls += 1
         if self.debug:
             sys.stderr.write("Flushing output.\n")
         pass
     def closeOutput(self):
+        self.counter.calls += 1
         if self.debug:
             sys.stderr.write("Closing output.\n")
         pass
 
+class InputStreamWrapper(unohelper.Base, XInputStream, XSeekable):
+    """
+    Implementation of XInputStream and XSeekable over file object, so that
+    office reads document incrementally. Real files are memory mapped.
+    """
+    def __init__(self, fileobj, counter=None):
+        self.fileobj = fileobj
+        self.counter = counter or BridgeCounter()
+        self.data = fileobj
+        if isinstance(fileobj, BufferedReader):
+            try:
+                self.data = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file can not be mapped
+                pass
+        self.data.seek(0, 2)
+        self.length = self.data.tell()
+        self.data.seek(0)
+
+    def readBytes(self, aData, nBytesToRead):
+        self.counter.calls += 1
+        chunk = self.data.read(nBytesToRead)
+        return len(chunk), uno.ByteSequence(chunk)
+
+    def readSomeBytes(self, aData, nMaxBytesToRead):
+        return self.readBytes(aData, nMaxBytesToRead)
+
+    def skipBytes(self, nBytesToSkip):
+        self.counter.calls += 1
+        self.data.seek(nBytesToSkip, 1)
+
+    def available(self):
+        self.counter.calls += 1
+        return self.length - self.data.tell()
+
+    def closeInput(self):
+        self.data.close()
+        self.fileobj.close()
+
+    def seek(self, location):
+        self.counter.calls += 1
+        self.data.seek(location)
+
+    def getPosition(self):
+        self.counter.calls += 1
+        return self.data.tell()
+
+    def getLength(self):
+        self.counter.calls += 1
+        return self.length
+
 class DocumentConverter:
+
+    # UnoUrlResolver is shared by all converters of the process
+    _resolver = None
+    _resolver_lock = Lock()
    
-    def __init__(self, host='localhost', port=DEFAULT_OPENOFFICE_PORT, ooo_restart_cmd=None):
+    def __init__(self, host='localhost', port=DEFAULT_OPENOFFICE_PORT, ooo_restart_cmd=None,
+                 spool_threshold=SPOOL_THRESHOLD, ooo_start_timeout=60,
+                 office_scripts=False, restart=True):
         self._host = host
         self._port = port
+        self._ooo_start_timeout = ooo_start_timeout
+        self._ooo_pid = None
+        self._local = None
+        self._spool_threshold = spool_threshold
+        self.timings = []
+        self.bridge = BridgeCounter()
+        # run append and update as scripts inside office
+        self._office_scripts = office_scripts
+        self._scripts = {}
+        self._updated = False
         self.logger = logging.getLogger('main')
         self._ooo_restart_cmd = ooo_restart_cmd
         self.localContext = uno.getComponentContext()
         self.serviceManager = self.localContext.ServiceManager
-        resolvervector = "com.sun.star.bridge.UnoUrlResolver"
-        self._resolver = self.serviceManager.createInstanceWithContext(resolvervector, self.localContext)
+        self._resolver = self._getResolver()
         try:
             self.connectOffice()
         except IllegalArgumentException as exception:
             raise DocumentConversionException("The url is invalid (%s)" % exception)
         except NoConnectException as exception:
-            if self._restart_ooo():
+            if restart and self._restart_ooo():
                 # We try again once
                 try:
                     self.connectOffice()
@@ -109,33 +254,78 @@ class DocumentConverter:
 
         except ConnectionSetupException as exception:
             raise DocumentConversionException("Not possible to accept on a local resource (%s)" % exception)
+        self._createDesktop()
+
+    def _getResolver(self):
+        with DocumentConverter._resolver_lock:
+            if DocumentConverter._resolver is None:
+                resolvervector = "com.sun.star.bridge.UnoUrlResolver"
+                DocumentConverter._resolver = self.serviceManager.createInstanceWithContext(resolvervector, self.localContext)
+            return DocumentConverter._resolver
+
+    def popTimings(self):
+        """
+        Returns (stage, seconds) list measured since previous call.
+        """
+        timings, self.timings = self.timings, []
+        return timings
+
+    def popBridgeCalls(self):
+        """
+        Returns number of UNO bridge round-trips since previous call.
+        """
+        calls, self.bridge.calls = self.bridge.calls, 0
+        return calls
+
+    def _timed(self, stage, start_time):
+        self.timings.append((stage, time.time() - start_time))
 
     def connectOffice(self):
-        self._context = self._resolver.resolve(RESOLVESTR % (self._host, self._port))
+        context = self._resolver.resolve(RESOLVESTR % (self._host, self._port))
+        self._context = BridgeProxy(context, self.bridge)
+        self._scripts = {}
     
-    def _createDesktop(self):
+    def _createDesktop(self, retries=MAXRETRIES):
         try:
             smanager = self._context.ServiceManager
             desktopvector = "com.sun.star.frame.Desktop"
             self.desktop = smanager.createInstanceWithContext(desktopvector, self._context)
-        except UnknownPropertyException as e:
+        except (UnknownPropertyException, DisposedException) as e:
+            if not retries:
+                raise DocumentConversionException("Lost connection to OpenOffice.org on host %s, port %s. %s" % (self._host, self._port, e))
+            self._reconnect()
+            self._createDesktop(retries - 1)
+
+    def _reconnect(self):
+        try:
             self.connectOffice()
-            self._createDesktop()
+        except (NoConnectException, ConnectionSetupException) as e:
+            raise DocumentConversionException("Failed to connect to OpenOffice.org on host %s, port %s. %s" % (self._host, self._port, e))
     
-    def putDocument(self, data, filter_name=False, read_only=False):
+    def putDocument(self, data, filter_name=False, read_only=False, retries=MAXRETRIES):
         """
         Uploads document to office service
         """
+        inputStream = self._initStream(data)
         try:
-            if not hasattr(self, 'desktop'):
-                self._createDesktop()
-            elif self.desktop is None:
-                self._createDesktop()
-        except UnknownPropertyException:
-            self.connectOffice()
+            self._loadDocument('private:stream', filter_name, read_only,
+                               retries, InputStream=inputStream)
+        finally:
+            inputStream.closeInput()
+
+    def putDocumentByPath(self, path, filter_name=False, read_only=False,
+                          retries=MAXRETRIES):
+        """
+        Makes office load document straight from file, which has to be
+        reachable by office at the same path.
+        """
+        self._loadDocument(self._toFileUrl(path), filter_name, read_only,
+                           retries)
+
+    def _loadDocument(self, url, filter_name=False, read_only=False,
+                      retries=MAXRETRIES, **properties):
+        if getattr(self, 'desktop', None) is None:
             self._createDesktop()
-        inputStream = self._initStream(data)
-        properties = {'InputStream':inputStream}
         properties.update({'Hidden':True})
         properties.update({'UpdateDocMode':QUIET_UPDATE})
         properties.update({'ReadOnly':read_only})
@@ -148,19 +338,27 @@ class DocumentConverter:
             properties.update({'FilterName':filter_name})
         props = self._toProperties(**properties)
         try:
-            self.document = self.desktop.loadComponentFromURL('private:stream', '_blank', 0, props)
+            start_time = time.time()
+            self.document = self.desktop.loadComponentFromURL(url, '_blank', 0, props)
+            self._updated = False
+            self._timed('putDocument', start_time)
         except DisposedException as e:
             #   When office unexpectedly crashed or has been restarted, we know
             # nothing about it, that is why we need to create new desktop or
             # even try to completely reconnect to new office socket. Then give
-            # it another try.
+            # it another try, but not endlessly.
+            if not retries:
+                raise DocumentConversionException("Lost connection to OpenOffice.org on host %s, port %s. %s" % (self._host, self._port, e))
+            self._reconnect()
             self._createDesktop()
-            self.putDocument(data, filter_name=filter_name, read_only=read_only)
+            if 'InputStream' in properties:
+                properties['InputStream'].seek(0)
+            self._loadDocument(url, filter_name, read_only, retries - 1,
+                               **properties)
         except Exception as e:
             exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
             traceback.print_exception(exceptionType, exceptionValue,
                             exceptionTraceback, limit=2, file=sys.stdout)
-        inputStream.closeInput()
 
     def closeDocument(self):
         if hasattr(self,'document'):
@@ -168,45 +366,86 @@ class DocumentConverter:
                 self.document.close(True)
                 del self.document
 
-    def _updateDocument(self):
-        try:
-            self.document.updateLinks()
-        except AttributeError:
-            # if document doesn't support XLinkUpdate interface
-            pass
-        try:
-            self.document.refresh()
-            indexes = self.document.getDocumentIndexes()
-        except AttributeError:
-            # ods document does not support refresh
-            pass
+    def _updateDocument(self, update=None):
+        """
+        Updates links, fields and indexes of the document. By default only
+        what the document has is updated, with update True everything is and
+        with False nothing is. Update is done only once after last change.
+        """
+        if update is False or self._updated:
+            return
+        start_time = time.time()
+        script = self._officeScript('update_document')
+        if script is not None:
+            self._invokeScript(script, self.document, update is True)
         else:
-            for inc in range(0, indexes.getCount()):
-                indexes.getByIndex(inc).update()
+            update_document(self.document, update is True)
+        self._updated = True
+        self._timed('updateDocument', start_time)
         
-    def saveByStream(self, filter_name=None):
+    def saveByStream(self, filter_name=None, update=None):
         """
         Downloads document from office service
         """
-        self._updateDocument()
-        outputStream = OutputStreamWrapper(False)
+        outfile = self.saveToFile(filter_name=filter_name, update=update)
+        openDocumentBytes = outfile.read()
+        outfile.close()
+        return openDocumentBytes
+
+    def saveToFile(self, fileobj=None, filter_name=None, update=None):
+        """
+        Downloads document from office service into file object, by default
+        into temporary file which is kept in memory only while it is small.
+        Returns the file object positioned at start of the document.
+        """
+        self._updateDocument(update)
+        outputStream = OutputStreamWrapper(False, fileobj, self._spool_threshold,
+                                           self.bridge)
         properties = {"OutputStream": outputStream}
         properties.update({"FilterName": filter_name})
-        if filter_name == 'Text - txt - csv (StarCalc)':
-            properties.update({"FilterOptions": CSVFilterOptions})
+        if filter_name in FilterOptions:
+            properties.update({"FilterOptions": FilterOptions[filter_name]})
         props = self._toProperties(**properties)
         try:
             #url = uno.systemPathToFileUrl(path) #when storing to filesystem
+            start_time = time.time()
             self.document.storeToURL('private:stream', props)
+            self._timed('storeToURL', start_time)
         except Exception as exception:
             exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
             traceback.print_exception(exceptionType, exceptionValue,
                             exceptionTraceback, limit=2, file=sys.stdout)
-        openDocumentBytes = outputStream.data.getvalue()
-        outputStream.close()
-        return openDocumentBytes
+            # half written document must not pass for the result
+            if fileobj is None:
+                outputStream.data.close()
+            raise exception
+        outputStream.data.flush()
+        outputStream.data.seek(0)
+        return outputStream.data
+
+    def saveToPath(self, path, filter_name=None, update=None):
+        """
+        Makes office store document straight into file, which has to be
+        writable by office at the same path.
+        """
+        self._updateDocument(update)
+        properties = {"FilterName": filter_name, "Overwrite": True}
+        if filter_name in FilterOptions:
+            properties.update({"FilterOptions": FilterOptions[filter_name]})
+        props = self._toProperties(**properties)
+        start_time = time.time()
+        self.document.storeToURL(self._toFileUrl(path), props)
+        self._timed('storeToURL', start_time)
 
     def _initStream(self, data):
+        """
+        Returns input stream for document given as bytes or file object.
+        File objects are read by office directly, without loading them
+        into memory at once.
+        """
+        if not isinstance(data, (bytes, bytearray)):
+            data.seek(0)
+            return InputStreamWrapper(data, self.bridge)
         streamvector = "com.sun.star.io.SequenceInputStream"
         subStream = self.serviceManager.createInstanceWithContext(streamvector, self.localContext)
         subStream.initialize((uno.ByteSequence(data),))
@@ -220,10 +459,9 @@ class DocumentConverter:
         import os
 
         for subreport in oo_subreports:
-            fd = file(subreport, 'rb')
+            fd = open(subreport, 'rb')
             placeholder_text = "<insert_doc('%s')>" % subreport
-            subdata = fd.read()
-            subStream = self._initStream(subdata)
+            subStream = self._initStream(fd)
             search = self.document.createSearchDescriptor()
             search.SearchString = placeholder_text
             found = self.document.findFirst( search )
@@ -238,84 +476,168 @@ class DocumentConverter:
                 exceptionType, exceptionValue, exceptionTraceback = sys.exc_info()
                 traceback.print_exception(exceptionType, exceptionValue,
                                 exceptionTraceback, limit=2, file=sys.stdout)
+            subStream.closeInput()
             #found = self.document.findNext(found, search)
 
             os.unlink(subreport)
 
-    def appendDocuments(self, docs_iter, filter_name=False, preserve_styles=True):
-        # Get first document list of styles
-        stylefamilies = self.document.StyleFamilies
-        pagestyles = stylefamilies.getByName('PageStyles')
-        defaultpagetyle = pagestyles.getElementNames()[0]
-        # Seemingly not needed
-        #parastyles = stylefamilies.getByName('ParagraphStyles')
-        #defaultparatyle = parastyles.getElementNames()[0]
-        
-        text = self.document.Text
-        cursor = text.createTextCursor()
-        cursor.gotoStart(False)
-        
-        # Get first page styles
-        cursor.gotoStartOfParagraph(False)
-        cursor.gotoEndOfParagraph(True)
-        
-        pagestyle = cursor.PageDescName or defaultpagetyle
-        # Seemingly not needed
-        parastyle = cursor.ParaStyleName or defaultparatyle
+    def appendDocuments(self, docs_iter, filter_name=False, preserve_styles=True, update=None):
+        script = self._officeScript('append_documents')
+        if script is not None:
+            self._appendInOffice(script, docs_iter, filter_name)
+            self._updateDocument(update)
+            return
+        text, cursor, pagestyle = start_append(self.document)
         
         for doc in docs_iter:
-            subStream = self._initStream(doc)
-            properties = {'InputStream':subStream}
+            start_time = time.time()
+            # document given by path is read by office itself
+            if isinstance(doc, str):
+                url = self._toFileUrl(doc)
+                subStream = None
+                properties = {}
+            else:
+                url = 'private:stream'
+                subStream = self._initStream(doc)
+                properties = {'InputStream':subStream}
             properties.update({'FilterName':filter_name})
             props = self._toProperties(**properties)
             try:
-                cursor.gotoEnd(False)
-                cur_sect = cursor.TextSection
-                if cur_sect is not None:
-                    # drilldown to bottom
-                    lowersect = cur_sect
-                    parent_sect = True
-                    level = 0
-                    while parent_sect and level < SECTIONMAXLEVEL:
-                        parent_sect = lowersect.getParentSection()
-                        if parent_sect:
-                            lowersect = parent_sect
-                            level += 1
-                    # TODO Implement check if section is not anchored to page gloablly...
-                    # cur_pos = ancestor.AnchorType
-                    paravector = 'com.sun.star.text.Paragraph'
-                    newpara = self.document.createInstance(paravector)
-                    text.insertTextContentAfter(newpara, lowersect)
-                else:
-                    text.insertControlCharacter(cursor, APPEND_PARAGRAPH, 0)
-                cursor.gotoEnd(False)
-                cursor.gotoStartOfParagraph(False)
-                cursor.gotoEndOfParagraph(True)
-                cursor.PageDescName = pagestyle
-                cursor.PageNumberOffset = 1
-                # Seemingly not needed
-                #cursor.ParaStyleName = parastyle
-                self.document.Text.getEnd().insertDocumentFromURL('private:stream', props)
+                append_document(self.document, text, cursor, pagestyle, url, props)
+                self._updated = False
                 
             except Exception as e:
-                print("Error inserting file %s bytes on the OpenOffice document: %s" % (len(doc), e))
+                print("Error inserting file %s on the OpenOffice document: %s"
+                      % (subStream is None and doc
+                         or '%s bytes' % subStream.getLength(), e))
                 raise e
-        self._updateDocument()
+            finally:
+                if subStream is not None:
+                    subStream.closeInput()
+            self._timed('appendDocument', start_time)
+        self._updateDocument(update)
 
-    def convertByPath(self, inputFile, outputFile):
-        inputUrl = self._toFileUrl(inputFile)
-        outputUrl = self._toFileUrl(outputFile)
-        props = self._toProperties(Hidden=True)
-        document = self.desktop.loadComponentFromURL(inputUrl, "_blank", 8, props)
+    def _appendInOffice(self, script, docs_iter, filter_name=False):
+        """
+        Appends documents by office script, so that number of round-trips
+        does not grow with number of documents. Documents in memory are
+        sent along with the call, in batches of up to spool threshold.
+        Files stay open until their batch is appended, so a batch takes at
+        most MAX_BATCH_STREAMS of them.
+        """
+        batch = []
+        size = 0
+        streams = 0
         try:
-            document.refresh()
-        except AttributeError:
-            pass
-        props = self._toProperties(FilterName="writer_pdf_Export")
+            for doc in docs_iter:
+                if isinstance(doc, str):
+                    batch.append(self._toFileUrl(doc))
+                elif isinstance(doc, (bytes, bytearray)):
+                    batch.append(uno.ByteSequence(doc))
+                    size += len(doc)
+                else:
+                    batch.append(self._initStream(doc))
+                    streams += 1
+                if size >= self._spool_threshold or streams >= MAX_BATCH_STREAMS:
+                    self._appendBatch(script, batch, filter_name)
+                    batch = []
+                    size = 0
+                    streams = 0
+            if batch:
+                self._appendBatch(script, batch, filter_name)
+                batch = []
+        finally:
+            self._closeStreams(batch)
+
+    def _appendBatch(self, script, batch, filter_name):
         try:
-            document.storeToURL(outputUrl, props)
+            timings = self._invokeScript(script, self.document, tuple(batch),
+                                         filter_name or '')
+            self._updated = False
+        except Exception as e:
+            print("Error inserting %s files on the OpenOffice document: %s"
+                  % (len(batch), e))
+            raise e
         finally:
-            document.close(True)
+            self._closeStreams(batch)
+        self.timings.extend(('appendDocument', seconds) for seconds in timings)
+
+    def _closeStreams(self, docs):
+        for doc in docs:
+            if isinstance(doc, InputStreamWrapper):
+                doc.closeInput()
+
+    def _officeScript(self, name):
+        """
+        Returns script of aeroo_docs_office module running in office, or
+        None when scripts are not enabled or office can not run them.
+        """
+        if not self._office_scripts:
+            return None
+        script = self._scripts.get(name)
+        if script is None:
+            try:
+                if not self._scripts:
+                    self._deployScripts()
+                smanager = self._context.ServiceManager
+                factoryvector = "com.sun.star.script.provider.MasterScriptProviderFactory"
+                factory = smanager.createInstanceWithContext(factoryvector, self._context)
+                provider = factory.createScriptProvider('')
+                script = provider.getScript(SCRIPT_URI % name)
+            except Exception as e:
+                self.logger.warning('Office on host %s, port %s can not run '
+                                    'Python scripts, falling back to calls over '
+                                    'bridge. %s' % (self._host, self._port, e))
+                self._office_scripts = False
+                return None
+            self._scripts[name] = script
+        return script
+
+    def _deployScripts(self):
+        """
+        Copies aeroo_docs_office module into Scripts/python of office user
+        profile, unless the same file is there already.
+        """
+        smanager = self._context.ServiceManager
+        substvector = "com.sun.star.util.PathSubstitution"
+        substitution = smanager.createInstanceWithContext(substvector, self._context)
+        accessvector = "com.sun.star.ucb.SimpleFileAccess"
+        fileaccess = smanager.createInstanceWithContext(accessvector, self._context)
+        with open(aeroo_docs_office.__file__, 'rb') as scriptfile:
+            source = scriptfile.read()
+        folder = substitution.substituteVariables('$(user)/Scripts', True)
+        url = '%s/python/aeroo_docs_office.py' % folder
+        if fileaccess.exists(url) and fileaccess.getSize(url) == len(source):
+            # same size is not enough, edited script may keep its size
+            stream = fileaccess.openFileRead(url)
+            try:
+                length, deployed = stream.readBytes(None, len(source))
+            finally:
+                stream.closeInput()
+            if deployed.value == source:
+                return
+        for folder in (folder, folder + '/python'):
+            if not fileaccess.exists(folder):
+                fileaccess.createFolder(folder)
+        fileaccess.writeFile(url, self._initStream(source))
+        self.logger.info('Deployed office scripts to %s' % url)
+
+    def _invokeScript(self, script, *args):
+        result, out_indexes, out_params = script.invoke(args, (), ())
+        return result
+
+    def convertByPath(self, inputFile, outputFile, filter_name="writer_pdf_Export",
+                      in_filter_name=False, update=None):
+        """
+        Converts file to file without passing document through the bridge.
+        Both have to be reachable by office at the same paths.
+        """
+        self.putDocumentByPath(inputFile, filter_name=in_filter_name,
+                               read_only=True)
+        try:
+            self.saveToPath(outputFile, filter_name=filter_name, update=update)
+        finally:
+            self.closeDocument()
 
     def _toFileUrl(self, path):
         return uno.systemPathToFileUrl(abspath(path))
@@ -329,17 +651,113 @@ class DocumentConverter:
             props.append(prop)
         return tuple(props)
 
+    def isLocal(self):
+        """
+        Tells whether office runs on this machine, so that its process can
+        be found by port.
+        """
+        if self._local is None:
+            try:
+                address = socket.gethostbyname(self._host)
+                local = socket.gethostbyname(socket.gethostname())
+            except OSError:
+                address = local = None
+            self._local = self._host in LOCAL_HOSTS \
+                          or address is not None \
+                             and (address.startswith('127.') or address == local)
+        return self._local
+
+    def officePid(self):
+        """
+        Finds process id of office listening on our port, by its command
+        line. Returns None where /proc is not available, or office runs on
+        another host.
+        """
+        if not self.isLocal():
+            return None
+        if self._ooo_pid is not None and os.path.exists('/proc/%s' % self._ooo_pid):
+            return self._ooo_pid
+        self._ooo_pid = None
+        accept = 'port=%s;' % self._port
+        try:
+            pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+        except OSError:
+            return None
+        for pid in pids:
+            try:
+                with open('/proc/%s/cmdline' % pid, 'rb') as cmdfile:
+                    cmdline = cmdfile.read().decode('utf8', 'replace')
+            except OSError:
+                continue
+            if 'soffice' in cmdline and accept in cmdline:
+                self._ooo_pid = int(pid)
+                # soffice wrapper script starts soffice.bin, prefer that one
+                if 'soffice.bin' in cmdline:
+                    break
+        return self._ooo_pid
+
+    def officeMemory(self):
+        """
+        Returns resident memory of office process in bytes, or None if it
+        can not be found out.
+        """
+        pid = self.officePid()
+        if pid is None:
+            return None
+        try:
+            with open('/proc/%s/status' % pid) as statusfile:
+                for line in statusfile:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            self._ooo_pid = None
+        return None
+
+    def _waitForOffice(self):
+        """
+        Polls office socket until it accepts UNO connection.
+        """
+        deadline = time.time() + self._ooo_start_timeout
+        while True:
+            try:
+                self.connectOffice()
+                return True
+            except (NoConnectException, ConnectionSetupException):
+                if time.time() > deadline:
+                    return False
+                time.sleep(0.2)
+
+    def canRestart(self):
+        """
+        Tells whether restart script can restart this office. Office on
+        another host only can if script is given its {host}.
+        """
+        return bool(self._ooo_restart_cmd) \
+               and (self.isLocal() or '{host}' in self._ooo_restart_cmd)
+
     def _restart_ooo(self):
         if not self._ooo_restart_cmd:
             self.logger.warning('No LibreOffice/OpenOffice restart script configured')
             return False
+        if not self.canRestart():
+            self.logger.warning('Not restarting LibreOffice/OpenOffice on remote '
+                                'host %s, restart script does not take {host}'
+                                % self._host)
+            return False
         self.logger.info('Restarting LibreOffice/OpenOffice background process')
+        # only placeholders are replaced, shell command may have other braces
+        restart_cmd = self._ooo_restart_cmd.replace('{host}', self._host) \
+                                           .replace('{port}', str(self._port))
+        self._ooo_pid = None
         try:
-            self.logger.info('Executing restart script "%s"' % self._ooo_restart_cmd)
-            retcode = subprocess.call(self._ooo_restart_cmd, shell=True)
+            self.logger.info('Executing restart script "%s"' % restart_cmd)
+            retcode = subprocess.call(restart_cmd, shell=True)
             if retcode == 0:
                 self.logger.warning('Restart successfull')
-                time.sleep(4) # Let some time for LibO/OOO to be fully started
+                # Let LibO/OOO to be fully started
+                if not self._waitForOffice():
+                    self.logger.error('LibreOffice/OpenOffice did not start in %s s'
+                                      % self._ooo_start_timeout)
             else:
                 self.logger.error('Restart script failed with return code %d' % retcode)
         except OSError as e:
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+import logging
+from hashlib import sha256
+from collections import OrderedDict
+from os import path, listdir, mkdir, stat, unlink, rename, getpid
+from threading import Lock, get_ident
+from time import time
+
+SWEEP_INTERVAL = 60
+HASH_CHUNK = 1024 * 1024
+
+class ConversionCache():
+    """
+    Content addressed cache of conversion results.
+
+    Results are kept in memory, least recently used first out, up to
+    max_bytes. When disk_dir is given, results are also written there and
+    served back until disk_expire seconds after they were stored.
+    """
+    def __init__(self, max_bytes=0, disk_dir=None, disk_expire=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_expire and disk_dir or None
+        self.disk_expire = disk_expire
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._last_sweep = time()
+        if self.disk_dir and not path.exists(self.disk_dir):
+            mkdir(self.disk_dir, mode=0o0700)
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes or self.disk_dir)
+
+    def key(self, data, *options):
+        """
+        Returns cache key for input bytes and everything else that affects
+        the result (mime types, filter names and options).
+        """
+        if hasattr(data, 'read'):
+            digest = sha256()
+            data.seek(0)
+            for chunk in iter(lambda: data.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+            data.seek(0)
+        else:
+            digest = sha256(data)
+        for option in options:
+            digest.update(b'\0' + str(option).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store_memory(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._store_memory(key, data)
+        self._write_disk(key, data)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes,
+                   }
+
+    def _store_memory(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key))
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            old_key, old_data = self._entries.popitem(last=False)
+            self.size -= len(old_data)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        fname = path.join(self.disk_dir, key)
+        try:
+            if time() - stat(fname).st_mtime > self.disk_expire:
+                self._unlink(fname)
+                return None
+            with open(fname, 'rb') as cachefile:
+                return cachefile.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+        logger = logging.getLogger('main')
+        fname = path.join(self.disk_dir, key)
+        tmpname = '%s.%s.%s' % (fname, getpid(), get_ident())
+        try:
+            with open(tmpname, 'wb') as cachefile:
+                cachefile.write(data)
+            rename(tmpname, fname)
+        except OSError as e:
+            logger.warning('Failed to write conversion cache file: %s' % e)
+        if time() - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = time()
+            self._sweep()
+
+    def _sweep(self):
+        now = time()
+        for fname in listdir(self.disk_dir):
+            fname = path.join(self.disk_dir, fname)
+            try:
+                if now - stat(fname).st_mtime > self.disk_expire:
+                    self._unlink(fname)
+            except FileNotFoundError:
+                pass
+
+    def _unlink(self, fname):
+        try:
+            unlink(fname)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.evictions += 1
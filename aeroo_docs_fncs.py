@@ -29,14 +29,33 @@
 ################################################################################
 import logging
 import base64
-from hashlib import md5
-from random import randint
-from os import path, rename, getpid
+from os import fstat
+import os
+from collections import deque
+from io import BytesIO
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from time import time, sleep
+from threading import Condition, Thread, Lock
+from uuid import uuid4
+from contextlib import contextmanager
 from jsonrpc2 import JsonRpcException
-from DocumentConverter import DocumentConverter, DocumentConversionException
+from DocumentConverter import DocumentConverter, DocumentConversionException, \
+                              FilterOptions, SPOOL_THRESHOLD
+from aeroo_docs_cache import ConversionCache
+from aeroo_docs_spool import Spool
+from aeroo_docs_stats import Stats
+from aeroo_docs_jobs import JobQueue
+from aeroo_docs_pdf import merge as merge_pdf
 
-MAXINT = 9223372036854775807
+DOWNLOAD_CHUNK = 1024 * 1024 # default size of chunk returned by download
+DOWNLOAD_CHUNK_MAX = 16 * 1024 * 1024
+LATENCY_WINDOW = 50 # conversions to calculate office latency from
+BATCH_MEMORY = 256 * 1024 * 1024 # documents in flight in convert_batch
+HANDLE_TIMEOUT = 30 # seconds open document handle is kept without use
+PROBE_INTERVAL = 5 # seconds between connection attempts to ejected office
 
 filters = {'pdf':'writer_pdf_Export',   # PDF - Portable Document Format
            'odt':'writer8', #ODF Text Document
@@ -46,6 +65,45 @@ filters = {'pdf':'writer_pdf_Export',   # PDF - Portable Document Format
            'csv':'Text - txt - csv (StarCalc)', # Text CSV
           }
 
+def _odf(mimetype, body):
+    """
+    Returns minimal OpenDocument file with given body.
+    """
+    content = '<?xml version="1.0" encoding="UTF-8"?>' \
+        '<office:document-content ' \
+        'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" ' \
+        'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" ' \
+        'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" ' \
+        'office:version="1.2"><office:body>%s</office:body>' \
+        '</office:document-content>' % body
+    manifest = '<?xml version="1.0" encoding="UTF-8"?>' \
+        '<manifest:manifest ' \
+        'xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" ' \
+        'manifest:version="1.2">' \
+        '<manifest:file-entry manifest:full-path="/" manifest:media-type="%s"/>' \
+        '<manifest:file-entry manifest:full-path="content.xml" ' \
+        'manifest:media-type="text/xml"/></manifest:manifest>' % mimetype
+    data = BytesIO()
+    with ZipFile(data, 'w') as odf:
+        # mimetype has to be the first, uncompressed entry
+        odf.writestr('mimetype', mimetype, ZIP_STORED)
+        odf.writestr('META-INF/manifest.xml', manifest, ZIP_DEFLATED)
+        odf.writestr('content.xml', content, ZIP_DEFLATED)
+    return data.getvalue()
+
+# Tiny documents loaded into every office before it starts serving, and
+# output formats they are stored to, so that all filters are loaded
+warmup = (('odt', _odf('application/vnd.oasis.opendocument.text',
+                       '<office:text><text:p>Aeroo DOCS</text:p></office:text>'),
+           ('pdf', 'odt', 'doc')),
+          ('ods', _odf('application/vnd.oasis.opendocument.spreadsheet',
+                       '<office:spreadsheet><table:table table:name="Sheet1">'
+                       '<table:table-row><table:table-cell><text:p>1</text:p>'
+                       '</table:table-cell></table:table-row></table:table>'
+                       '</office:spreadsheet>'),
+           ('ods', 'xls', 'csv')),
+         )
+
 class AccessException(Exception):
     pass
     
@@ -58,109 +116,925 @@ class NodataException(Exception):
 class NoOfficeConnection(Exception):
     pass
 
-class OfficeService():
-    def __init__(self, oo_host, oo_port, spool_dir, auth_type):
+class OfficeBusy(Exception):
+    pass
+
+class MemoryBudget():
+    """
+    Limits bytes of documents being converted at the same time. Document
+    bigger than the whole limit is let through alone.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = Condition()
+
+    @contextmanager
+    def reserve(self, size):
+        size = min(size, self.limit)
+        with self._lock:
+            while self.used and self.used + size > self.limit:
+                self._lock.wait()
+            self.used += size
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.used -= size
+                self._lock.notify_all()
+
+class DocumentHandle():
+    """
+    Document kept loaded on office worker between convert_multi calls. The
+    worker stays out of the pool until handle is closed.
+    """
+    def __init__(self, worker):
+        self.handle = uuid4().hex
+        self.worker = worker
+        self.touched = time()
+        self.closed = False
+        self.lock = Lock()
+
+class OfficeWorker():
+    """
+    One office instance listening on its own port, with its own converter.
+    Keeps track of conversions since office was (re)started, to tell when
+    office should be recycled.
+    """
+    def __init__(self, oo_host, oo_port, max_conversions=0, max_memory=0,
+                 latency_factor=0, warm_up=True, **options):
         self.oo_host = oo_host
         self.oo_port = oo_port
-        self.spool_path = spool_dir + '/%s'
-        self.auth = auth_type
+        self.warm_up = warm_up
+        self.max_conversions = max_conversions
+        self.max_memory = max_memory
+        self.latency_factor = latency_factor
+        self.options = options
+        self._reset_counters()
         self._init_conn()
-    
-    def _init_conn(self):
+
+    def _reset_counters(self):
+        self.conversions = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.baseline = None
+
+    def _init_conn(self, restart=True):
         logger = logging.getLogger('main')
         try:
-            self.oservice = DocumentConverter(self.oo_host, self.oo_port)
+            self.oservice = DocumentConverter(self.oo_host, self.oo_port,
+                                              restart=restart, **self.options)
         except DocumentConversionException as e:
             self.oservice = None
-            logger.warning("Failed to initiate OpenOffice/LibreOffice connection.")
-    
-    def _conn_healthy(self):
-        if hasattr(self, 'oservice'):
-            if self.oservice is not None:
-                return True
+            logger.warning("Failed to initiate OpenOffice/LibreOffice "
+                           "connection on %s:%s." % (self.oo_host, self.oo_port))
         else:
-            self.oservice = None
+            if self.warm_up:
+                self._warm_up()
+
+    def _warm_up(self):
+        """
+        Round-trips tiny documents through every filter, so that the first
+        real request does not pay for loading them.
+        """
         logger = logging.getLogger('main')
-        attempt = 0
-        while self.oservice is None and attempt < 3:
-            attempt += 1
-            self._init_conn()
-            if self.oservice is not None:
-                return True
-            sleep(3)
-        message = 'Failed to initiate connection to OpenOffice/LibreOffice three times in a row.'
-        logger.warning(message)
-        raise NoOfficeConnection(message)
-    
-    def _chktime(self, start_time):
-        return '%s s' % str(round(time()-start_time, 6))
+        start_time = time()
+        try:
+            for in_mime, data, out_mimes in warmup:
+                self.oservice.putDocument(data, filter_name=filters[in_mime],
+                                          read_only=True)
+                try:
+                    for out_mime in out_mimes:
+                        self.oservice.saveByStream(filters[out_mime])
+                finally:
+                    self.oservice.closeDocument()
+        except Exception as e:
+            logger.warning('Warm up of OpenOffice/LibreOffice on port %s '
+                           'failed: %s' % (self.oo_port, e))
+        else:
+            logger.info('OpenOffice/LibreOffice on port %s warmed up in %.3f s'
+                        % (self.oo_port, time() - start_time))
+        self.oservice.popTimings()
+        self.oservice.popBridgeCalls()
     
-    def convert(self, data=False, identifier=False, in_mime=False, out_mime=False, username=None, password=None):
+    def _conn_healthy(self, restart=True):
+        """
+        Connects to office if worker is not connected. Returns whether it
+        is connected, without retrying, so that request can go elsewhere.
+        """
+        if self.oservice is None:
+            self._init_conn(restart)
+        return self.oservice is not None
+
+    def record(self, seconds):
+        self.conversions += 1
+        self.latencies.append(seconds)
+        if self.baseline is None and len(self.latencies) == LATENCY_WINDOW:
+            # latency of fresh office, to compare later latencies against
+            self.baseline = self.p95()
+
+    def latency(self):
+        """
+        Returns average of recent conversion times, 0 if there are none.
+        """
+        latencies = list(self.latencies)
+        return latencies and sum(latencies) / len(latencies) or 0
+
+    def p95(self):
+        latencies = sorted(self.latencies)
+        return latencies and latencies[int(0.95 * (len(latencies) - 1))] or 0
+
+    def recycle_reason(self):
+        """
+        Returns why office should be restarted, or None if it should not.
+        """
+        if self.oservice is None or not self.oservice.canRestart():
+            return None
+        if self.max_conversions and self.conversions >= self.max_conversions:
+            return '%s conversions' % self.conversions
+        if self.max_memory:
+            memory = self.oservice.officeMemory()
+            if memory is not None and memory > self.max_memory:
+                return 'memory use %s MB' % (memory // 1024 // 1024)
+        if self.latency_factor and self.baseline \
+                and len(self.latencies) == LATENCY_WINDOW \
+                and self.p95() > self.baseline * self.latency_factor:
+            return 'p95 latency %.3f s, was %.3f s' % (self.p95(), self.baseline)
+        return None
+
+    def recycle(self, reason):
         logger = logging.getLogger('main')
+        logger.info('Recycling OpenOffice/LibreOffice on port %s after %s.'
+                    % (self.oo_port, reason))
+        oservice, self.oservice = self.oservice, None
+        oservice._restart_ooo()
+        self._reset_counters()
+        self._init_conn()
+
+def endpoints(oo_server, oo_port):
+    """
+    Returns (host, port) of offices given as comma separated hosts, each
+    optionally with its own port, otherwise oo_port. IPv6 address takes
+    port only in brackets, as [::1]:8100.
+    """
+    result = []
+    for entry in str(oo_server).split(','):
+        entry = entry.strip()
+        host, port = entry, oo_port
+        if entry.startswith('['):
+            address, sep, rest = entry[1:].partition(']')
+            if sep and (not rest or rest.startswith(':') and rest[1:].isdigit()):
+                host, port = address, rest[1:] or oo_port
+        elif entry.count(':') == 1:
+            name, sep, number = entry.partition(':')
+            if number.isdigit():
+                host, port = name, number
+        if host:
+            result.append((host, int(port)))
+    return result
+
+class OfficePool():
+    """
+    Pool of office workers, size of them on consecutive ports of every
+    office endpoint. Every request checks out idle worker of the least
+    loaded endpoint, judging by requests in flight there and recent
+    latency, or waits up to timeout seconds in line for one to become free.
+    Worker which lost its office is ejected from the pool and probed in
+    background until office is back. Worker due for recycling is restarted
+    in background and returns to the pool when its office is up again.
+    Remaining keyword arguments are passed on to every OfficeWorker.
+    """
+    def __init__(self, oo_host, oo_port, size=1, timeout=60, **options):
+        self.timeout = timeout
+        self.recycles = 0
+        addresses = [(host, port) for host, first_port in endpoints(oo_host, oo_port)
+                     for port in range(first_port, first_port + max(size, 1))]
+        # connect and warm up all offices at the same time
+        with ThreadPoolExecutor(max_workers=len(addresses)) as executor:
+            self.workers = list(executor.map(
+                lambda address: OfficeWorker(address[0], address[1], **options),
+                addresses))
+        self._idle = [worker for worker in self.workers
+                      if worker.oservice is not None]
+        self._ejected = set(worker for worker in self.workers
+                            if worker.oservice is None)
+        self._in_flight = dict((worker.oo_host, 0) for worker in self.workers)
+        self._waiting = deque()
+        self._prober = None
+        self._lock = Condition()
+        if self._ejected:
+            self._start_prober()
+
+    def acquire(self):
+        """
+        Returns idle worker connected to its office.
+        """
+        deadline = time() + self.timeout
+        while True:
+            worker = self._acquire(deadline)
+            if worker._conn_healthy():
+                return worker
+            # office went away while worker was idle, try another one
+            self.release(worker, failed=True)
+
+    def _acquire(self, deadline):
+        with self._lock:
+            # requests are served in order of arrival
+            ticket = object()
+            self._waiting.append(ticket)
+            try:
+                while self._waiting[0] is not ticket or not self._idle:
+                    if len(self._ejected) == len(self.workers):
+                        raise NoOfficeConnection('No OpenOffice/LibreOffice is reachable.')
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        raise OfficeBusy('All %s office workers are busy.'
+                                         % len(self.workers))
+                    self._lock.wait(remaining)
+                worker = min(self._idle, key=self._expected_latency)
+                self._idle.remove(worker)
+                self._in_flight[worker.oo_host] += 1
+                return worker
+            finally:
+                self._waiting.remove(ticket)
+                self._lock.notify_all()
+
+    def _expected_latency(self, worker):
+        """
+        Estimates how long request would take on worker, with requests
+        already in flight on the same host sharing its resources.
+        """
+        return (self._in_flight[worker.oo_host] + 1) * (worker.latency() or 0.001)
+
+    def release(self, worker, failed=False):
+        """
+        Returns worker to the pool. Worker whose office failed is ejected
+        until probe gets connection again.
+        """
+        reason = not failed and worker.recycle_reason()
+        with self._lock:
+            self._in_flight[worker.oo_host] -= 1
+            if failed:
+                worker.oservice = None
+                self._ejected.add(worker)
+                self._start_prober()
+            elif not reason:
+                self._idle.append(worker)
+                self._lock.notify_all()
+        if failed:
+            logger = logging.getLogger('main')
+            logger.warning('OpenOffice/LibreOffice on %s:%s failed, ejected '
+                           'from the pool.' % (worker.oo_host, worker.oo_port))
+        elif reason:
+            recycler = Thread(target=self._recycle, args=(worker, reason),
+                              name='Recycle %s' % worker.oo_port)
+            recycler.daemon = True
+            recycler.start()
+
+    def _recycle(self, worker, reason):
+        try:
+            worker.recycle(reason)
+        except Exception as e:
+            logger = logging.getLogger('main')
+            logger.error('Recycling OpenOffice/LibreOffice on port %s failed: %s'
+                         % (worker.oo_port, e))
+        finally:
+            with self._lock:
+                self.recycles += 1
+                if worker.oservice is None:
+                    self._ejected.add(worker)
+                    self._start_prober()
+                else:
+                    self._idle.append(worker)
+                    self._lock.notify_all()
+
+    def _start_prober(self):
+        """
+        Starts background probing of ejected workers, caller holds the lock.
+        """
+        if self._prober is None:
+            self._prober = Thread(target=self._probe, name='Office prober',
+                                  daemon=True)
+            self._prober.start()
+
+    def _probe(self):
+        logger = logging.getLogger('main')
+        while True:
+            sleep(PROBE_INTERVAL)
+            with self._lock:
+                ejected = list(self._ejected)
+            for worker in ejected:
+                # office that is down is not restarted on every probe
+                if not worker._conn_healthy(restart=False):
+                    continue
+                logger.info('OpenOffice/LibreOffice on %s:%s is back in the pool.'
+                            % (worker.oo_host, worker.oo_port))
+                with self._lock:
+                    self._ejected.discard(worker)
+                    self._idle.append(worker)
+                    self._lock.notify_all()
+            with self._lock:
+                if not self._ejected:
+                    self._prober = None
+                    return
+
+    def stats(self):
+        with self._lock:
+            return {'workers': len(self.workers),
+                    'workers_idle': len(self._idle),
+                    'workers_ejected': len(self._ejected),
+                    'recycles': self.recycles,
+                   }
+
+    @contextmanager
+    def worker(self):
+        worker = self.acquire()
+        failed = False
+        try:
+            start_time = time()
+            yield worker.oservice
+            worker.record(time() - start_time)
+        except DocumentConversionException:
+            # connection is lost, office is probed until it is back
+            failed = True
+            raise
+        finally:
+            self.release(worker, failed)
+
+class OfficeService():
+    def __init__(self, oo_host, oo_port, spool_dir, auth_type, workers=1,
+                 queue_timeout=60, cache_size=0, cache_expire=0,
+                 spool_threshold=SPOOL_THRESHOLD, prefetch=2, join_batch=0,
+                 restart_cmd=None, start_timeout=60, max_conversions=0,
+                 max_memory=0, latency_factor=0, warm_up=True,
+                 batch_memory=BATCH_MEMORY, max_jobs=100, job_expire=1800,
+                 max_handles=0, handle_timeout=HANDLE_TIMEOUT, shared_spool=False,
+                 pdf_workers=2, office_scripts=False):
+        self._pdf_pool = None
+        if pdf_workers > 0:
+            # spawned processes would run aeroo-docs script again, so they
+            # are forked, but first of all, before any thread or office
+            # connection exists; the pool forks all on its first task
+            self._pdf_pool = ProcessPoolExecutor(max_workers=pdf_workers,
+                                mp_context=multiprocessing.get_context('fork'))
+            self._pdf_pool.submit(os.getpid).result()
+        self.oo_host = oo_host
+        self.oo_port = oo_port
+        self.spool_path = spool_dir + '/%s'
+        self.spool = Spool(spool_dir)
+        self.auth = auth_type
+        self.pool = OfficePool(oo_host, oo_port, workers, queue_timeout,
+                               spool_threshold=spool_threshold,
+                               ooo_restart_cmd=restart_cmd,
+                               ooo_start_timeout=start_timeout,
+                               max_conversions=max_conversions,
+                               max_memory=max_memory,
+                               latency_factor=latency_factor,
+                               warm_up=warm_up,
+                               office_scripts=office_scripts)
+        self.cache = ConversionCache(cache_size, self.spool_path % 'cache',
+                                     cache_expire)
+        self.metrics = Stats(filters)
+        self.spool_threshold = spool_threshold
+        self.join_batch = join_batch
+        self.batch_memory = batch_memory
+        self.prefetch = prefetch
+        # workers of all office hosts
+        self.jobs = JobQueue(len(self.pool.workers), max_jobs, job_expire,
+                             self._forgetJob)
+        # every handle holds a worker, at least one is left for conversions
+        self.max_handles = min(max(max_handles, 0), len(self.pool.workers) - 1)
+        if self.max_handles < max_handles:
+            logging.getLogger('main').warning(
+                'Open documents are limited to %s, one less than office '
+                'workers.' % self.max_handles)
+        # office reads and writes spool files itself
+        self.shared_spool = shared_spool
+        self.handle_timeout = handle_timeout
+        self._handles = {}
+        self._handles_lock = Lock()
+        if self.max_handles > 0:
+            Thread(target=self._closeIdleHandles, name='Handle cleaner',
+                   daemon=True).start()
+        self._prefetcher = None
+        if prefetch > 0:
+            # every worker can be joining, each with prefetch files ahead
+            # and the one it waits for, so joins do not queue behind each other
+            self._prefetcher = ThreadPoolExecutor(
+                max_workers=len(self.pool.workers) * (prefetch + 1),
+                thread_name_prefix='Prefetch')
+    
+    def convert(self, data=False, identifier=False, in_mime=False, out_mime=False, username=None, password=None,
+                spool_result=False, update=None):
         if not self.auth(username, password):
             raise AccessException('Access denied.')
-        start_time = time()
+        timer = self.metrics.timer('convert', in_mime, out_mime)
+        result = self._convert(data, identifier, in_mime, out_mime, timer,
+                               spool_result, update)
+        if not spool_result:
+            result = base64.b64encode(result).decode('utf8')
+            timer.lap('encode')
+        timer.finish()
+        return result
+
+    def _convert(self, data, identifier, in_mime, out_mime, timer,
+                 spool_result=False, update=None):
+        """
+        Converts document given as base64 data or spool identifier. Returns
+        converted document, or identifier of spooled result.
+        """
+        logger = logging.getLogger('main')
+        if self.shared_spool and data is False and identifier is not False:
+            return self._convertByPath(identifier, in_mime, out_mime, timer,
+                                       spool_result, update)
+        data = self._readInput(data, identifier)
+        timer.lap('read')
+        try:
+            infilter = filters.get(in_mime, False)
+            outfilter = filters.get(out_mime, False)
+            cache_key = None
+            if self.cache.enabled:
+                cache_key = self.cache.key(data, infilter, outfilter,
+                                           FilterOptions.get(outfilter, ''), update)
+                conv_data = self.cache.get(cache_key)
+                timer.lap('cache')
+                if conv_data is not None:
+                    logger.debug("  cache hit")
+                    if spool_result:
+                        conv_data = self._spoolResult(conv_data)
+                        timer.lap('spool')
+                    return conv_data
+            with self.pool.worker() as oservice:
+                timer.lap('connect')
+                try:
+                    oservice.putDocument(data, filter_name=infilter, read_only=True)
+                    if spool_result:
+                        result = self._saveResult(oservice, outfilter, update)
+                    else:
+                        result = oservice.saveByStream(filter_name=outfilter,
+                                                       update=update)
+                except Exception as e:
+                    logger.debug("  conversion failed Exception: %s" % str(e))
+                    oservice.closeDocument()
+                    logger.debug("  emergency close document")
+                    raise e
+                else:
+                    oservice.closeDocument()
+                finally:
+                    timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+        finally:
+            if hasattr(data, 'close'):
+                data.close()
+        # empty result is a failed conversion, not worth remembering
+        if not spool_result and cache_key is not None and result:
+            self.cache.put(cache_key, result)
+        return result
+
+    def _convertByPath(self, identifier, in_mime, out_mime, timer,
+                       spool_result=False, update=None):
+        """
+        Converts spool file by having office load it from its path, and
+        store result straight into new spool file when spool_result is set.
+        Document bytes do not pass through this process then, so conversion
+        cache is not used.
+        """
+        logger = logging.getLogger('main')
+        inpath = self._spoolPath(identifier)
+        with self.pool.worker() as oservice:
+            timer.lap('connect')
+            try:
+                oservice.putDocumentByPath(inpath,
+                                           filter_name=filters.get(in_mime, False),
+                                           read_only=True)
+                if spool_result:
+                    result = self._storeResult(oservice, filters.get(out_mime, False),
+                                               update)
+                else:
+                    result = oservice.saveByStream(filter_name=filters.get(out_mime, False),
+                                                   update=update)
+            except Exception as e:
+                logger.debug("  conversion failed Exception: %s" % str(e))
+                oservice.closeDocument()
+                logger.debug("  emergency close document")
+                raise e
+            else:
+                oservice.closeDocument()
+            finally:
+                timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+        return result
+
+    def _readInput(self, data, identifier):
+        """
+        Returns decoded base64 data, or spool file of identifier.
+        """
+        logger = logging.getLogger('main')
         logger.debug('Openning identifier: %s' % identifier)
         if data is not False:
-            data = base64.b64decode(data)
+            return base64.b64decode(data)
         elif identifier is not False:
-            data = self._readFile(identifier)
-        else:
-            raise NoidentException('Wrong or no identifier.')
-        logger.debug("  read file %s" % self._chktime(start_time))
-        self._conn_healthy()
-        logger.debug("  connection test ok %s" % self._chktime(start_time))
-        infilter = filters.get(in_mime, False)
-        outfilter = filters.get(out_mime, False)
-        self.oservice.putDocument(data, filter_name=infilter, read_only=True)
-        logger.debug("  upload document to office %s" % self._chktime(start_time))
+            return self._openFile(identifier)
+        raise NoidentException('Wrong or no identifier.')
+
+    def convert_multi(self, data=False, identifier=False, in_mime=False, out_mimes=(),
+                      username=None, password=None, spool_result=False, update=None,
+                      handle=False):
+        """
+        Loads document once and stores it in every format of out_mimes.
+        Document kept open with open_document can be given by handle
+        instead of data or identifier. Returns dictionary of results by
+        out_mime.
+        """
+        logger = logging.getLogger('main')
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        # several output types are not labelled, that would multiply series
+        timer = self.metrics.timer('convert_multi', in_mime)
+        if handle:
+            doc = self._getHandle(handle)
+            with doc.lock:
+                if doc.closed:
+                    raise NoidentException('Wrong or no handle.')
+                timer.lap('connect')
+                oservice = doc.worker.oservice
+                try:
+                    results = self._storeMulti(oservice, out_mimes, timer,
+                                               spool_result, update)
+                except Exception as e:
+                    logger.debug("  conversion failed Exception: %s" % str(e))
+                    self._closeHandle(doc, e)
+                    raise e
+                doc.touched = time()
+            timer.finish()
+            return results
+        data = self._readInput(data, identifier)
+        timer.lap('read')
         try:
-            conv_data = self.oservice.saveByStream(filter_name=outfilter)
-            logger.debug("  download converted document %s" % self._chktime(start_time))
-        except Exception as e:
-            logger.debug("  conversion failed %s Exception: %s" % (self._chktime(start_time), str(e)))
-            self.oservice.closeDocument()
-            logger.debug("  emergency close document %s" % self._chktime(start_time))
-            raise e
-        else:
-            self.oservice.closeDocument()
-            logger.debug("  close document %s" % self._chktime(start_time))
-        return base64.b64encode(conv_data).decode('utf8')
+            with self.pool.worker() as oservice:
+                timer.lap('connect')
+                try:
+                    oservice.putDocument(data, filter_name=filters.get(in_mime, False),
+                                         read_only=True)
+                    results = self._storeMulti(oservice, out_mimes, timer,
+                                               spool_result, update)
+                except Exception as e:
+                    logger.debug("  conversion failed Exception: %s" % str(e))
+                    oservice.closeDocument()
+                    logger.debug("  emergency close document")
+                    raise e
+                else:
+                    oservice.closeDocument()
+                finally:
+                    timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+        finally:
+            if hasattr(data, 'close'):
+                data.close()
+        timer.finish()
+        return results
+
+    def _storeMulti(self, oservice, out_mimes, timer, spool_result=False,
+                    update=None):
+        results = {}
+        for out_mime in out_mimes:
+            outfilter = filters.get(out_mime, False)
+            if spool_result:
+                results[out_mime] = self._saveResult(oservice, outfilter, update)
+                timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+            else:
+                data = oservice.saveByStream(filter_name=outfilter, update=update)
+                timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+                results[out_mime] = base64.b64encode(data).decode('utf8')
+                timer.lap('encode')
+        return results
+
+    def open_document(self, data=False, identifier=False, in_mime=False,
+                      username=None, password=None):
+        """
+        Loads document and keeps it open on office worker, for convert_multi
+        calls with returned handle. Handle is closed by close_document or
+        after handle_timeout seconds without use.
+        """
+        logger = logging.getLogger('main')
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        if not self.max_handles:
+            raise NodataException('Open documents are disabled.')
+        with self._handles_lock:
+            if len(self._handles) >= self.max_handles:
+                raise OfficeBusy('Too many open documents.')
+            # reserve the slot while document is being loaded
+            reservation = object()
+            self._handles[reservation] = None
+        try:
+            data = self._readInput(data, identifier)
+            try:
+                worker = self.pool.acquire()
+                doc = DocumentHandle(worker)
+                try:
+                    worker.oservice.putDocument(data,
+                                                filter_name=filters.get(in_mime, False),
+                                                read_only=True)
+                    worker.oservice.popTimings()
+                    worker.oservice.popBridgeCalls()
+                except Exception as e:
+                    logger.debug("  loading failed Exception: %s" % str(e))
+                    self._closeHandle(doc, e)
+                    raise e
+            finally:
+                if hasattr(data, 'close'):
+                    data.close()
+            with self._handles_lock:
+                self._handles[doc.handle] = doc
+        finally:
+            with self._handles_lock:
+                del self._handles[reservation]
+        logger.debug('Opened document handle %s' % doc.handle)
+        return {'handle': doc.handle, 'timeout': self.handle_timeout}
+
+    def close_document(self, handle=False, username=None, password=None):
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        doc = self._getHandle(handle)
+        with doc.lock:
+            self._closeHandle(doc)
+        return True
+
+    def _getHandle(self, handle):
+        with self._handles_lock:
+            doc = handle and self._handles.get(handle)
+        if not doc:
+            raise NoidentException('Wrong or no handle.')
+        return doc
+
+    def _closeHandle(self, doc, error=None):
+        """
+        Closes document of handle and returns its worker to the pool.
+        Caller holds the handle lock.
+        """
+        if doc.closed:
+            return
+        doc.closed = True
+        with self._handles_lock:
+            self._handles.pop(doc.handle, None)
+        worker = doc.worker
+        try:
+            if worker.oservice is not None:
+                worker.oservice.closeDocument()
+                worker.oservice.popTimings()
+                worker.oservice.popBridgeCalls()
+        except Exception:
+            error = error or True
+        # connection is lost, office is probed until it is back
+        self.pool.release(worker, failed=isinstance(error, DocumentConversionException)
+                                         or error is True)
+
+    def _closeIdleHandles(self):
+        logger = logging.getLogger('main')
+        while True:
+            sleep(1)
+            deadline = time() - self.handle_timeout
+            with self._handles_lock:
+                idle = [doc for doc in self._handles.values()
+                        if doc is not None and doc.touched < deadline]
+            for doc in idle:
+                # skip handles in use, they are touched when done
+                if doc.lock.acquire(blocking=False):
+                    try:
+                        if doc.touched < deadline:
+                            logger.debug('Closing idle document handle %s'
+                                         % doc.handle)
+                            self._closeHandle(doc)
+                    finally:
+                        doc.lock.release()
+
+    def convert_batch(self, items, username=None, password=None, spool_result=False,
+                      update=None):
+        """
+        Converts list of documents, each given as dictionary with data or
+        identifier, in_mime and out_mime, on all office workers at once.
+        Returns list of results in the same order, each with either data (or
+        identifier and size when spool_result is set) or error.
+        """
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        timer = self.metrics.timer('convert_batch')
+        budget = MemoryBudget(self.batch_memory)
+        def convert_item(item):
+            if not isinstance(item, dict):
+                return {'error': 'Item has to be a dictionary.'}
+            data = item.get('data', False)
+            identifier = item.get('identifier', False)
+            try:
+                if data is not False:
+                    if not isinstance(data, str):
+                        raise NodataException('Data has to be base64 string.')
+                    size = len(data) * 3 // 4
+                else:
+                    if isinstance(identifier, bool) \
+                            or not isinstance(identifier, (str, int)):
+                        raise NoidentException('Wrong or no identifier.')
+                    size = self.spool.size(identifier)
+                with budget.reserve(size):
+                    item_timer = self.metrics.timer('convert_batch',
+                                                    item.get('in_mime'),
+                                                    item.get('out_mime'))
+                    result = self._convert(data, identifier,
+                                           item.get('in_mime', False),
+                                           item.get('out_mime', False),
+                                           item_timer, spool_result, update)
+                    if not spool_result:
+                        result = {'data': base64.b64encode(result).decode('utf8')}
+                        item_timer.lap('encode')
+                    item_timer.finish()
+                    return result
+            except Exception as e:
+                return {'error': str(e)}
+        with ThreadPoolExecutor(max_workers=len(self.pool.workers),
+                                thread_name_prefix='Batch') as executor:
+            results = list(executor.map(convert_item, items))
+        timer.finish()
+        return results
+
+    def submit_convert(self, data=False, identifier=False, in_mime=False, out_mime=False,
+                       username=None, password=None, update=None, priority=0):
+        """
+        Queues conversion and returns its job id right away. Result is
+        spooled, to be fetched with fetch_result once job_status says done.
+        """
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        timer = self.metrics.timer('submit_convert', in_mime, out_mime)
+        def run():
+            timer.lap('queue')
+            result = self._convert(data, identifier, in_mime, out_mime, timer,
+                                   True, update)
+            timer.finish()
+            return result
+        return self._submit(priority, run)
+
+    def submit_join(self, idents, in_mime=False, out_mime=False, username=None,
+                    password=None, batch_size=False, update=None, priority=10):
+        """
+        Queues join and returns its job id right away. Joins have lower
+        priority than conversions by default, so that big joins do not hold
+        back interactive conversions.
+        """
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        timer = self.metrics.timer('submit_join', in_mime, out_mime)
+        def run():
+            timer.lap('queue')
+            result = self._joinAll(idents, in_mime, out_mime, timer, True,
+                                   batch_size, update)
+            timer.finish()
+            return result
+        return self._submit(priority, run)
+
+    def _submit(self, priority, func):
+        job = self.jobs.submit(int(priority), func)
+        if job is None:
+            raise OfficeBusy('Job queue is full.')
+        logging.getLogger('main').debug('Submitted job %s' % job.job_id)
+        return {'job': job.job_id}
+
+    def job_status(self, job=False, username=None, password=None):
+        """
+        Returns status of job: queued, running, done (with identifier and
+        size of spooled result) or failed (with error).
+        """
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        return self._getJob(job).info()
+
+    def fetch_result(self, job=False, offset=0, size=DOWNLOAD_CHUNK, username=None,
+                     password=None):
+        """
+        Returns next chunk of finished job result, same as download.
+        """
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        job = self._getJob(job)
+        if job.status != 'done':
+            raise NodataException('Job is %s.' % job.status)
+        return self.download(job.result['identifier'], offset, size,
+                             username, password)
+
+    def _forgetJob(self, job):
+        if job.status == 'done':
+            self.spool.remove(job.result['identifier'])
+
+    def _getJob(self, job_id):
+        job = job_id and self.jobs.get(job_id)
+        if not job:
+            raise NoidentException('Wrong or no job.')
+        return job
+
+    def cache_stats(self, username=None, password=None):
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        return self.cache.stats()
+
+    def stats(self, username=None, password=None):
+        """
+        Returns histograms of request stage durations.
+        """
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        return self.metrics.stats()
+
+    def prometheus(self):
+        """
+        Returns request stage histograms, cache, office pool, job queue and
+        spool counters in Prometheus text format.
+        """
+        counters = dict(('cache_%s' % name, value)
+                        for name, value in self.cache.stats().items())
+        for name, value in self.pool.stats().items():
+            counters['office_%s' % name] = value
+        for status, value in self.jobs.stats().items():
+            counters['jobs_%s' % status] = value
+        for name, value in self.spool.stats().items():
+            counters['spool_%s' % name] = value
+        return self.metrics.prometheus(counters)
+
+    def _saveResult(self, oservice, filter_name, update=None):
+        """
+        Stores document from office straight into spool file, to be fetched
+        with download.
+        """
+        identifier, outfile = self.spool.create()
+        try:
+            with outfile:
+                oservice.saveToFile(outfile, filter_name=filter_name, update=update)
+                size = outfile.seek(0, 2)
+        except Exception:
+            self.spool.remove(identifier)
+            raise
+        self.spool.update(identifier, size)
+        return {'identifier': identifier, 'size': size}
 
-    def _md5(self, data):
-        return md5(data.encode()).hexdigest()
+    def _storeResult(self, oservice, filter_name, update=None):
+        """
+        Has office store document straight into new spool file.
+        """
+        identifier, outfile = self.spool.create()
+        outfile.close()
+        fname = self.spool.filename(identifier)
+        try:
+            oservice.saveToPath(fname, filter_name=filter_name, update=update)
+        except Exception:
+            self.spool.remove(identifier)
+            raise
+        size = os.path.getsize(fname)
+        self.spool.update(identifier, size)
+        return {'identifier': identifier, 'size': size}
+
+    def _spoolResult(self, data):
+        identifier, outfile = self.spool.create()
+        with outfile:
+            outfile.write(data)
+        self.spool.update(identifier, len(data))
+        return {'identifier': identifier, 'size': len(data)}
+
+    def download(self, identifier=False, offset=0, size=DOWNLOAD_CHUNK, username=None, password=None):
+        """
+        Returns next chunk of spooled conversion result, starting at offset.
+        """
+        logger = logging.getLogger('main')
+        logger.debug('Download identifier: %s offset: %s' % (identifier, offset))
+        if not self.auth(username, password):
+            raise AccessException('Access denied.')
+        if not identifier:
+            raise NoidentException('Wrong or no identifier.')
+        size = min(max(int(size), 1), DOWNLOAD_CHUNK_MAX)
+        with self._openFile(identifier) as outfile:
+            total = fstat(outfile.fileno()).st_size
+            outfile.seek(offset)
+            chunk = outfile.read(size)
+        offset += len(chunk)
+        return {'identifier': identifier,
+                'data': base64.b64encode(chunk).decode('ascii'),
+                'offset': offset,
+                'is_last': offset >= total,
+               }
         
     def upload(self, data=False, is_last=False, identifier=False, username=None, password=None):
         logger = logging.getLogger('main')
         logger.debug('Upload identifier: %s' % identifier)
         try:
-            start_time = time()
-            
             if not self.auth(username, password):
                 raise AccessException('Access denied.')
-            # NOTE:md5 conversion on file operations to prevent path injection attack
-            if identifier and not path.isfile(self.spool_path % '_'+self._md5(str(identifier))):
-                raise NoidentException('Wrong or no identifier.')
-            elif data is False:
+            if data is False:
                 raise NodataException('No data to be converted.')
-            
-            fname = ''
-            # generate random identifier
-            while not identifier:
-                new_ident = randint(1, MAXINT)
-                fname = self._md5(str(new_ident))
-                logger.debug('  assigning new identifier %s' % new_ident)
-                # check if there is any other such files
-                identifier = not path.isfile(self.spool_path % '_'+fname) \
-                             and not path.isfile(self.spool_path % fname) \
-                             and new_ident or False
-            fname = fname or self._md5(str(identifier))
-            with open(self.spool_path % '_'+fname, "a") as tmpfile:
-                tmpfile.write(data)
-            logger.debug("  chunk finished %s" % self._chktime(start_time))            
+            timer = self.metrics.timer('upload')
+            data = base64.b64decode(data)
+            timer.lap('decode')
+            identifier = self.spool.append(data, identifier)
+            if identifier is None:
+                raise NoidentException('Wrong or no identifier.')
             if is_last:
-                rename(self.spool_path % '_'+fname, self.spool_path % fname)
+                self.spool.finish(identifier)
                 logger.debug("  file finished")
+            timer.lap('write')
+            timer.finish()
             return {'identifier': identifier}
         except AccessException as e:
             raise e
@@ -175,45 +1049,227 @@ class OfficeService():
             exceptionTraceback, limit=2, file=sys.stdout)
             
     
-    def _readFile(self, ident):
-        with open(self.spool_path % self._md5(str(ident)), "r") as tmpfile:
-            data = tmpfile.read()
-        return base64.b64decode(data)
+    def _spoolPath(self, ident):
+        fname = self.spool.filename(ident)
+        if not os.path.isfile(fname):
+            raise NoidentException('Wrong or no identifier.')
+        return fname
+
+    def _openFile(self, ident):
+        try:
+            return self.spool.open(ident)
+        except FileNotFoundError:
+            raise NoidentException('Wrong or no identifier.')
     
-    def _readFiles(self, idents):
-        logger = logging.getLogger('main')
-        for ident in idents:
-            start_time = time()
-            data = self._readFile(ident)
-            logger.debug("    read next file: %s +%s" % (ident, self._chktime(start_time)))
-            yield data
+    def _prefetchFile(self, ident):
+        """
+        Loads small spool file into memory, so that office gets it in one
+        go. Bigger files are only opened and read ahead into page cache.
+        """
+        infile = self._openFile(ident)
+        size = fstat(infile.fileno()).st_size
+        if size <= self.spool_threshold:
+            with infile:
+                return infile.read()
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(infile.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+        return infile
+
+    def _readFiles(self, idents, timer):
+        if self._prefetcher is None:
+            for ident in idents:
+                timer.lap()
+                data = self._openFile(ident)
+                timer.lap('read')
+                yield data
+            return
+        # keep up to self.prefetch next files loading while office is busy
+        idents = iter(idents)
+        pending = deque()
+        try:
+            for ident in idents:
+                pending.append((ident, self._prefetcher.submit(self._prefetchFile, ident)))
+                if len(pending) <= self.prefetch:
+                    continue
+                yield self._nextPrefetched(pending, timer)
+            while pending:
+                yield self._nextPrefetched(pending, timer)
+        finally:
+            # join failed half way, close files that were opened ahead
+            for ident, future in pending:
+                future.add_done_callback(self._closePrefetched)
+
+    def _nextPrefetched(self, pending, timer):
+        timer.lap()
+        ident, future = pending.popleft()
+        data = future.result()
+        timer.lap('read')
+        return data
+
+    def _closePrefetched(self, future):
+        if not future.cancelled() and future.exception() is None \
+                and hasattr(future.result(), 'close'):
+            future.result().close()
             
         
-    def join(self, idents, in_mime=False, out_mime=False, username=None, password=None):
+    def join(self, idents, in_mime=False, out_mime=False, username=None, password=None,
+             spool_result=False, batch_size=False, update=None):
         logger = logging.getLogger('main')
         logger.debug('Join %s identifiers: %s' % (str(len(idents)),str(idents)))
         if not self.auth(username, password):
             raise AccessException('Access denied.')
-        start_time = time()
-        ident = idents.pop(0)
-        data = self._readFile(ident)
-        logger.debug("  read first file %s" % self._chktime(start_time))
-        self._conn_healthy()
-        logger.debug("  connection test ok %s" % self._chktime(start_time))
+        timer = self.metrics.timer('join', in_mime, out_mime)
+        result = self._joinAll(idents, in_mime, out_mime, timer, spool_result,
+                               batch_size, update)
+        if not spool_result:
+            result = base64.b64encode(result).decode('utf8')
+            timer.lap('encode')
+        timer.finish()
+        return result
+
+    def _joinAll(self, idents, in_mime, out_mime, timer, spool_result=False,
+                 batch_size=False, update=None):
+        """
+        Joins documents, in batches when there are too many of them.
+        PDF documents are joined without office.
+        """
+        if in_mime == 'pdf':
+            return self._joinPdf(idents, out_mime, timer, spool_result)
+        infilter = filters.get(in_mime, False) or 'writer8'
+        outfilter = filters.get(out_mime, False)
+        batch_size = batch_size or self.join_batch
+        intermediates = []
         try:
-            infilter = filters.get(in_mime, False) or 'writer8'
-            outfilter = filters.get(out_mime, False)
-            self.oservice.putDocument(data, filter_name=infilter, read_only=True)
-            logger.debug("  upload first document to office %s" % self._chktime(start_time))
-            self.oservice.appendDocuments(self._readFiles(idents), filter_name=infilter)
-            result_data = self.oservice.saveByStream(outfilter)
-        except Exception as e:
-            logger.debug("  conversion failed %s Exception: %s" % (self._chktime(start_time), str(e)))
-            self.oservice.closeDocument()
-            logger.debug("  emergency close document %s" % self._chktime(start_time))
-            raise e
-        else:
-            self.oservice.closeDocument()
-            logger.debug("  close document %s" % self._chktime(start_time))
-        logger.debug("  join finished %s" % self._chktime(start_time))
-        return base64.b64encode(result_data).decode('utf8')
+            if batch_size and len(idents) > batch_size:
+                idents = intermediates = self._joinBatches(idents, in_mime,
+                                                           batch_size)
+                timer.lap('batches')
+                infilter = 'writer8'
+            result = self._join(idents, infilter, outfilter, timer, spool_result,
+                                update)
+        finally:
+            for ident in intermediates:
+                self.spool.remove(ident)
+        return result
+
+    def _join(self, idents, infilter, outfilter, timer, spool_result=False,
+              update=None):
+        """
+        Joins documents on one office worker. Returns joined document, or
+        identifier of spooled result.
+        """
+        logger = logging.getLogger('main')
+        with self.pool.worker() as oservice:
+            timer.lap('connect')
+            try:
+                if self.shared_spool:
+                    oservice.putDocumentByPath(self._spoolPath(idents[0]),
+                                               filter_name=infilter, read_only=True)
+                    parts = (self._spoolPath(ident) for ident in idents[1:])
+                else:
+                    data = self._openFile(idents[0])
+                    timer.lap('read')
+                    oservice.putDocument(data, filter_name=infilter, read_only=True)
+                    parts = self._readFiles(idents[1:], timer)
+                timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+                oservice.appendDocuments(parts, filter_name=infilter, update=update)
+                if spool_result and self.shared_spool:
+                    result = self._storeResult(oservice, outfilter, update)
+                elif spool_result:
+                    result = self._saveResult(oservice, outfilter, update)
+                else:
+                    result = oservice.saveByStream(outfilter, update=update)
+            except Exception as e:
+                logger.debug("  conversion failed Exception: %s" % str(e))
+                oservice.closeDocument()
+                logger.debug("  emergency close document")
+                raise e
+            else:
+                oservice.closeDocument()
+            finally:
+                timer.add(oservice.popTimings(), oservice.popBridgeCalls())
+        return result
+
+    def _joinPdf(self, idents, out_mime, timer, spool_result=False):
+        """
+        Joins PDF documents page by page in PDF process pool, straight from
+        spool files into new spool file.
+        """
+        if out_mime not in (False, 'pdf'):
+            raise NodataException('PDF documents can only be joined into PDF.')
+        paths = [self._spoolPath(ident) for ident in idents]
+        identifier, outfile = self.spool.create()
+        outfile.close()
+        fname = self.spool.filename(identifier)
+        try:
+            pdf_pool = self._pdf_pool
+            if pdf_pool is None:
+                merge_pdf(paths, fname)
+            else:
+                try:
+                    pdf_pool.submit(merge_pdf, paths, fname).result()
+                except BrokenProcessPool as e:
+                    # forking anew with threads and office connections
+                    # around is not safe, so PDFs get merged in thread
+                    logging.getLogger('main').warning(
+                        'PDF process pool broken, merging in thread: %s' % e)
+                    self._pdf_pool = None
+                    pdf_pool.shutdown(wait=False)
+                    merge_pdf(paths, fname)
+            timer.lap('merge')
+            size = os.path.getsize(fname)
+            self.spool.update(identifier, size)
+            if spool_result:
+                return {'identifier': identifier, 'size': size}
+            with open(fname, 'rb') as outfile:
+                return outfile.read()
+        except:
+            spool_result = False
+            raise
+        finally:
+            if not spool_result:
+                self.spool.remove(identifier)
+
+    def _joinBatches(self, idents, in_mime, batch_size):
+        """
+        Joins documents batch by batch into intermediate ODT documents, on as
+        many office workers as there are free, and repeats on intermediates
+        until at most batch_size of them are left. Every batch gets the same
+        page style and page number reset as appendDocuments applies, so the
+        final join of intermediates gives the same page breaks and numbering
+        as a sequential join. Intermediates are not updated, the final join
+        does that. Returns identifiers of intermediates.
+        """
+        infilter = filters.get(in_mime, False) or 'writer8'
+        batch_size = max(batch_size, 2)
+        previous = level = []
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.pool.workers),
+                                    thread_name_prefix='Join') as executor:
+                while len(idents) > batch_size:
+                    batches = [idents[i:i + batch_size]
+                               for i in range(0, len(idents), batch_size)]
+                    futures = [executor.submit(self._join, batch, infilter,
+                                    'writer8',
+                                    self.metrics.timer('join_batch', in_mime, 'odt'),
+                                    True, False)
+                               for batch in batches]
+                    previous, level = level, []
+                    try:
+                        for future in futures:
+                            level.append(future.result()['identifier'])
+                    finally:
+                        # wait for the rest, so nothing is left behind in spool
+                        for future in futures[len(level):]:
+                            if future.exception() is None:
+                                level.append(future.result()['identifier'])
+                    for ident in previous:
+                        self.spool.remove(ident)
+                    idents = level
+                    infilter = 'writer8'
+        except Exception:
+            # intermediates of the level that failed and of the one before
+            for ident in previous + level:
+                self.spool.remove(ident)
+            raise
+        return level
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+import logging
+import heapq
+from itertools import count
+from threading import Condition, Thread
+from time import time
+from uuid import uuid4
+
+class Job():
+    """
+    Conversion waiting in job queue, running or finished, with spooled
+    result or error message.
+    """
+    def __init__(self, priority, func, args, kwargs):
+        self.job_id = uuid4().hex
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time()
+        self.finished = None
+
+    def info(self):
+        info = {'job': self.job_id, 'status': self.status}
+        if self.status == 'done':
+            info.update(self.result)
+        elif self.status == 'failed':
+            info['error'] = self.error
+        return info
+
+class JobQueue():
+    """
+    Bounded priority queue of conversions, run in background by given
+    number of threads. Jobs with lower priority number run first, in order
+    of submission within the same priority. Finished jobs are forgotten
+    after expire seconds, and given forget function is called with each of
+    them, to remove their spooled results.
+    """
+    def __init__(self, workers=1, max_jobs=100, expire=1800, forget=None):
+        self.max_jobs = max_jobs
+        self.expire = expire
+        self.forget = forget
+        self._queue = []
+        self._jobs = {}
+        self._seq = count()
+        self._cond = Condition()
+        for i in range(workers):
+            Thread(target=self._run, name='Job %s' % i, daemon=True).start()
+
+    def submit(self, priority, func, *args, **kwargs):
+        """
+        Queues call of func, which has to return dictionary with spool
+        identifier and size of result. Returns job, or None if queue is full.
+        """
+        with self._cond:
+            self._forget_expired()
+            if self.max_jobs and len(self._queue) >= self.max_jobs:
+                return None
+            job = Job(priority, func, args, kwargs)
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._queue, (priority, next(self._seq), job))
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._cond:
+            statuses = [job.status for job in self._jobs.values()]
+        return dict((status, statuses.count(status))
+                    for status in ('queued', 'running', 'done', 'failed'))
+
+    def _forget_expired(self):
+        deadline = time() - self.expire
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished < deadline]:
+            job = self._jobs.pop(job_id)
+            if self.forget is not None:
+                self.forget(job)
+
+    def _run(self):
+        logger = logging.getLogger('main')
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                priority, seq, job = heapq.heappop(self._queue)
+                job.status = 'running'
+            logger.debug('Running job %s' % job.job_id)
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                job.status = 'done'
+            except Exception as e:
+                logger.debug('  job %s failed: %s' % (job.job_id, str(e)))
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                job.finished = time()
+                job.func = job.args = job.kwargs = None
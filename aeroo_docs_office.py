@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# Append and update logic of DocumentConverter, which can also run as Python
+# UNO script inside OpenOffice.org/LibreOffice process.
+#
+# Copyright (C) 2009 Alistek Ltd. (www.alistek.com)
+# Licensed under the GNU LGPL v2.1 - http://www.gnu.org/licenses/lgpl-2.1.html
+# - or any later version.
+#
+"""
+DocumentConverter calls these functions over the UNO bridge, where every
+property access and method call is a round-trip to office. Deployed into
+user profile of office (Scripts/python) they are invoked once per join or
+update instead, and work on the document in office process.
+
+Module has to stay self-contained, it is copied into office as it is.
+"""
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.text.ControlCharacter import APPEND_PARAGRAPH
+
+SECTIONMAXLEVEL = 10 # Just to make sure we do not go into endless loop
+
+def _toProperties(**args):
+    props = []
+    for key in args:
+        prop = PropertyValue()
+        prop.Name = key
+        prop.Value = args[key]
+        props.append(prop)
+    return tuple(props)
+
+def start_append(document):
+    """
+    Returns text, cursor and page style of the first page, to append
+    documents with.
+    """
+    # Get first document list of styles
+    stylefamilies = document.StyleFamilies
+    pagestyles = stylefamilies.getByName('PageStyles')
+    defaultpagetyle = pagestyles.getElementNames()[0]
+
+    text = document.Text
+    cursor = text.createTextCursor()
+    cursor.gotoStart(False)
+
+    # Get first page styles
+    cursor.gotoStartOfParagraph(False)
+    cursor.gotoEndOfParagraph(True)
+
+    pagestyle = cursor.PageDescName or defaultpagetyle
+    return text, cursor, pagestyle
+
+def append_document(document, text, cursor, pagestyle, url, props):
+    """
+    Inserts document from url at the end, on new page with given style.
+    """
+    cursor.gotoEnd(False)
+    cur_sect = cursor.TextSection
+    if cur_sect is not None:
+        # drilldown to bottom
+        lowersect = cur_sect
+        parent_sect = True
+        level = 0
+        while parent_sect and level < SECTIONMAXLEVEL:
+            parent_sect = lowersect.getParentSection()
+            if parent_sect:
+                lowersect = parent_sect
+                level += 1
+        # TODO Implement check if section is not anchored to page gloablly...
+        # cur_pos = ancestor.AnchorType
+        paravector = 'com.sun.star.text.Paragraph'
+        newpara = document.createInstance(paravector)
+        text.insertTextContentAfter(newpara, lowersect)
+    else:
+        text.insertControlCharacter(cursor, APPEND_PARAGRAPH, 0)
+    cursor.gotoEnd(False)
+    cursor.gotoStartOfParagraph(False)
+    cursor.gotoEndOfParagraph(True)
+    cursor.PageDescName = pagestyle
+    cursor.PageNumberOffset = 1
+    # Seemingly not needed
+    #cursor.ParaStyleName = parastyle
+    document.Text.getEnd().insertDocumentFromURL(url, props)
+
+def append_documents(document, docs, filter_name=''):
+    """
+    Script entry point. Appends documents given as file URLs, byte
+    sequences or input streams. Returns seconds every document took.
+    """
+    context = uno.getComponentContext()
+    text, cursor, pagestyle = start_append(document)
+    timings = []
+    for doc in docs:
+        start_time = time.time()
+        properties = {}
+        if filter_name:
+            properties['FilterName'] = filter_name
+        url = doc
+        if not isinstance(doc, str):
+            url = 'private:stream'
+            if isinstance(doc, uno.ByteSequence):
+                # document sent along with the call, no reading back
+                streamvector = 'com.sun.star.io.SequenceInputStream'
+                data, doc = doc, context.ServiceManager.createInstanceWithContext(
+                                                        streamvector, context)
+                doc.initialize((data,))
+            properties['InputStream'] = doc
+        append_document(document, text, cursor, pagestyle, url,
+                        _toProperties(**properties))
+        timings.append(time.time() - start_time)
+    return tuple(timings)
+
+def document_contents(document):
+    """
+    Finds out what update of the document would refresh.
+    Returns whether document has linked content, whether it has fields
+    and its indexes (or None).
+    """
+    try:
+        sections = document.getTextSections()
+    except AttributeError:
+        # spreadsheets keep their links in separate containers
+        links = False
+        for name in ('AreaLinks', 'DDELinks', 'SheetLinks'):
+            container = getattr(document, name, None)
+            if container is not None and container.getCount():
+                links = True
+        return links, False, None
+    links = False
+    for name in sections.getElementNames():
+        if sections.getByName(name).FileLink.FileURL:
+            links = True
+            break
+    fields = document.getTextFields().createEnumeration().hasMoreElements()
+    indexes = document.getDocumentIndexes()
+    if not indexes.getCount():
+        indexes = None
+    return links, fields, indexes
+
+def update_document(document, everything=False):
+    """
+    Script entry point. Updates links, fields and indexes the document
+    has, or all of them.
+    """
+    if everything:
+        links = fields = True
+        indexes = None
+    else:
+        links, fields, indexes = document_contents(document)
+    if links:
+        try:
+            document.updateLinks()
+        except AttributeError:
+            # if document doesn't support XLinkUpdate interface
+            pass
+    if fields:
+        try:
+            document.refresh()
+            indexes = document.getDocumentIndexes()
+        except AttributeError:
+            # ods document does not support refresh
+            pass
+    if indexes is not None:
+        for inc in range(0, indexes.getCount()):
+            indexes.getByIndex(inc).update()
+
+g_exportedScripts = (append_documents, update_document)
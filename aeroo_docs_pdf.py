@@ -0,0 +1,691 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+"""
+Joins PDF documents page by page without office. Input files are mapped
+into memory and only objects reachable from their pages are parsed. They
+are written to output as soon as they are copied, so only their offsets
+are kept for the cross-reference table at the end. Objects with the same
+content, like fonts and images every invoice embeds, are written once.
+"""
+import re
+import zlib
+import mmap
+from hashlib import sha1
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+
+re_space = re.compile(rb'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*')
+re_name = re.compile(rb'/([^\x00\t\n\x0c\r ()<>\[\]{}/%]*)')
+re_number = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+re_reference = re.compile(rb'[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+re_keyword = re.compile(rb'[A-Za-z_\'"*]+')
+re_hexstring = re.compile(rb'<[^>]*>')
+re_object = re.compile(rb'(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+re_startxref = re.compile(rb'startxref[\x00\t\n\x0c\r ]+(\d+)')
+re_xref_section = re.compile(rb'(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]*[\r\n]')
+re_object_scan = re.compile(rb'(?<![0-9])(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj(?![A-Za-z])')
+
+# attributes page inherits from its ancestors in page tree
+INHERITED = (b'Resources', b'MediaBox', b'CropBox', b'Rotate')
+
+class PdfError(Exception):
+    pass
+
+class Name(bytes):
+    """
+    Name as written in file, without the slash.
+    """
+
+class Literal(bytes):
+    """
+    String, real number or other token copied as it is written in file.
+    """
+
+class Ref():
+    __slots__ = ('num', 'gen')
+
+    def __init__(self, num, gen=0):
+        self.num = num
+        self.gen = gen
+
+class Stream(dict):
+    """
+    Stream dictionary with its still encoded data.
+    """
+    def __init__(self, attributes, data):
+        super(Stream, self).__init__(attributes)
+        self.data = data
+
+def serialize(value):
+    if isinstance(value, Name):
+        return b'/' + value
+    if isinstance(value, (Literal, bytes)):
+        return bytes(value)
+    if value is True:
+        return b'true'
+    if value is False:
+        return b'false'
+    if value is None:
+        return b'null'
+    if isinstance(value, int):
+        return b'%d' % value
+    if isinstance(value, Ref):
+        return b'%d %d R' % (value.num, value.gen)
+    if isinstance(value, list):
+        return b'[' + b' '.join(serialize(item) for item in value) + b']'
+    if isinstance(value, Stream):
+        attributes = dict(value)
+        attributes[Name(b'Length')] = len(value.data)
+        return serialize(attributes) + b'\nstream\n' + value.data + b'\nendstream'
+    if isinstance(value, dict):
+        return b'<<' + b''.join(b'/' + key + b' ' + serialize(item)
+                                for key, item in value.items()) + b'>>'
+    raise PdfError('Can not write %r.' % value)
+
+def _unpredict(data, params):
+    """
+    Reverses PNG predictors used by cross-reference and object streams.
+    """
+    predictor = params.get(b'Predictor', 1)
+    if predictor < 10:
+        if predictor != 1:
+            raise PdfError('Unsupported predictor %s.' % predictor)
+        return data
+    columns = params.get(b'Columns', 1) * params.get(b'Colors', 1) \
+              * params.get(b'BitsPerComponent', 8) // 8
+    bpp = max(params.get(b'Colors', 1) * params.get(b'BitsPerComponent', 8) // 8, 1)
+    output = bytearray()
+    previous = bytearray(columns)
+    for start in range(0, len(data), columns + 1):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + 1 + columns])
+        row.extend(bytes(columns - len(row)))
+        for i in range(columns):
+            left = row[i - bpp] if i >= bpp else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xff
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xff
+            elif kind == 4:
+                upleft = previous[i - bpp] if i >= bpp else 0
+                p = left + up - upleft
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - upleft)
+                if pa <= pb and pa <= pc:
+                    row[i] = (row[i] + left) & 0xff
+                elif pb <= pc:
+                    row[i] = (row[i] + up) & 0xff
+                else:
+                    row[i] = (row[i] + upleft) & 0xff
+        output.extend(row)
+        previous = row
+    return bytes(output)
+
+class PdfReader():
+    """
+    Reads objects of PDF file through its cross-reference table, which is
+    rebuilt by scanning the file when it is broken.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise PdfError('Empty file.')
+        if self.data.find(b'%PDF-', 0, 1024) < 0:
+            self.close()
+            raise PdfError('Not a PDF file.')
+        self.xref = {} # object number: offset, or (object stream, index)
+        self.trailer = {}
+        self._object_streams = {}
+        try:
+            self._read_xref()
+            self._check_xref()
+        except (PdfError, ValueError, IndexError, KeyError, TypeError, zlib.error):
+            self.xref = {}
+            self.trailer = {}
+            self._scan_objects()
+        if b'Encrypt' in self.trailer:
+            self.close()
+            raise PdfError('Encrypted PDF is not supported.')
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # parsing
+
+    def _skip(self, pos):
+        return re_space.match(self.data, pos).end()
+
+    def parse(self, pos):
+        """
+        Parses value at pos. Returns value and position after it.
+        """
+        data = self.data
+        pos = self._skip(pos)
+        char = data[pos:pos + 1]
+        if char == b'/':
+            match = re_name.match(data, pos)
+            return Name(match.group(1)), match.end()
+        if char == b'<':
+            if data[pos + 1:pos + 2] == b'<':
+                return self._parse_dict(pos + 2)
+            match = re_hexstring.match(data, pos)
+            return Literal(match.group(0)), match.end()
+        if char == b'[':
+            items = []
+            pos += 1
+            while True:
+                pos = self._skip(pos)
+                if data[pos:pos + 1] == b']':
+                    return items, pos + 1
+                if pos >= len(data):
+                    raise PdfError('Unterminated array.')
+                item, pos = self.parse(pos)
+                items.append(item)
+        if char == b'(':
+            return self._parse_string(pos)
+        match = re_number.match(data, pos)
+        if match:
+            token = match.group(0)
+            if token.isdigit():
+                reference = re_reference.match(data, match.end())
+                if reference:
+                    return Ref(int(token), int(reference.group(1))), reference.end()
+                return int(token), match.end()
+            return Literal(token), match.end()
+        match = re_keyword.match(data, pos)
+        if match:
+            keyword = match.group(0)
+            if keyword == b'true':
+                return True, match.end()
+            if keyword == b'false':
+                return False, match.end()
+            if keyword == b'null':
+                return None, match.end()
+            return Literal(keyword), match.end()
+        raise PdfError('Unexpected %r at %s.' % (data[pos:pos + 10], pos))
+
+    def _parse_dict(self, pos):
+        data = self.data
+        attributes = {}
+        while True:
+            pos = self._skip(pos)
+            if data[pos:pos + 2] == b'>>':
+                return attributes, pos + 2
+            match = re_name.match(data, pos)
+            if not match:
+                raise PdfError('Dictionary key expected at %s.' % pos)
+            value, pos = self.parse(match.end())
+            attributes[Name(match.group(1))] = value
+
+    def _parse_string(self, pos):
+        data = self.data
+        depth = 0
+        end = pos
+        length = len(data)
+        while end < length:
+            char = data[end]
+            if char == 0x5c: # backslash escapes next character
+                end += 2
+                continue
+            if char == 0x28:
+                depth += 1
+            elif char == 0x29:
+                depth -= 1
+                if not depth:
+                    return Literal(data[pos:end + 1]), end + 1
+            end += 1
+        raise PdfError('Unterminated string at %s.' % pos)
+
+    def _parse_object(self, pos):
+        """
+        Parses indirect object at pos, with stream data if it has one.
+        """
+        match = re_object.match(self.data, self._skip(pos))
+        if not match:
+            raise PdfError('Object expected at %s.' % pos)
+        value, pos = self.parse(match.end())
+        pos = self._skip(pos)
+        if isinstance(value, dict) and self.data[pos:pos + 6] == b'stream':
+            value = Stream(value, self._stream_data(value, pos + 6))
+        return value
+
+    def _stream_data(self, attributes, pos):
+        data = self.data
+        if data[pos:pos + 2] == b'\r\n':
+            pos += 2
+        elif data[pos:pos + 1] in (b'\n', b'\r'):
+            pos += 1
+        length = attributes.get(b'Length')
+        if isinstance(length, Ref):
+            length = self.get(length.num)
+        if isinstance(length, int):
+            end = pos + length
+            if data[self._skip(end):self._skip(end) + 9] == b'endstream':
+                return data[pos:end]
+        # wrong length, stream ends before endstream keyword
+        end = data.find(b'endstream', pos)
+        if end < 0:
+            raise PdfError('Unterminated stream at %s.' % pos)
+        if data[end - 2:end] == b'\r\n':
+            end -= 2
+        elif data[end - 1:end] in (b'\n', b'\r'):
+            end -= 1
+        return data[pos:end]
+
+    def decode(self, stream):
+        filters = stream.get(b'Filter', [])
+        params = stream.get(b'DecodeParms', {})
+        if not isinstance(filters, list):
+            filters, params = [filters], [params]
+        elif not isinstance(params, list):
+            params = [params] * len(filters)
+        data = stream.data
+        for name, param in zip(filters, params or [{}] * len(filters)):
+            if name != b'FlateDecode':
+                raise PdfError('Unsupported filter %s.' % name.decode('latin-1'))
+            data = _unpredict(zlib.decompress(data), param or {})
+        return data
+
+    # cross-reference
+
+    def _read_xref(self):
+        match = None
+        for match in re_startxref.finditer(self.data, max(len(self.data) - 4096, 0)):
+            pass
+        if match is None:
+            raise PdfError('No startxref.')
+        pos = int(match.group(1))
+        seen = set()
+        while pos is not None and pos not in seen:
+            seen.add(pos)
+            pos = self._read_xref_section(pos)
+        if b'Root' not in self.trailer:
+            raise PdfError('No document catalog.')
+
+    def _check_xref(self):
+        """
+        Offsets of table can be wrong while table itself reads fine, every
+        one has to point at its object.
+        """
+        for num, location in self.xref.items():
+            if not isinstance(location, int):
+                continue
+            match = re_object.match(self.data, self._skip(location))
+            if not match or int(match.group(1)) != num:
+                raise PdfError('Object %s is not at its offset.' % num)
+
+    def _read_xref_section(self, pos):
+        """
+        Reads cross-reference table or stream at pos. Entries read before
+        are newer and win. Returns position of previous section, if any.
+        """
+        pos = self._skip(pos)
+        if self.data[pos:pos + 4] == b'xref':
+            pos += 4
+            while True:
+                pos = self._skip(pos)
+                if self.data[pos:pos + 7] == b'trailer':
+                    break
+                match = re_xref_section.match(self.data, pos)
+                if not match:
+                    raise PdfError('Broken cross-reference table.')
+                start, count = int(match.group(1)), int(match.group(2))
+                pos = match.end()
+                for num in range(start, start + count):
+                    pos = self._skip(pos)
+                    entry = self.data[pos:pos + 18].split()
+                    if entry[2] == b'n' and num not in self.xref:
+                        self.xref[num] = int(entry[0])
+                    elif num not in self.xref:
+                        self.xref[num] = None
+                    pos += 18
+            trailer, pos = self.parse(pos + 7)
+            if isinstance(trailer.get(b'XRefStm'), int):
+                self._read_xref_section(trailer[b'XRefStm'])
+        else:
+            trailer = self._parse_object(pos)
+            if not isinstance(trailer, Stream) or trailer.get(b'Type') != b'XRef':
+                raise PdfError('Broken cross-reference stream.')
+            self._read_xref_stream(trailer)
+        for key, value in trailer.items():
+            self.trailer.setdefault(key, value)
+        return trailer.get(b'Prev')
+
+    def _read_xref_stream(self, stream):
+        widths = stream[b'W']
+        index = stream.get(b'Index', [0, stream[b'Size']])
+        data = self.decode(stream)
+        entry_size = sum(widths)
+        pos = 0
+        for i in range(0, len(index), 2):
+            for num in range(index[i], index[i] + index[i + 1]):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[pos:pos + width], 'big'))
+                    pos += width
+                kind = fields[0] if widths[0] else 1
+                if num in self.xref:
+                    continue
+                if kind == 1:
+                    self.xref[num] = fields[1]
+                elif kind == 2:
+                    self.xref[num] = (fields[1], fields[2])
+                else:
+                    self.xref[num] = None
+            if pos > len(data):
+                raise PdfError('Short cross-reference stream.')
+
+    def _scan_objects(self):
+        for match in re_object_scan.finditer(self.data):
+            # later definitions win, as with incremental updates
+            self.xref[int(match.group(1))] = match.start()
+        for num in list(self.xref):
+            if self.data.find(b'/ObjStm', self.xref[num], self.xref[num] + 256) < 0:
+                continue
+            try:
+                stream = self._parse_object(self.xref[num])
+                if stream.get(b'Type') != b'ObjStm':
+                    continue
+                numbers = self.decode(stream)[:stream[b'First']].split()
+            except (PdfError, ValueError, KeyError, AttributeError, zlib.error):
+                continue
+            for index, i in enumerate(range(0, len(numbers) - 1, 2)):
+                self.xref.setdefault(int(numbers[i]), (num, index))
+        match = None
+        for match in re.finditer(rb'trailer', self.data):
+            pass
+        if match is not None:
+            try:
+                trailer = self.parse(match.end())[0]
+                self.trailer.update(trailer)
+            except PdfError:
+                pass
+        if b'Root' not in self.trailer:
+            for num in list(self.xref):
+                try:
+                    value = self.get(num)
+                except PdfError:
+                    continue
+                if isinstance(value, dict) and value.get(b'Type') == b'Catalog':
+                    self.trailer[Name(b'Root')] = Ref(num)
+                    break
+        if b'Root' not in self.trailer:
+            raise PdfError('No document catalog.')
+
+    # objects
+
+    def get(self, num):
+        location = self.xref.get(num)
+        if location is None:
+            return None
+        if isinstance(location, int):
+            return self._parse_object(location)
+        stream_num, index = location
+        objects = self._object_streams.get(stream_num)
+        if objects is None:
+            objects = self._object_streams[stream_num] = self._read_object_stream(stream_num)
+        return objects.get(num)
+
+    def _read_object_stream(self, num):
+        stream = self._parse_object(self.xref[num])
+        data = self.decode(stream)
+        reader = _BytesReader(data)
+        numbers = data[:stream[b'First']].split()
+        objects = {}
+        for i in range(0, len(numbers) - 1, 2):
+            objects[int(numbers[i])] = reader.parse(stream[b'First'] + int(numbers[i + 1]))[0]
+        return objects
+
+    def resolve(self, value):
+        seen = 0
+        while isinstance(value, Ref) and seen < 32:
+            value = self.get(value.num)
+            seen += 1
+        return value
+
+    def pages(self):
+        """
+        Returns object numbers of pages, each with attributes it inherits
+        from page tree, and object numbers of page tree nodes.
+        """
+        pages = []
+        nodes = set()
+        root = self.resolve(self.trailer[b'Root'])
+        top = root.get(b'Pages')
+        stack = [(top, {})]
+        while stack:
+            ref, inherited = stack.pop()
+            if not isinstance(ref, Ref) or ref.num in nodes:
+                continue
+            node = self.get(ref.num)
+            if not isinstance(node, dict):
+                continue
+            inherited = dict(inherited)
+            for key in INHERITED:
+                if key in node:
+                    inherited[key] = node[key]
+            kids = node.get(b'Kids')
+            if node.get(b'Type') == b'Page' or kids is None:
+                pages.append((ref.num, inherited))
+                continue
+            nodes.add(ref.num)
+            kids = self.resolve(kids) or []
+            stack.extend((kid, inherited) for kid in reversed(kids))
+        return pages, nodes
+
+class _BytesReader(PdfReader):
+    """
+    Parses values out of decoded object stream.
+    """
+    def __init__(self, data):
+        self.data = data
+
+class PdfWriter():
+    """
+    Writes pages of PDF documents into file object, one after another.
+    """
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.offsets = [None] # by object number
+        self.pos = 0
+        self.kids = []
+        self._written = {} # object number by digest of its content
+        self._write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self.pages_ref = Ref(self._reserve())
+
+    def _write(self, data):
+        self.outfile.write(data)
+        self.pos += len(data)
+
+    def _reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def _write_object(self, num, data):
+        self.offsets[num] = self.pos
+        self._write(b'%d 0 obj\n' % num + data + b'\nendobj\n')
+
+    def add_document(self, reader):
+        pages, nodes = reader.pages()
+        copied = {} # input object number: output object number
+        for num in nodes:
+            copied[num] = self.pages_ref.num
+        for num, inherited in pages:
+            copied[num] = self._reserve()
+        for num, inherited in pages:
+            page = reader.get(num)
+            attributes = dict(inherited)
+            attributes.update((key, value) for key, value in page.items()
+                              if key != b'Parent')
+            attributes[Name(b'Type')] = Name(b'Page')
+            # page is on the path, references back to it are kept
+            path = {num: copied[num]}
+            value = self._copy_value(reader, attributes, copied, path)
+            value[Name(b'Parent')] = self.pages_ref
+            self._write_object(copied[num], serialize(value))
+            self.kids.append(Ref(copied[num]))
+        return len(pages)
+
+    def _copy(self, reader, num, copied, path):
+        """
+        Writes input object with all objects it references. Returns its
+        output object number. Referenced objects are walked with explicit
+        stack, chains like /Parent or /Next can be longer than recursion
+        limit.
+        """
+        first = num
+        stack = [[num, False, None]] # number, whether read, value
+        while stack:
+            entry = stack[-1]
+            num, read, value = entry
+            if not read:
+                if num in copied:
+                    stack.pop()
+                    continue
+                if num in path:
+                    # reference cycle, number has to be known before object
+                    # is written
+                    if path[num] is None:
+                        path[num] = self._reserve()
+                    stack.pop()
+                    continue
+                path[num] = None
+                entry[1:] = True, reader.get(num)
+                # referenced objects are written first, in order
+                stack.extend([ref, False, None] for ref
+                             in reversed(self._references(reader, entry[2])))
+                continue
+            stack.pop()
+            # references are all copied or reserved, this does not go deeper
+            value = self._copy_value(reader, value, copied, path)
+            out = path.pop(num)
+            data = serialize(value)
+            if out is None:
+                digest = sha1(data).digest()
+                out = self._written.get(digest)
+                if out is None:
+                    out = self._written[digest] = self._reserve()
+                    self._write_object(out, data)
+            else:
+                self._write_object(out, data)
+            copied[num] = out
+        if first in copied:
+            return copied[first]
+        return path[first]
+
+    def _references(self, reader, value):
+        """
+        Returns numbers of existing objects value references, in order.
+        """
+        refs = []
+        values = [value]
+        while values:
+            value = values.pop()
+            if isinstance(value, Ref):
+                if reader.xref.get(value.num) is not None:
+                    refs.append(value.num)
+            elif isinstance(value, list):
+                values.extend(reversed(value))
+            elif isinstance(value, dict):
+                values.extend(reversed([item for key, item in value.items()
+                                        if not isinstance(value, Stream)
+                                           or key != b'Length']))
+        return refs
+
+    def _copy_value(self, reader, value, copied, path):
+        if isinstance(value, Ref):
+            if reader.xref.get(value.num) is None:
+                return None
+            return Ref(self._copy(reader, value.num, copied, path))
+        if isinstance(value, list):
+            return [self._copy_value(reader, item, copied, path) for item in value]
+        if isinstance(value, Stream):
+            # length is written anew, it may reference separate object
+            return Stream(dict((key, self._copy_value(reader, item, copied, path))
+                               for key, item in value.items() if key != b'Length'),
+                          value.data)
+        if isinstance(value, dict):
+            return dict((key, self._copy_value(reader, item, copied, path))
+                        for key, item in value.items())
+        return value
+
+    def close(self):
+        """
+        Writes page tree, catalog and cross-reference table.
+        """
+        self._write_object(self.pages_ref.num, serialize({
+            Name(b'Type'): Name(b'Pages'),
+            Name(b'Kids'): self.kids,
+            Name(b'Count'): len(self.kids)}))
+        catalog = self._reserve()
+        self._write_object(catalog, serialize({
+            Name(b'Type'): Name(b'Catalog'),
+            Name(b'Pages'): self.pages_ref}))
+        xref = self.pos
+        lines = [b'xref\n0 %d\n' % len(self.offsets), b'0000000000 65535 f\r\n']
+        for offset in self.offsets[1:]:
+            lines.append(b'%010d 00000 n\r\n' % (offset or 0))
+        self._write(b''.join(lines))
+        self._write(b'trailer\n' + serialize({
+            Name(b'Size'): len(self.offsets),
+            Name(b'Root'): Ref(catalog)}) + b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+def merge(paths, output):
+    """
+    Joins PDF files into output file. Returns number of pages.
+    """
+    with open(output, 'wb') as outfile:
+        writer = PdfWriter(outfile)
+        count = 0
+        for index, path in enumerate(paths):
+            try:
+                with PdfReader(path) as reader:
+                    count += writer.add_document(reader)
+            except RecursionError:
+                raise PdfError('Document %s: objects are nested too deep.'
+                               % (index + 1))
+            except (PdfError, ValueError, IndexError, KeyError, TypeError,
+                    AttributeError, zlib.error) as e:
+                raise PdfError('Document %s: %s' % (index + 1, e))
+        writer.close()
+    return count
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+import logging
+import heapq
+from hashlib import md5
+from random import randint
+from os import path, rename, unlink, scandir, open as os_open, fdopen, \
+               O_WRONLY, O_CREAT, O_EXCL
+from threading import Lock
+from time import time
+
+MAXINT = 9223372036854775807
+
+class UploadSession():
+    """
+    Upload in progress, with its partial file kept open for appending.
+    """
+    def __init__(self, identifier, fname, tmpfile, size=0):
+        self.identifier = identifier
+        self.fname = fname
+        self.tmpfile = tmpfile
+        self.size = size
+        self.touched = time()
+        self.lock = Lock()
+
+class Spool():
+    """
+    Spool directory for uploaded documents and conversion results. Files
+    hold decoded document bytes and are named by md5 of their identifier.
+    Uploads in progress are written to the same name prefixed with '_' and
+    are tracked in memory, so appending a chunk needs no file system probes.
+    Files are indexed by last write time in a heap, so that expiring them
+    only touches files which are due.
+    """
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        self.spool_path = spool_dir + '/%s'
+        self._uploads = {}
+        self._lock = Lock()
+        self._files = {} # file name: [last write time, size]
+        self._expiry = [] # heap of (last write time, file name)
+        self._index_lock = Lock()
+        self.expired_files = 0
+        self.expired_bytes = 0
+
+    def filename(self, identifier, partial=False):
+        # NOTE:md5 conversion on file operations to prevent path injection attack
+        fname = md5(str(identifier).encode()).hexdigest()
+        return self.spool_path % (partial and '_' + fname or fname)
+
+    def create(self, partial=False):
+        """
+        Generates random identifier and creates its spool file, exclusively,
+        so that two requests never get the same identifier.
+        Returns identifier and the file opened for binary writing.
+        """
+        logger = logging.getLogger('main')
+        while True:
+            identifier = randint(1, MAXINT)
+            try:
+                fd = os_open(self.filename(identifier, partial),
+                             O_WRONLY | O_CREAT | O_EXCL, 0o0600)
+            except FileExistsError:
+                continue
+            logger.debug('  assigning new identifier %s' % identifier)
+            self._track(self.filename(identifier, partial))
+            return identifier, fdopen(fd, 'wb')
+
+    def update(self, identifier, size):
+        """
+        Records size of spool file written by caller of create.
+        """
+        self._track(self.filename(identifier), size)
+
+    def append(self, data, identifier=False):
+        """
+        Appends decoded chunk to upload, starting new upload when no
+        identifier is given. Returns identifier, or None if there is no
+        such upload in progress.
+        """
+        if not identifier:
+            identifier, tmpfile = self.create(partial=True)
+            session = UploadSession(identifier, self.filename(identifier),
+                                    tmpfile)
+            with self._lock:
+                self._uploads[str(identifier)] = session
+        else:
+            session = self._session(identifier)
+            if session is None:
+                return None
+        with session.lock:
+            session.tmpfile.write(data)
+            session.size += len(data)
+            session.touched = time()
+            self._touch(self.filename(session.identifier, partial=True),
+                        session.size)
+        return session.identifier
+
+    def finish(self, identifier):
+        """
+        Completes upload, after which it can be opened for reading.
+        """
+        with self._lock:
+            session = self._uploads.pop(str(identifier), None)
+        if session is None:
+            return False
+        with session.lock:
+            session.tmpfile.close()
+            rename(self.filename(identifier, partial=True), session.fname)
+            self._untrack(self.filename(identifier, partial=True))
+            self._track(session.fname, session.size)
+        return True
+
+    def open(self, identifier):
+        """
+        Opens completed spool file for binary reading.
+        Raises FileNotFoundError for unknown identifier.
+        """
+        return open(self.filename(identifier), 'rb')
+
+    def size(self, identifier):
+        """
+        Returns size of completed spool file, 0 if there is no such file.
+        """
+        try:
+            return path.getsize(self.filename(identifier))
+        except OSError:
+            return 0
+
+    def remove(self, identifier):
+        fname = self.filename(identifier)
+        self._untrack(fname)
+        try:
+            unlink(fname)
+        except FileNotFoundError:
+            pass
+
+    def scan(self):
+        """
+        Indexes files left in spool directory by previous run of the
+        service. Returns number of files found.
+        """
+        found = 0
+        with scandir(self.spool_dir) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    attribs = entry.stat()
+                except FileNotFoundError:
+                    continue
+                with self._index_lock:
+                    if entry.path in self._files:
+                        continue
+                    self._files[entry.path] = [attribs.st_mtime, attribs.st_size]
+                    heapq.heappush(self._expiry, (attribs.st_mtime, entry.path))
+                found += 1
+        return found
+
+    def expire(self, expire):
+        """
+        Removes files not written to for expire seconds. Returns number of
+        removed files.
+        """
+        logger = logging.getLogger('main')
+        deadline = time() - expire
+        due = []
+        with self._index_lock:
+            while self._expiry and self._expiry[0][0] < deadline:
+                written, fname = heapq.heappop(self._expiry)
+                entry = self._files.get(fname)
+                if entry is None:
+                    # removed before it expired
+                    continue
+                if entry[0] > written:
+                    # written to since it was indexed, check again later
+                    heapq.heappush(self._expiry, (entry[0], fname))
+                    continue
+                del self._files[fname]
+                due.append((fname, entry[1]))
+        removed = 0
+        for fname, size in due:
+            try:
+                unlink(fname)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning('Can not remove expired spool file %s: %s'
+                               % (fname, e))
+                continue
+            self.expired_files += 1
+            self.expired_bytes += size
+            removed += 1
+        return removed
+
+    def stats(self):
+        with self._index_lock:
+            sizes = [entry[1] for entry in self._files.values()]
+        return {'files': len(sizes),
+                'bytes': sum(sizes),
+                'expired_files': self.expired_files,
+                'expired_bytes': self.expired_bytes,
+               }
+
+    def _track(self, fname, size=0):
+        now = time()
+        with self._index_lock:
+            self._files[fname] = [now, size]
+            heapq.heappush(self._expiry, (now, fname))
+
+    def _touch(self, fname, size):
+        now = time()
+        with self._index_lock:
+            if fname not in self._files:
+                heapq.heappush(self._expiry, (now, fname))
+            self._files[fname] = [now, size]
+
+    def _untrack(self, fname):
+        with self._index_lock:
+            self._files.pop(fname, None)
+
+    def close_idle(self, expire):
+        """
+        Forgets uploads without new chunks for expire seconds and closes
+        their files, which are then left to the spool cleaner.
+        """
+        deadline = time() - expire
+        with self._lock:
+            idle = [session for session in self._uploads.values()
+                    if session.touched < deadline]
+            for session in idle:
+                del self._uploads[str(session.identifier)]
+        for session in idle:
+            with session.lock:
+                session.tmpfile.close()
+        return len(idle)
+
+    def _session(self, identifier):
+        with self._lock:
+            session = self._uploads.get(str(identifier))
+            if session is not None:
+                return session
+            # upload may have been started before restart of the service
+            fname = self.filename(identifier, partial=True)
+            if not path.isfile(fname):
+                return None
+            session = UploadSession(identifier, self.filename(identifier),
+                                    open(fname, 'ab'), path.getsize(fname))
+            self._uploads[str(identifier)] = session
+            return session
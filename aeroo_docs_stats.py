@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+from bisect import bisect_left
+from threading import Lock
+from time import time
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0, 120.0, float('inf'))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                     .replace('\n', '\\n')
+
+def _labels(names, values):
+    return ','.join('%s="%s"' % (name, _escape(value))
+                    for name, value in zip(names, values))
+
+class Histogram():
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class RequestTimer():
+    """
+    Measures stages of one request. Every lap records time passed since
+    previous lap, or since start of the request.
+    """
+    def __init__(self, stats, method, in_mime=False, out_mime=False):
+        self.stats = stats
+        self.labels = (method, in_mime or '', out_mime or '')
+        self.start = self.last = time()
+        self.bridge_calls = None
+
+    def lap(self, stage=None):
+        """
+        Records time since previous lap as given stage. Without stage
+        only restarts the lap.
+        """
+        now = time()
+        if stage:
+            self.stats.observe(self.labels, stage, now - self.last)
+        self.last = now
+
+    def add(self, timings, bridge_calls=None):
+        """
+        Records list of (stage, seconds) measured elsewhere, and number of
+        office bridge round-trips they took.
+        """
+        for stage, seconds in timings:
+            self.stats.observe(self.labels, stage, seconds)
+        if bridge_calls is not None:
+            self.bridge_calls = (self.bridge_calls or 0) + bridge_calls
+        self.last = time()
+
+    def finish(self):
+        self.stats.observe(self.labels, 'total', time() - self.start)
+        if self.bridge_calls is not None:
+            self.stats.count_calls(self.labels, self.bridge_calls)
+
+class Stats():
+    """
+    Histograms of stage durations by RPC method, input and output mime type.
+    Mime types other than given ones, which come from clients, are counted
+    as 'other', so that number of series stays bounded.
+    """
+    def __init__(self, mimes=()):
+        self.mimes = frozenset(mimes)
+        self._histograms = {}
+        # requests which used office and their bridge round-trips
+        self._calls = {}
+        self._lock = Lock()
+
+    def timer(self, method, in_mime=False, out_mime=False):
+        return RequestTimer(self, method, self._mime(in_mime),
+                            self._mime(out_mime))
+
+    def _mime(self, mime):
+        if not mime:
+            return False
+        return mime in self.mimes and mime or 'other'
+
+    def observe(self, labels, stage, seconds):
+        key = labels + (stage,)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def count_calls(self, labels, calls):
+        with self._lock:
+            counts = self._calls.setdefault(labels, [0, 0])
+            counts[0] += 1
+            counts[1] += calls
+
+    def bridge_calls(self):
+        """
+        Returns requests which used office and sum of their bridge calls,
+        by RPC method, input and output mime type.
+        """
+        with self._lock:
+            return [{'method': method,
+                     'in_mime': in_mime,
+                     'out_mime': out_mime,
+                     'requests': requests,
+                     'calls': calls,
+                    } for (method, in_mime, out_mime), (requests, calls)
+                      in sorted(self._calls.items())]
+
+    def stats(self):
+        result = []
+        with self._lock:
+            for key, histogram in sorted(self._histograms.items()):
+                method, in_mime, out_mime, stage = key
+                result.append({'method': method,
+                               'in_mime': in_mime,
+                               'out_mime': out_mime,
+                               'stage': stage,
+                               'count': histogram.count,
+                               'sum': round(histogram.sum, 6),
+                               'buckets': list(zip([str(b) for b in BUCKETS],
+                                                   histogram.counts)),
+                              })
+        return result
+
+    def prometheus(self, counters=None):
+        """
+        Returns histograms, and given counters, in Prometheus text format.
+        """
+        lines = ['# TYPE aeroo_docs_stage_seconds histogram']
+        with self._lock:
+            for key, histogram in sorted(self._histograms.items()):
+                labels = _labels(('method', 'in_mime', 'out_mime', 'stage'), key)
+                total = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    total += count
+                    bound = bound == float('inf') and '+Inf' or repr(bound)
+                    lines.append('aeroo_docs_stage_seconds_bucket{%s,le="%s"} %s'
+                                 % (labels, bound, total))
+                lines.append('aeroo_docs_stage_seconds_sum{%s} %s'
+                             % (labels, repr(histogram.sum)))
+                lines.append('aeroo_docs_stage_seconds_count{%s} %s'
+                             % (labels, histogram.count))
+            lines.append('# TYPE aeroo_docs_bridge_calls summary')
+            for key, (requests, calls) in sorted(self._calls.items()):
+                labels = _labels(('method', 'in_mime', 'out_mime'), key)
+                lines.append('aeroo_docs_bridge_calls_sum{%s} %s' % (labels, calls))
+                lines.append('aeroo_docs_bridge_calls_count{%s} %s'
+                             % (labels, requests))
+        for name, value in sorted((counters or {}).items()):
+            lines.append('aeroo_docs_%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
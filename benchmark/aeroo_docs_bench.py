@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+"""
+Benchmark of Aeroo DOCS conversion and join throughput. Runs JSON-RPC
+application in-process, against fake office (see fake_office.py) or real
+headless OpenOffice/LibreOffice, and writes requests per second, latency
+percentiles, UNO bridge calls per request and peak memory of every
+workload and document size as JSON.
+
+    ./benchmark/aeroo_docs_bench.py --sizes 10,100,1000 -o fake.json
+    ./benchmark/aeroo_docs_bench.py --backend soffice --start-office -o real.json
+"""
+import sys
+import json
+import base64
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os import path
+from threading import Thread, Event, Lock
+from time import time, sleep, strftime
+
+BENCH_DIR = path.dirname(path.abspath(__file__))
+WORDS = ('aeroo', 'report', 'invoice', 'total', 'amount', 'customer', 'line',
+         'document', 'page', 'quantity', 'price', 'tax', 'date', 'number')
+
+class BenchError(Exception):
+    pass
+
+def document(size, seed=0):
+    """
+    Returns ODT document with about size bytes of text.
+    """
+    from aeroo_docs_fncs import _odf
+    rnd = random.Random(seed)
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = ' '.join(rnd.choice(WORDS) for i in range(40))
+        paragraphs.append('<text:p>%s</text:p>' % paragraph)
+        length += len(paragraph)
+    return _odf('application/vnd.oasis.opendocument.text',
+                '<office:text>%s</office:text>' % ''.join(paragraphs))
+
+class RpcClient():
+    """
+    Calls JSON-RPC application directly through WSGI, without sockets.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._ids = iter(range(1, sys.maxsize))
+        self._lock = Lock()
+
+    def __call__(self, method, **params):
+        with self._lock:
+            rpc_id = next(self._ids)
+        body = json.dumps({'jsonrpc': '2.0', 'id': rpc_id, 'method': method,
+                           'params': params}).encode('utf-8')
+        environ = {'REQUEST_METHOD': 'POST',
+                   'CONTENT_TYPE': 'application/json',
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': BytesIO(body),
+                  }
+        response = json.loads(b''.join(self.app(environ, lambda *args: None)))
+        if 'error' in response:
+            raise BenchError(response['error']['message'])
+        return response['result']
+
+class MemorySampler(Thread):
+    """
+    Samples resident memory of this process and of offices, keeping peaks.
+    """
+    def __init__(self, offices=(), interval=0.05):
+        super(MemorySampler, self).__init__(daemon=True)
+        self.offices = offices
+        self.interval = interval
+        self.peak = 0
+        self.office_peak = 0
+        self._done = Event()
+
+    def run(self):
+        while not self._done.is_set():
+            self.sample()
+            self._done.wait(self.interval)
+
+    def sample(self):
+        self.peak = max(self.peak, own_memory())
+        office = sum(oservice.officeMemory() or 0 for oservice in self.offices
+                     if oservice is not None)
+        self.office_peak = max(self.office_peak, office)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.sample()
+
+def own_memory():
+    try:
+        with open('/proc/self/status') as statusfile:
+            for line in statusfile:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+def bridge_calls(oser):
+    """
+    Returns requests which used office and their bridge calls so far.
+    """
+    counts = oser.metrics.bridge_calls()
+    return (sum(count['requests'] for count in counts),
+            sum(count['calls'] for count in counts))
+
+class Benchmark():
+    def __init__(self, rpc, oser, args):
+        self.rpc = rpc
+        self.oser = oser
+        self.args = args
+
+    def convert(self, data):
+        self.rpc('convert', data=data, in_mime='odt', out_mime='pdf')
+
+    def join(self, data):
+        chunk = self.args.chunk * 1024
+        idents = []
+        for part in range(self.args.parts):
+            identifier = False
+            for start in range(0, len(data), chunk):
+                identifier = self.rpc('upload',
+                    data=base64.b64encode(data[start:start + chunk]).decode('ascii'),
+                    identifier=identifier,
+                    is_last=start + chunk >= len(data))['identifier']
+            idents.append(identifier)
+        self.rpc('join', idents=idents, in_mime='odt', out_mime='pdf')
+        for identifier in idents:
+            self.oser.spool.remove(identifier)
+
+    def mixed(self, data):
+        if random.random() < self.args.join_ratio:
+            self.join(data)
+        else:
+            self.convert(base64.b64encode(data).decode('ascii'))
+
+    def run(self, workload, size):
+        data = document(size)
+        document_bytes = len(data)
+        if workload == 'convert':
+            data = base64.b64encode(data).decode('ascii')
+        operation = getattr(self, workload)
+        latencies = []
+        errors = []
+        def timed(i):
+            start = time()
+            try:
+                operation(data)
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append(time() - start)
+        # first request loads filters and fills caches, it is not measured
+        operation(data)
+        offices = [worker.oservice for worker in self.oser.pool.workers]
+        sampler = MemorySampler(offices)
+        sampler.start()
+        requests_before, calls_before = bridge_calls(self.oser)
+        start = time()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            list(executor.map(timed, range(self.args.requests)))
+        seconds = time() - start
+        sampler.stop()
+        requests, calls = bridge_calls(self.oser)
+        requests -= requests_before
+        calls -= calls_before
+        return {'workload': workload,
+                'size': size,
+                'document_bytes': document_bytes,
+                'requests': self.args.requests,
+                'concurrency': self.args.concurrency,
+                'errors': len(errors),
+                'first_error': errors and errors[0] or None,
+                'seconds': seconds,
+                'rps': len(latencies) / seconds,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'bridge_calls': requests and calls / requests or None,
+                'peak_rss': sampler.peak,
+                'office_peak_rss': sampler.office_peak or None,
+               }
+
+def start_offices(args):
+    """
+    Starts headless office on every worker port and waits until they accept
+    connections. Returns their processes.
+    """
+    processes = []
+    for port in range(args.oo_port, args.oo_port + args.workers):
+        processes.append(subprocess.Popen([args.soffice, '--headless',
+            '--invisible', '--nologo', '--norestore', '--nofirststartwizard',
+            '-env:UserInstallation=file:///tmp/aeroo-docs-bench-%s' % port,
+            '--accept=socket,host=localhost,port=%s;urp;' % port],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    deadline = time() + args.start_timeout
+    for port in range(args.oo_port, args.oo_port + args.workers):
+        while True:
+            try:
+                socket.create_connection(('localhost', port), 1).close()
+                break
+            except OSError:
+                if time() > deadline:
+                    stop_offices(processes)
+                    raise BenchError('Office on port %s did not start.' % port)
+                sleep(0.5)
+    return processes
+
+def stop_offices(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+parser = ArgumentParser(description='Benchmark of Aeroo DOCS.')
+parser.add_argument('--backend', choices=('fake', 'soffice'), default='fake',
+                    help='Office to convert with. Default - fake')
+parser.add_argument('--workloads', default='convert,join,mixed',
+                    help='Comma separated workloads out of convert, join and \
+                          mixed. Default - convert,join,mixed')
+parser.add_argument('--sizes', default='10,100,1000',
+                    help='Comma separated document sizes in kilobytes of \
+                          text. Default - 10,100,1000')
+parser.add_argument('-n', '--requests', type=int, default=50,
+                    help='Requests per workload and size. Default - 50')
+parser.add_argument('-c', '--concurrency', type=int, default=4,
+                    help='Requests sent at the same time. Default - 4')
+parser.add_argument('-k', '--workers', type=int, default=2,
+                    help='Office workers. Default - 2')
+parser.add_argument('--parts', type=int, default=5,
+                    help='Documents in one join. Default - 5')
+parser.add_argument('--chunk', type=int, default=256,
+                    help='Upload chunk in kilobytes. Default - 256')
+parser.add_argument('--join-ratio', type=float, default=0.2,
+                    help='Share of joins in mixed workload. Default - 0.2')
+parser.add_argument('--cache-size', type=int, default=0,
+                    help='Conversion cache in megabytes. Default - 0')
+parser.add_argument('--fake-load', type=float, default=0.02,
+                    help='Seconds fake office takes to load a document. \
+                          Default - 0.02')
+parser.add_argument('--fake-store', type=float, default=0.01,
+                    help='Seconds fake office takes to store a document. \
+                          Default - 0.01')
+parser.add_argument('--fake-insert', type=float, default=0.01,
+                    help='Seconds fake office takes to insert a document. \
+                          Default - 0.01')
+parser.add_argument('--fake-per-mb', type=float, default=0.05,
+                    help='Seconds fake office adds to every operation per \
+                          megabyte of document. Default - 0.05')
+parser.add_argument('--fake-call', type=float, default=0.0002,
+                    help='Seconds every call over UNO bridge of fake office \
+                          takes. Default - 0.0002')
+parser.add_argument('--office-scripts', action='store_true',
+                    help='Run join and update as Python script in office.')
+parser.add_argument('-p', '--oo-port', type=int, default=8100,
+                    help='Port of the first office. Default - 8100')
+parser.add_argument('--start-office', action='store_true',
+                    help='Start headless office for every worker.')
+parser.add_argument('--soffice', default='soffice',
+                    help='Office executable to start. Default - soffice')
+parser.add_argument('--start-timeout', type=int, default=60,
+                    help='Seconds to wait for offices to start. Default - 60')
+parser.add_argument('-o', '--output', default=None,
+                    help='File to write JSON results to. Default - stdout')
+
+def main(args):
+    if args.backend == 'fake':
+        import fake_office
+        fake_office.install(load=args.fake_load, store=args.fake_store,
+                            insert=args.fake_insert, per_mb=args.fake_per_mb,
+                            call=args.fake_call)
+    sys.path.insert(0, path.dirname(BENCH_DIR))
+    from jsonrpc2 import JsonRpcApplication
+    from aeroo_docs_fncs import OfficeService
+    processes = []
+    if args.backend == 'soffice' and args.start_office:
+        if shutil.which(args.soffice) is None:
+            raise BenchError('Office executable %s not found.' % args.soffice)
+        processes = start_offices(args)
+    spool_dir = tempfile.mkdtemp(prefix='aeroo-docs-bench-')
+    try:
+        oser = OfficeService('localhost', args.oo_port, spool_dir,
+                             lambda username, password: True,
+                             workers=args.workers,
+                             cache_size=args.cache_size * 1024 * 1024,
+                             office_scripts=args.office_scripts)
+        rpc = RpcClient(JsonRpcApplication(rpcs={'convert': oser.convert,
+                                                 'upload': oser.upload,
+                                                 'join': oser.join}))
+        benchmark = Benchmark(rpc, oser, args)
+        results = []
+        for workload in args.workloads.split(','):
+            for size in args.sizes.split(','):
+                result = benchmark.run(workload, int(size) * 1024)
+                print('%-8s %8s KB %8.2f rps  p50 %.3f  p95 %.3f  p99 %.3f  '
+                      '%6.1f calls  %s errors' % (workload, size, result['rps'],
+                      result['p50'] or 0, result['p95'] or 0,
+                      result['p99'] or 0, result['bridge_calls'] or 0,
+                      result['errors']), file=sys.stderr)
+                results.append(result)
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        stop_offices(processes)
+    report = {'backend': args.backend,
+              'started': strftime('%Y-%m-%dT%H:%M:%S'),
+              'settings': vars(args),
+              'results': results,
+             }
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+if __name__ == '__main__':
+    main(parser.parse_args())
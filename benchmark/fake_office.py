@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+################################################################################
+#
+# Copyright (c) 2009-2014 Alistek ( http://www.alistek.com ) All Rights Reserved.
+#                    General contacts <info@alistek.com>
+#
+# WARNING: This program as such is intended to be used by professional
+# programmers who take the whole responsability of assessing all potential
+# consequences resulting from its eventual inadequacies and bugs
+# End users who are looking for a ready-to-use solution with commercial
+# garantees and support are strongly adviced to contract a Free Software
+# Service Company
+#
+# This program is Free Software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+################################################################################
+"""
+Stand-in for the office UNO bridge, so that Aeroo DOCS can be benchmarked
+without OpenOffice/LibreOffice. install() registers uno, unohelper and the
+com.sun.star modules DocumentConverter uses. Documents are kept as bytes,
+loading, storing and inserting sleep for given base latency plus latency
+per megabyte of the document. Office objects are reached through Remote,
+every call on them, and every call office makes on streams of the caller,
+sleeps for round-trip latency of UNO bridge. Python scripts deployed into
+user profile run in "office", without that latency.
+"""
+import re
+import sys
+import types
+import time
+import threading
+from urllib.parse import quote, unquote
+
+latency = {'load': 0.0, 'store': 0.0, 'insert': 0.0, 'per_mb': 0.0,
+           'call': 0.0}
+STREAM_CHUNK = 65536
+USER_URL = 'file:///fake-office/user'
+
+# set while office script runs, objects created then are office objects
+_office = threading.local()
+
+def _delay(stage, size):
+    time.sleep(latency[stage] + latency['per_mb'] * size / 1048576.0)
+
+def _roundtrip():
+    time.sleep(latency['call'])
+
+class UnoException(Exception):
+    pass
+
+class UnknownPropertyException(UnoException): pass
+class NoConnectException(UnoException): pass
+class ConnectionSetupException(UnoException): pass
+class IllegalArgumentException(UnoException): pass
+class DisposedException(UnoException): pass
+class IOException(UnoException): pass
+class BufferSizeExceededException(UnoException): pass
+class NotConnectedException(UnoException): pass
+
+class ScriptFrameworkErrorException(UnoException): pass
+
+class XOutputStream(): pass
+class XInputStream(): pass
+class XSeekable(): pass
+
+class Base():
+    pass
+
+class UnoObject():
+    def queryInterface(self, uno_type):
+        return self
+
+def _remote(value):
+    if isinstance(value, UnoObject):
+        return Remote(value)
+    return value
+
+def _local(value):
+    if isinstance(value, Remote):
+        return value._target
+    if isinstance(value, tuple):
+        return tuple(_local(item) for item in value)
+    return value
+
+class Remote():
+    """
+    Office object seen through the bridge.
+    """
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if callable(value):
+            def call(*args):
+                _roundtrip()
+                return _remote(value(*_local(args)))
+            return call
+        _roundtrip()
+        return _remote(value)
+
+    def __setattr__(self, name, value):
+        _roundtrip()
+        setattr(self._target, name, _local(value))
+
+class PropertyValue():
+    Name = None
+    Value = None
+
+class ByteSequence():
+    def __init__(self, value):
+        self.value = bytes(value)
+
+    def __len__(self):
+        return len(self.value)
+
+def systemPathToFileUrl(path):
+    return 'file://' + quote(path)
+
+def fileUrlToSystemPath(url):
+    return unquote(url[len('file://'):])
+
+def _properties(props):
+    return dict((prop.Name, prop.Value) for prop in props)
+
+def _read(props, url):
+    props = _properties(props)
+    stream = props.get('InputStream')
+    if stream is None:
+        with open(fileUrlToSystemPath(url), 'rb') as infile:
+            return infile.read()
+    return _readStream(stream)
+
+def _readStream(stream):
+    if isinstance(stream, SequenceInputStream):
+        if not stream.office:
+            # stream of the caller is read back over the bridge
+            for start in range(0, len(stream.data), STREAM_CHUNK):
+                _roundtrip()
+        return stream.data
+    chunks = []
+    while True:
+        _roundtrip()
+        length, chunk = stream.readBytes(None, STREAM_CHUNK)
+        if not length:
+            break
+        chunks.append(chunk.value)
+    return b''.join(chunks)
+
+class SequenceInputStream():
+    def __init__(self, office=False):
+        self.office = office
+
+    def initialize(self, args):
+        self.data = args[0].value
+
+    def getLength(self):
+        return len(self.data)
+
+    def readBytes(self, data, length):
+        chunk, self.data = self.data[:length], self.data[length:]
+        return len(chunk), ByteSequence(chunk)
+
+    def closeInput(self):
+        pass
+
+class Container(UnoObject):
+    def __init__(self, names=()):
+        self.names = tuple(names)
+
+    def getElementNames(self):
+        return self.names
+
+    def getCount(self):
+        return len(self.names)
+
+    def getByName(self, name):
+        return Container(('Default',))
+
+    def createEnumeration(self):
+        return self
+
+    def hasMoreElements(self):
+        return False
+
+class Cursor(UnoObject):
+    PageDescName = 'Default'
+    ParaStyleName = 'Standard'
+    TextSection = None
+    PageNumberOffset = 0
+
+    def __getattr__(self, name):
+        if name.startswith('goto'):
+            return lambda *args: True
+        raise AttributeError(name)
+
+class TextRange(UnoObject):
+    def __init__(self, document):
+        self.document = document
+
+    def insertDocumentFromURL(self, url, props):
+        data = _read(props, url)
+        _delay('insert', len(data))
+        self.document.data.append(data)
+
+class Text(UnoObject):
+    def __init__(self, document):
+        self.document = document
+
+    def createTextCursor(self):
+        return Cursor()
+
+    def getEnd(self):
+        return TextRange(self.document)
+
+    def insertControlCharacter(self, *args):
+        pass
+
+    def insertTextContentAfter(self, *args):
+        pass
+
+class Document(UnoObject):
+    def __init__(self, data):
+        self.data = [data]
+        self.Text = Text(self)
+        self.StyleFamilies = Container()
+
+    def getTextSections(self):
+        return Container()
+
+    def getTextFields(self):
+        return Container()
+
+    def getDocumentIndexes(self):
+        return Container()
+
+    def updateLinks(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def createInstance(self, name):
+        return Container()
+
+    def storeToURL(self, url, props):
+        data = b''.join(self.data)
+        _delay('store', len(data))
+        stream = _properties(props).get('OutputStream')
+        if stream is None:
+            with open(fileUrlToSystemPath(url), 'wb') as outfile:
+                outfile.write(data)
+            return
+        for start in range(0, len(data), STREAM_CHUNK):
+            _roundtrip()
+            stream.writeBytes(ByteSequence(data[start:start + STREAM_CHUNK]))
+        _roundtrip()
+        stream.closeOutput()
+
+    def close(self, deliver):
+        self.data = None
+
+class Desktop(UnoObject):
+    def loadComponentFromURL(self, url, frame, flags, props):
+        data = _read(props, url)
+        _delay('load', len(data))
+        return Document(data)
+
+class PathSubstitution(UnoObject):
+    def substituteVariables(self, text, substitute):
+        return text.replace('$(user)', USER_URL)
+
+class SimpleFileAccess(UnoObject):
+    """
+    Files of office user profile, kept in memory.
+    """
+    files = {}
+
+    def exists(self, url):
+        return url in self.files
+
+    def getSize(self, url):
+        return len(self.files[url])
+
+    def createFolder(self, url):
+        self.files[url] = b''
+
+    def writeFile(self, url, stream):
+        self.files[url] = _readStream(stream)
+
+    def openFileRead(self, url):
+        stream = SequenceInputStream(office=True)
+        stream.initialize((ByteSequence(self.files[url]),))
+        return stream
+
+class ScriptProviderFactory(UnoObject):
+    def createScriptProvider(self, context):
+        return ScriptProvider()
+
+class ScriptProvider(UnoObject):
+    modules = {}
+
+    def getScript(self, uri):
+        match = re.match(r'vnd\.sun\.star\.script:(\w+\.py)\$(\w+)\?.*location=user$', uri)
+        url = match and '%s/Scripts/python/%s' % (USER_URL, match.group(1))
+        if url not in SimpleFileAccess.files:
+            raise ScriptFrameworkErrorException('Script %s not found.' % uri)
+        source = SimpleFileAccess.files[url]
+        module = self.modules.get(source)
+        if module is None:
+            module = types.ModuleType(match.group(1)[:-3])
+            exec(compile(source, url, 'exec'), module.__dict__)
+            self.modules[source] = module
+        return Script(getattr(module, match.group(2)))
+
+class Script(UnoObject):
+    def __init__(self, function):
+        self.function = function
+
+    def invoke(self, args, out_param_index, out_param):
+        _office.active = True
+        try:
+            return self.function(*args), (), ()
+        finally:
+            _office.active = False
+
+class ServiceManager(UnoObject):
+    services = {'com.sun.star.frame.Desktop': Desktop,
+                'com.sun.star.util.PathSubstitution': PathSubstitution,
+                'com.sun.star.ucb.SimpleFileAccess': SimpleFileAccess,
+                'com.sun.star.script.provider.MasterScriptProviderFactory':
+                    ScriptProviderFactory,
+               }
+
+    def __init__(self, office=False):
+        self.office = office
+
+    def createInstanceWithContext(self, name, context):
+        if name == 'com.sun.star.bridge.UnoUrlResolver':
+            return Resolver()
+        if name == 'com.sun.star.io.SequenceInputStream':
+            return SequenceInputStream(self.office)
+        return self.services[name]()
+
+class Context(UnoObject):
+    def __init__(self, office=False):
+        self.ServiceManager = ServiceManager(office)
+
+class Resolver(UnoObject):
+    def resolve(self, url):
+        return Remote(Context(office=True))
+
+def getComponentContext():
+    return Context(getattr(_office, 'active', False))
+
+def _module(name, **attributes):
+    module = sys.modules.get(name) or types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def install(**latencies):
+    """
+    Registers fake office modules, has to be called before DocumentConverter
+    is imported. Latencies are seconds for load, store, insert, per_mb and
+    bridge round-trip call.
+    """
+    latency.update(latencies)
+    _module('uno', ByteSequence=ByteSequence,
+            systemPathToFileUrl=systemPathToFileUrl,
+            fileUrlToSystemPath=fileUrlToSystemPath,
+            getComponentContext=getComponentContext)
+    _module('unohelper', Base=Base)
+    for name in ('com', 'com.sun', 'com.sun.star', 'com.sun.star.document',
+                 'com.sun.star.style', 'com.sun.star.text'):
+        _module(name)
+    _module('com.sun.star.beans', PropertyValue=PropertyValue,
+            UnknownPropertyException=UnknownPropertyException)
+    _module('com.sun.star.connection', NoConnectException=NoConnectException,
+            ConnectionSetupException=ConnectionSetupException)
+    _module('com.sun.star.lang', IllegalArgumentException=IllegalArgumentException,
+            DisposedException=DisposedException)
+    _module('com.sun.star.io', XOutputStream=XOutputStream,
+            XInputStream=XInputStream, XSeekable=XSeekable,
+            IOException=IOException,
+            BufferSizeExceededException=BufferSizeExceededException,
+            NotConnectedException=NotConnectedException)
+    _module('com.sun.star.document.UpdateDocMode', QUIET_UPDATE=1)
+    _module('com.sun.star.document.MacroExecMode', NEVER_EXECUTE=0)
+    _module('com.sun.star.style.BreakType', PAGE_AFTER=1, PAGE_BEFORE=2,
+            PAGE_BOTH=3)
+    _module('com.sun.star.text.ControlCharacter', PARAGRAPH_BREAK=0,
+            APPEND_PARAGRAPH=5)
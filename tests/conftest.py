@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmark'))
+sys.path.insert(0, ROOT)
+
+import fake_office
+# has to happen before DocumentConverter is imported
+fake_office.install()
+
+import pytest
+
+import DocumentConverter
+import aeroo_docs_fncs
+
+@pytest.fixture(autouse=True)
+def office():
+    """
+    Fake office without latencies and with empty user profile.
+    """
+    latency = dict(fake_office.latency)
+    files = dict(fake_office.SimpleFileAccess.files)
+    fake_office.latency.update(dict.fromkeys(latency, 0.0))
+    fake_office.SimpleFileAccess.files.clear()
+    yield fake_office
+    fake_office.latency.update(latency)
+    fake_office.SimpleFileAccess.files.clear()
+    fake_office.SimpleFileAccess.files.update(files)
+
+@pytest.fixture
+def down(monkeypatch):
+    """
+    Ports of offices which refuse connections.
+    """
+    ports = set()
+    resolve = fake_office.Resolver.resolve
+    def refuse(self, url):
+        port = int(url.split('port=')[1].split(';')[0])
+        if port in ports:
+            raise fake_office.NoConnectException('Connection refused.')
+        return resolve(self, url)
+    monkeypatch.setattr(fake_office.Resolver, 'resolve', refuse)
+    monkeypatch.setattr(aeroo_docs_fncs, 'PROBE_INTERVAL', 0.01)
+    return ports
+
+@pytest.fixture
+def restarts(monkeypatch):
+    """
+    Commands restart script was run with, instead of running it.
+    """
+    commands = []
+    def call(command, shell=False):
+        commands.append(command)
+        return 0
+    monkeypatch.setattr(DocumentConverter.subprocess, 'call', call)
+    return commands
+
+@pytest.fixture
+def service(tmp_path):
+    """
+    Returns function creating OfficeService on fake office, with spool in
+    temporary directory.
+    """
+    services = []
+    def create(oo_host='localhost', oo_port=8100, auth=lambda username, password: True,
+               **options):
+        options.setdefault('warm_up', False)
+        options.setdefault('pdf_workers', 0)
+        options.setdefault('prefetch', 0)
+        spool_dir = tmp_path / 'spool'
+        spool_dir.mkdir(exist_ok=True)
+        oser = aeroo_docs_fncs.OfficeService(oo_host, oo_port, str(spool_dir),
+                                             auth, **options)
+        services.append(oser)
+        return oser
+    yield create
+    for oser in services:
+        if oser._prefetcher is not None:
+            oser._prefetcher.shutdown()
+        if oser._pdf_pool is not None:
+            oser._pdf_pool.shutdown()
+
+def wait_for(condition, timeout=5):
+    """
+    Waits until condition holds, for work done in background threads.
+    """
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Condition not met in %s s.' % timeout)
+        time.sleep(0.01)
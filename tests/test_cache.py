@@ -0,0 +1,79 @@
+import base64
+import io
+import os
+import time
+
+import pytest
+
+from aeroo_docs_cache import ConversionCache
+
+def test_least_recently_used_goes_first():
+    cache = ConversionCache(max_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1,
+                             'entries': 2, 'bytes': 8, 'max_bytes': 10}
+
+def test_result_bigger_than_cache_is_not_kept():
+    cache = ConversionCache(max_bytes=4)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbbb')
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('b') is None
+
+def test_key_covers_options_and_files():
+    cache = ConversionCache(max_bytes=10)
+    assert cache.key(b'data', 'writer8', 'pdf') == \
+           cache.key(io.BytesIO(b'data'), 'writer8', 'pdf')
+    assert cache.key(b'data', 'writer8', 'pdf') != cache.key(b'data', 'writer8', 'doc')
+    assert cache.key(b'data', 'ab', 'c') != cache.key(b'data', 'a', 'bc')
+
+def test_disk_tier(tmp_path):
+    disk_dir = str(tmp_path / 'cache')
+    ConversionCache(0, disk_dir, 60).put('a', b'aaaa')
+    cache = ConversionCache(0, disk_dir, 60)
+    assert cache.get('a') == b'aaaa'
+    old = time.time() - 120
+    os.utime(os.path.join(disk_dir, 'a'), (old, old))
+    assert cache.get('a') is None
+    assert os.listdir(disk_dir) == []
+    assert cache.stats()['evictions'] == 1
+
+def test_disk_tier_needs_expire(tmp_path):
+    cache = ConversionCache(0, str(tmp_path / 'cache'), 0)
+    assert not cache.enabled
+    assert not os.path.exists(str(tmp_path / 'cache'))
+
+def test_service_serves_repeated_conversion(service):
+    oser = service(cache_size=1024)
+    data = base64.b64encode(b'document').decode()
+    assert oser.convert(data, in_mime='odt', out_mime='pdf') == data
+    assert oser.convert(data, in_mime='odt', out_mime='pdf') == data
+    assert oser.convert(data, in_mime='odt', out_mime='doc') == data
+    stats = oser.cache_stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+
+def test_service_does_not_cache_failed_conversion(service, office, monkeypatch):
+    oser = service(cache_size=1024)
+    data = base64.b64encode(b'document').decode()
+    def fail(self, url, props):
+        raise office.IOException('Disk full.')
+    with monkeypatch.context() as patch:
+        patch.setattr(office.Document, 'storeToURL', fail)
+        with pytest.raises(office.IOException):
+            oser.convert(data, in_mime='odt', out_mime='pdf')
+    assert oser.cache_stats()['entries'] == 0
+    assert oser.convert(data, in_mime='odt', out_mime='pdf') == data
+
+def test_service_does_not_cache_empty_result(service, office, monkeypatch):
+    oser = service(cache_size=1024)
+    data = base64.b64encode(b'document').decode()
+    monkeypatch.setattr(office.Document, 'storeToURL',
+                        lambda self, url, props: None)
+    assert oser.convert(data, in_mime='odt', out_mime='pdf') == ''
+    assert oser.cache_stats()['entries'] == 0
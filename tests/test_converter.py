@@ -0,0 +1,88 @@
+import mmap
+from io import BytesIO
+
+import pytest
+
+from DocumentConverter import DocumentConverter, InputStreamWrapper
+
+@pytest.fixture
+def converter():
+    return DocumentConverter('localhost', 8100, spool_threshold=4)
+
+def test_small_output_stays_in_memory(converter):
+    converter.putDocument(b'doc')
+    outfile = converter.saveToFile(filter_name='writer8')
+    assert not outfile._rolled
+    assert outfile.read() == b'doc'
+
+def test_big_output_goes_to_temporary_file(converter):
+    converter.putDocument(b'document')
+    outfile = converter.saveToFile(filter_name='writer8')
+    assert outfile._rolled
+    assert outfile.read() == b'document'
+
+def test_output_into_file_object(converter):
+    converter.putDocument(b'document')
+    outfile = BytesIO()
+    assert converter.saveToFile(outfile, filter_name='writer8') is outfile
+    assert outfile.getvalue() == b'document'
+
+def test_failed_store_closes_temporary_file(converter, office, monkeypatch):
+    converter.putDocument(b'document')
+    written = []
+    def fail(self, url, props):
+        stream = props[0].Value
+        stream.writeBytes(office.ByteSequence(b'half'))
+        written.append(stream.data)
+        raise office.IOException('Disk full.')
+    monkeypatch.setattr(office.Document, 'storeToURL', fail)
+    with pytest.raises(office.IOException):
+        converter.saveToFile(filter_name='writer8')
+    assert written[0].closed
+
+def read(method, length):
+    count, data = method(None, length)
+    assert count == len(data.value)
+    return data.value
+
+def test_input_stream_maps_file(tmp_path):
+    fname = tmp_path / 'document'
+    fname.write_bytes(b'document')
+    infile = open(str(fname), 'rb')
+    stream = InputStreamWrapper(infile)
+    assert isinstance(stream.data, mmap.mmap)
+    assert stream.getLength() == 8
+    assert read(stream.readBytes, 3) == b'doc'
+    stream.skipBytes(2)
+    assert stream.available() == 3
+    assert read(stream.readSomeBytes, 10) == b'ent'
+    assert read(stream.readBytes, 10) == b''
+    stream.seek(1)
+    assert stream.getPosition() == 1
+    assert stream.counter.calls == 8
+    stream.closeInput()
+    assert infile.closed and stream.data.closed
+
+def test_input_stream_of_empty_file(tmp_path):
+    fname = tmp_path / 'document'
+    fname.write_bytes(b'')
+    stream = InputStreamWrapper(open(str(fname), 'rb'))
+    assert not isinstance(stream.data, mmap.mmap)
+    assert stream.getLength() == 0
+    assert read(stream.readBytes, 10) == b''
+    stream.closeInput()
+
+def test_input_stream_of_memory_file():
+    stream = InputStreamWrapper(BytesIO(b'document'))
+    assert stream.getLength() == 8
+    assert read(stream.readBytes, 10) == b'document'
+
+def test_put_document_from_file(converter, tmp_path):
+    fname = tmp_path / 'document'
+    fname.write_bytes(b'document')
+    with open(str(fname), 'rb') as infile:
+        infile.read(3)
+        converter.putDocument(infile)
+        # office read the whole file, from the start, and closed it
+        assert infile.closed
+    assert converter.saveByStream('writer8') == b'document'
@@ -0,0 +1,108 @@
+import base64
+from threading import Event, Thread
+
+import pytest
+
+from conftest import wait_for
+from DocumentConverter import DocumentConverter, DocumentConversionException
+from aeroo_docs_fncs import NoidentException, NodataException, OfficeBusy
+
+DOCUMENT = base64.b64encode(b'document').decode()
+
+def test_convert_multi(service):
+    oser = service()
+    results = oser.convert_multi(DOCUMENT, in_mime='odt', out_mimes=['pdf', 'doc'])
+    assert results == {'pdf': DOCUMENT, 'doc': DOCUMENT}
+    results = oser.convert_multi(DOCUMENT, in_mime='odt', out_mimes=['pdf'],
+                                 spool_result=True)
+    assert results['pdf']['size'] == 8
+
+def test_handle_holds_worker(service):
+    oser = service(workers=2, max_handles=1)
+    handle = oser.open_document(DOCUMENT, in_mime='odt')['handle']
+    assert oser.pool.stats()['workers_idle'] == 1
+    for i in range(2):
+        assert oser.convert_multi(handle=handle, out_mimes=['pdf']) == {'pdf': DOCUMENT}
+    with pytest.raises(OfficeBusy):
+        oser.open_document(DOCUMENT, in_mime='odt')
+    assert oser.close_document(handle)
+    assert oser.pool.stats()['workers_idle'] == 2
+    with pytest.raises(NoidentException):
+        oser.convert_multi(handle=handle, out_mimes=['pdf'])
+    with pytest.raises(NoidentException):
+        oser.close_document(handle)
+
+def test_handles_leave_worker_for_conversions(service):
+    oser = service(workers=2, max_handles=5)
+    assert oser.max_handles == 1
+    oser = service(workers=1, max_handles=1)
+    assert oser.max_handles == 0
+    with pytest.raises(NodataException, match='Open documents are disabled.'):
+        oser.open_document(DOCUMENT, in_mime='odt')
+
+def test_handle_is_reserved_while_loading(service, office, monkeypatch):
+    oser = service(workers=3, max_handles=1)
+    loading = Event()
+    loaded = Event()
+    load = office.Desktop.loadComponentFromURL
+    def slow(self, *args):
+        loading.set()
+        loaded.wait()
+        return load(self, *args)
+    monkeypatch.setattr(office.Desktop, 'loadComponentFromURL', slow)
+    results = []
+    opener = Thread(target=lambda: results.append(
+                        oser.open_document(DOCUMENT, in_mime='odt')))
+    opener.start()
+    loading.wait()
+    with pytest.raises(OfficeBusy):
+        oser.open_document(DOCUMENT, in_mime='odt')
+    loaded.set()
+    opener.join()
+    assert oser.close_document(results[0]['handle'])
+
+def test_failed_load_frees_handle(service, monkeypatch):
+    oser = service(workers=2, max_handles=1)
+    with pytest.raises(NoidentException):
+        oser.open_document(identifier='unknown', in_mime='odt')
+    def fail(self, *args, **kwargs):
+        raise IOError('Broken document.')
+    with monkeypatch.context() as patch:
+        patch.setattr(DocumentConverter, 'putDocument', fail)
+        with pytest.raises(IOError):
+            oser.open_document(DOCUMENT, in_mime='odt')
+    assert oser.pool.stats()['workers_idle'] == 2
+    handle = oser.open_document(DOCUMENT, in_mime='odt')['handle']
+    assert oser.close_document(handle)
+
+def test_idle_handle_is_closed(service):
+    oser = service(workers=2, max_handles=1, handle_timeout=0)
+    handle = oser.open_document(DOCUMENT, in_mime='odt')['handle']
+    wait_for(lambda: oser.pool.stats()['workers_idle'] == 2)
+    with pytest.raises(NoidentException):
+        oser.convert_multi(handle=handle, out_mimes=['pdf'])
+
+def test_failed_conversion_closes_handle(service, office, monkeypatch):
+    oser = service(workers=2, max_handles=1)
+    handle = oser.open_document(DOCUMENT, in_mime='odt')['handle']
+    def fail(self, url, props):
+        raise office.IOException('Disk full.')
+    monkeypatch.setattr(office.Document, 'storeToURL', fail)
+    with pytest.raises(office.IOException):
+        oser.convert_multi(handle=handle, out_mimes=['pdf'])
+    # office is fine, worker goes back to the pool
+    assert oser.pool.stats() == {'workers': 2, 'workers_idle': 2,
+                                 'workers_ejected': 0, 'recycles': 0}
+    with pytest.raises(NoidentException):
+        oser.convert_multi(handle=handle, out_mimes=['pdf'])
+
+def test_lost_office_closes_handle(service, office, monkeypatch):
+    oser = service(workers=2, max_handles=1)
+    handle = oser.open_document(DOCUMENT, in_mime='odt')['handle']
+    def fail(self, url, props):
+        raise DocumentConversionException('Lost connection.')
+    monkeypatch.setattr(office.Document, 'storeToURL', fail)
+    with pytest.raises(DocumentConversionException):
+        oser.convert_multi(handle=handle, out_mimes=['pdf'])
+    assert oser.pool.stats()['workers_ejected'] == 1
+    assert not oser._handles
@@ -0,0 +1,123 @@
+import base64
+import gzip
+import os
+from io import BytesIO
+
+import pytest
+
+from conftest import ROOT
+
+CREDENTIALS = 'Basic ' + base64.b64encode(b'user:secret').decode()
+
+@pytest.fixture(scope='module')
+def script():
+    """
+    Definitions of aeroo-docs script, without parsing command line.
+    """
+    fname = os.path.join(ROOT, 'aeroo-docs')
+    with open(fname) as scriptfile:
+        source = scriptfile.read()
+    source = source[:source.index('\nargs = top_parser.parse_args()')]
+    namespace = {'__name__': 'aeroo_docs'}
+    exec(compile(source, fname, 'exec'), namespace)
+    return namespace
+
+@pytest.fixture
+def app(script, service):
+    def create(**options):
+        oser = service(auth=lambda username, password:
+                            (username, password) == ('user', 'secret'),
+                       **options)
+        return script['ServiceApplication'](oser, None)
+    return create
+
+def post(app, body, query='in=odt&out=pdf', **headers):
+    environ = {'REQUEST_METHOD': 'POST',
+               'PATH_INFO': '/convert',
+               'QUERY_STRING': query,
+               'CONTENT_LENGTH': str(len(body)),
+               'HTTP_AUTHORIZATION': CREDENTIALS,
+               'wsgi.input': BytesIO(body),
+              }
+    environ.update(headers)
+    response = {}
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    response['body'] = b''.join(app(environ, start_response))
+    return response
+
+def test_convert(app):
+    application = app()
+    response = post(application, b'document')
+    assert response['status'] == '200 OK'
+    assert response['body'] == b'document'
+    assert response['headers']['Content-Type'] == 'application/pdf'
+    assert response['headers']['Content-Length'] == '8'
+    # neither request body nor result is left in spool
+    assert os.listdir(application.oser.spool.spool_dir) == []
+
+def test_convert_compressed(app):
+    response = post(app(), gzip.compress(b'document'),
+                    HTTP_CONTENT_ENCODING='gzip', HTTP_ACCEPT_ENCODING='gzip')
+    assert response['status'] == '200 OK'
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response['body']) == b'document'
+
+def test_access_denied(app):
+    response = post(app(), b'document', HTTP_AUTHORIZATION='')
+    assert response['status'] == '401 Unauthorized'
+    assert 'WWW-Authenticate' in response['headers']
+
+def test_method_not_allowed(app):
+    response = post(app(), b'document', REQUEST_METHOD='GET')
+    assert response['status'] == '405 Method Not Allowed'
+
+@pytest.mark.parametrize('headers, status', [
+    ({'CONTENT_TYPE': 'multipart/form-data'}, '415 Unsupported Media Type'),
+    ({'HTTP_CONTENT_ENCODING': 'br'}, '415 Unsupported Media Type'),
+    ({'CONTENT_LENGTH': ''}, '411 Length Required'),
+    ({'HTTP_CONTENT_ENCODING': 'gzip'}, '400 Bad Request'),
+])
+def test_bad_request(app, headers, status):
+    application = app()
+    response = post(application, b'not compressed', **headers)
+    assert response['status'] == status
+    assert os.listdir(application.oser.spool.spool_dir) == []
+
+def test_office_busy(app):
+    application = app(queue_timeout=0.05)
+    worker = application.oser.pool.acquire()
+    try:
+        response = post(application, b'document')
+    finally:
+        application.oser.pool.release(worker)
+    assert response['status'] == '503 Service Unavailable'
+    assert os.listdir(application.oser.spool.spool_dir) == []
+
+def test_no_office(app, down):
+    down.add(8100)
+    application = app()
+    response = post(application, b'document')
+    assert response['status'] == '503 Service Unavailable'
+    assert response['body'] == b'No OpenOffice/LibreOffice is reachable.'
+
+def test_conversion_error(app, office, monkeypatch):
+    def fail(self, url, props):
+        raise office.IOException('Disk full.')
+    monkeypatch.setattr(office.Document, 'storeToURL', fail)
+    application = app()
+    response = post(application, b'document')
+    assert response['status'] == '500 Internal Server Error'
+    assert os.listdir(application.oser.spool.spool_dir) == []
+
+def test_metrics(app):
+    application = app()
+    post(application, b'document')
+    response = post(application, b'', REQUEST_METHOD='GET', PATH_INFO='/metrics')
+    assert response['status'] == '200 OK'
+    assert b'aeroo_docs_stage_seconds_count{method="convert",in_mime="odt",' \
+           b'out_mime="pdf",stage="total"} 1' in response['body']
+    response = post(application, b'', REQUEST_METHOD='GET', PATH_INFO='/metrics',
+                    HTTP_AUTHORIZATION='')
+    assert response['status'] == '401 Unauthorized'
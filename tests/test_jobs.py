@@ -0,0 +1,96 @@
+import base64
+import time
+from threading import Event
+
+import pytest
+
+import aeroo_docs_fncs
+from conftest import wait_for
+from aeroo_docs_fncs import AccessException, NodataException
+from aeroo_docs_jobs import JobQueue
+
+def test_priority_then_submission_order():
+    queue = JobQueue(workers=1)
+    started = Event()
+    blocker = Event()
+    order = []
+    def block():
+        started.set()
+        blocker.wait()
+        return {}
+    queue.submit(0, block)
+    started.wait()
+    jobs = [queue.submit(priority, order.append, name)
+            for priority, name in ((10, 'join'), (0, 'first'), (5, 'middle'),
+                                   (0, 'second'))]
+    blocker.set()
+    wait_for(lambda: all(job.status == 'done' for job in jobs))
+    assert order == ['first', 'second', 'middle', 'join']
+
+def test_full_queue():
+    queue = JobQueue(workers=0, max_jobs=2)
+    assert queue.submit(0, dict) is not None
+    assert queue.submit(0, dict) is not None
+    assert queue.submit(0, dict) is None
+    assert queue.stats() == {'queued': 2, 'running': 0, 'done': 0, 'failed': 0}
+
+def test_failed_job():
+    queue = JobQueue(workers=1)
+    def fail():
+        raise ValueError('Bad document.')
+    job = queue.submit(0, fail)
+    wait_for(lambda: job.finished)
+    assert job.info() == {'job': job.job_id, 'status': 'failed',
+                          'error': 'Bad document.'}
+
+def test_finished_jobs_are_forgotten():
+    forgotten = []
+    queue = JobQueue(workers=1, expire=0, forget=forgotten.append)
+    job = queue.submit(0, dict, identifier=1, size=0)
+    wait_for(lambda: job.finished)
+    time.sleep(0.01)
+    queue.submit(0, dict)
+    assert forgotten == [job]
+    assert queue.get(job.job_id) is None
+
+def test_service_job(service):
+    oser = service(auth=lambda username, password: password == 'secret')
+    data = base64.b64encode(b'document').decode()
+    job = oser.submit_convert(data, in_mime='odt', out_mime='pdf',
+                              password='secret')['job']
+    wait_for(lambda: oser.job_status(job, password='secret')['status'] == 'done')
+    with pytest.raises(AccessException):
+        oser.fetch_result(job)
+    with pytest.raises(AccessException):
+        oser.job_status(job)
+    result = oser.fetch_result(job, password='secret')
+    assert base64.b64decode(result['data']) == b'document'
+    assert result['is_last']
+
+def test_service_job_failed(service):
+    oser = service()
+    job = oser.submit_convert(identifier=12345, in_mime='odt', out_mime='pdf')['job']
+    wait_for(lambda: oser.job_status(job)['status'] == 'failed')
+    assert oser.job_status(job)['error'] == 'Wrong or no identifier.'
+    with pytest.raises(NodataException):
+        oser.fetch_result(job)
+
+def test_service_job_result_removed_with_job(service):
+    oser = service(job_expire=0)
+    data = base64.b64encode(b'document').decode()
+    job = oser.submit_convert(data, in_mime='odt', out_mime='pdf')['job']
+    wait_for(lambda: oser.job_status(job)['status'] == 'done')
+    identifier = oser.job_status(job)['identifier']
+    assert oser.spool.size(identifier) == 8
+    time.sleep(0.01)
+    oser.submit_convert(data, in_mime='odt', out_mime='pdf')
+    assert oser.spool.size(identifier) == 0
+
+def test_job_queue_served_by_all_workers(service, monkeypatch):
+    sizes = []
+    def queue(workers, *args):
+        sizes.append(workers)
+        return JobQueue(0, *args)
+    monkeypatch.setattr(aeroo_docs_fncs, 'JobQueue', queue)
+    service('a,b', workers=2)
+    assert sizes == [4]
@@ -0,0 +1,158 @@
+import pytest
+
+from DocumentConverter import DocumentConverter
+from aeroo_docs_office import document_contents, update_document
+
+class Container():
+    def __init__(self, items=()):
+        self.items = dict(items)
+
+    def getElementNames(self):
+        return tuple(self.items)
+
+    def getByName(self, name):
+        return self.items[name]
+
+    def getCount(self):
+        return len(self.items)
+
+    def getByIndex(self, index):
+        return list(self.items.values())[index]
+
+    def createEnumeration(self):
+        return self
+
+    def hasMoreElements(self):
+        return bool(self.items)
+
+class Section():
+    def __init__(self, url=''):
+        self.FileLink = type('FileLink', (), {'FileURL': url})
+
+class Index():
+    def __init__(self, document):
+        self.document = document
+
+    def update(self):
+        self.document.calls.append('index')
+        self.document.stale.discard('indexes')
+
+class TextDocument():
+    """
+    Writer document which tells what is out of date: linked sections,
+    fields and indexes it has. Refresh updates fields and renews indexes.
+    """
+    def __init__(self, links=False, fields=False, indexes=False):
+        self.calls = []
+        self.stale = set(name for name, has in (('links', links), ('fields', fields),
+                                                ('indexes', indexes)) if has)
+        self.sections = Container((('Linked', Section('file:///part.odt')),)
+                                  if links else (('Plain', Section()),))
+        self.fields = Container((('Date', None),) if fields else ())
+        self.indexes = Container((('Contents', Index(self)),) if indexes else ())
+
+    def getTextSections(self):
+        return self.sections
+
+    def getTextFields(self):
+        return self.fields
+
+    def getDocumentIndexes(self):
+        self.calls.append('indexes')
+        return self.indexes
+
+    def updateLinks(self):
+        self.calls.append('links')
+        self.stale.discard('links')
+
+    def refresh(self):
+        self.calls.append('refresh')
+        self.stale.discard('fields')
+        # refresh renews index objects
+        self.indexes = Container((name, Index(self)) for name
+                                 in self.indexes.getElementNames())
+
+class Spreadsheet():
+    def __init__(self, links=False):
+        self.calls = []
+        self.stale = links and set(['links']) or set()
+        self.AreaLinks = Container()
+        self.DDELinks = Container()
+        self.SheetLinks = Container((('Sheet1', None),) if links else ())
+
+    def updateLinks(self):
+        self.calls.append('links')
+        self.stale.discard('links')
+
+@pytest.mark.parametrize('document, calls', [
+    (TextDocument(), ['indexes']),
+    (TextDocument(indexes=True), ['indexes', 'index']),
+    (TextDocument(links=True), ['indexes', 'links']),
+    (TextDocument(fields=True), ['indexes', 'refresh', 'indexes']),
+    (TextDocument(True, True, True),
+     ['indexes', 'links', 'refresh', 'indexes', 'index']),
+    (Spreadsheet(), []),
+    (Spreadsheet(links=True), ['links']),
+])
+def test_update_only_what_document_has(document, calls):
+    update_document(document)
+    assert document.calls == calls
+    # same result as updating everything
+    assert document.stale == set()
+
+@pytest.mark.parametrize('document', [
+    TextDocument(), TextDocument(indexes=True), TextDocument(links=True),
+    TextDocument(fields=True), TextDocument(True, True, True),
+])
+def test_update_everything(document):
+    update_document(document, everything=True)
+    assert document.calls[:2] == ['links', 'refresh']
+    assert document.stale == set()
+
+def test_update_everything_in_spreadsheet():
+    document = Spreadsheet(links=True)
+    update_document(document, everything=True)
+    assert document.calls == ['links']
+
+def test_document_contents():
+    assert document_contents(TextDocument())[:2] == (False, False)
+    links, fields, indexes = document_contents(TextDocument(True, True, True))
+    assert (links, fields, indexes.getCount()) == (True, True, 1)
+    assert document_contents(TextDocument(indexes=True))[2] is not None
+    assert document_contents(TextDocument())[2] is None
+    assert document_contents(Spreadsheet(links=True)) == (True, False, None)
+
+@pytest.fixture
+def updates(office, monkeypatch):
+    """
+    Updates of fake office documents.
+    """
+    calls = []
+    monkeypatch.setattr(office.Document, 'updateLinks',
+                        lambda self: calls.append('links'))
+    monkeypatch.setattr(office.Document, 'refresh',
+                        lambda self: calls.append('refresh'))
+    return calls
+
+@pytest.mark.parametrize('update, calls', [
+    (None, []),
+    (True, ['links', 'refresh']),
+    (False, []),
+])
+def test_converter_update(updates, update, calls):
+    converter = DocumentConverter('localhost', 8100)
+    converter.putDocument(b'document')
+    converter.saveByStream('writer8', update=update)
+    # done once, until document changes
+    converter.saveByStream('writer_pdf_Export', update=update)
+    assert updates == calls
+    converter.appendDocuments([b'part'], update=update)
+    assert updates == calls * 2
+
+def test_service_update(service, updates):
+    oser = service()
+    data = 'ZG9jdW1lbnQ='
+    oser.convert(data, in_mime='odt', out_mime='pdf', update=True)
+    oser.convert(data, in_mime='odt', out_mime='pdf', update=False)
+    oser.convert(data, in_mime='odt', out_mime='pdf')
+    assert updates == ['links', 'refresh']
@@ -0,0 +1,236 @@
+import zlib
+
+import pytest
+
+from aeroo_docs_pdf import PdfReader, PdfError, merge
+
+CATALOG = b'<< /Type /Catalog /Pages 2 0 R >>'
+
+def pages(*nums):
+    kids = b' '.join(b'%d 0 R' % num for num in nums)
+    return b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(nums))
+
+def body(objects):
+    """
+    Returns file header with objects and their offsets.
+    """
+    data = b'%PDF-1.4\n'
+    offsets = {}
+    for num, value in sorted(objects.items()):
+        offsets[num] = len(data)
+        data += b'%d 0 obj\n%s\nendobj\n' % (num, value)
+    return data, offsets
+
+def classic(objects, trailer=b'', shift=0):
+    """
+    Builds PDF with cross-reference table, offsets moved by shift.
+    """
+    data, offsets = body(objects)
+    size = max(offsets) + 1
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f\r\n' % size
+    for num in range(1, size):
+        if num in offsets:
+            data += b'%010d 00000 n\r\n' % (offsets[num] + shift)
+        else:
+            data += b'0000000000 65535 f\r\n'
+    data += b'trailer\n<< /Size %d /Root 1 0 R %s>>\n' % (size, trailer)
+    return data + b'startxref\n%d\n%%%%EOF\n' % xref
+
+def png_up(rows, columns):
+    """
+    Encodes rows with PNG Up predictor.
+    """
+    data = b''
+    previous = bytes(columns)
+    for row in rows:
+        data += b'\x02' + bytes((a - b) & 0xff for a, b in zip(row, previous))
+        previous = row
+    return data
+
+def with_xref_stream(objects, packed=()):
+    """
+    Builds PDF with cross-reference stream, which is compressed with PNG
+    predictor. Objects numbered in packed go to object stream.
+    """
+    loose = dict((num, value) for num, value in objects.items()
+                 if num not in packed)
+    stream_num = max(objects) + 1
+    if packed:
+        header = b' '.join(b'%d %d' % (num, index * 100)
+                           for index, num in enumerate(packed)) + b' '
+        content = b''.join(objects[num].ljust(100) for num in packed)
+        compressed = zlib.compress(header + content)
+        loose[stream_num] = (b'<< /Type /ObjStm /N %d /First %d /Length %d '
+                             b'/Filter /FlateDecode >>\nstream\n%s\nendstream'
+                             % (len(packed), len(header), len(compressed),
+                                compressed))
+    data, offsets = body(loose)
+    xref_num = stream_num + 1
+    offsets[xref_num] = len(data)
+    rows = [bytes((0, 0, 0, 255))]
+    for num in range(1, xref_num + 1):
+        if num in packed:
+            rows.append(bytes((2, 0, stream_num, packed.index(num))))
+        elif num in offsets:
+            rows.append(bytes((1,)) + offsets[num].to_bytes(2, 'big') + b'\x00')
+        else:
+            rows.append(bytes(4))
+    compressed = zlib.compress(png_up(rows, 4))
+    data += (b'%d 0 obj\n<< /Type /XRef /Size %d /W [1 2 1] /Root 1 0 R '
+             b'/Filter /FlateDecode /DecodeParms << /Predictor 12 /Columns 4 >> '
+             b'/Length %d >>\nstream\n%s\nendstream\nendobj\n'
+             % (xref_num, xref_num + 1, len(compressed), compressed))
+    return data + b'startxref\n%d\n%%%%EOF\n' % offsets[xref_num]
+
+def document(text=b'Hello'):
+    content = b'BT (%s) Tj ET' % text
+    return {1: CATALOG,
+            2: pages(3),
+            3: b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R >>',
+            4: b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+           }
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def contents(path):
+    """
+    Returns content streams of pages in merged file.
+    """
+    with PdfReader(path) as reader:
+        numbers = reader.pages()[0]
+        return [reader.resolve(reader.get(num)[b'Contents']).data
+                for num, inherited in numbers]
+
+def test_classic_xref(tmp_path):
+    path = write(tmp_path, 'a.pdf', classic(document()))
+    with PdfReader(path) as reader:
+        assert sorted(num for num in reader.xref if reader.xref[num]) == [1, 2, 3, 4]
+        assert reader.trailer[b'Root'].num == 1
+        assert reader.pages() == ([(3, {})], {2})
+        assert reader.get(4).data == b'BT (Hello) Tj ET'
+
+def test_xref_stream_with_predictor(tmp_path):
+    path = write(tmp_path, 'a.pdf', with_xref_stream(document()))
+    with PdfReader(path) as reader:
+        assert reader.get(1)[b'Type'] == b'Catalog'
+        assert reader.get(4).data == b'BT (Hello) Tj ET'
+    output = str(tmp_path / 'out.pdf')
+    assert merge([path], output) == 1
+    assert contents(output) == [b'BT (Hello) Tj ET']
+
+def test_object_stream(tmp_path):
+    path = write(tmp_path, 'a.pdf', with_xref_stream(document(), packed=[1, 2, 3]))
+    with PdfReader(path) as reader:
+        assert reader.xref[3] == (5, 2)
+        assert reader.get(3)[b'Contents'].num == 4
+        assert reader.pages()[0] == [(3, {})]
+    output = str(tmp_path / 'out.pdf')
+    assert merge([path], output) == 1
+    assert contents(output) == [b'BT (Hello) Tj ET']
+
+def test_broken_xref_is_rebuilt(tmp_path):
+    path = write(tmp_path, 'a.pdf', classic(document(), shift=7))
+    with PdfReader(path) as reader:
+        assert reader.get(1)[b'Type'] == b'Catalog'
+        assert reader.get(4).data == b'BT (Hello) Tj ET'
+    output = str(tmp_path / 'out.pdf')
+    assert merge([path], output) == 1
+
+def test_broken_xref_finds_object_stream(tmp_path):
+    data = with_xref_stream(document(), packed=[1, 2, 3])
+    data = data[:data.rindex(b'startxref')] + b'startxref\n1\n%%EOF\n'
+    path = write(tmp_path, 'a.pdf', data)
+    with PdfReader(path) as reader:
+        assert reader.trailer[b'Root'].num == 1
+        assert reader.pages()[0] == [(3, {})]
+
+def test_merge_keeps_page_order_and_inherited(tmp_path):
+    objects = document(b'First')
+    objects[2] = pages(3, 5)[:-2] + b'/MediaBox [0 0 100 200] >>'
+    objects[5] = b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R >>'
+    first = write(tmp_path, 'a.pdf', classic(objects))
+    second = write(tmp_path, 'b.pdf', classic(document(b'Second')))
+    output = str(tmp_path / 'out.pdf')
+    assert merge([first, second], output) == 3
+    assert contents(output) == [b'BT (First) Tj ET'] * 2 + [b'BT (Second) Tj ET']
+    with PdfReader(output) as reader:
+        numbers = [num for num, inherited in reader.pages()[0]]
+        assert reader.get(numbers[0])[b'MediaBox'] == [0, 0, 100, 200]
+        assert b'MediaBox' not in reader.get(numbers[2])
+
+def test_identical_objects_written_once(tmp_path):
+    font = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+    paths = []
+    for name in ('a.pdf', 'b.pdf'):
+        objects = document(name.encode())
+        objects[3] = (b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R '
+                      b'/Resources << /Font << /F1 5 0 R >> >> >>')
+        objects[5] = font
+        paths.append(write(tmp_path, name, classic(objects)))
+    output = str(tmp_path / 'out.pdf')
+    assert merge(paths, output) == 2
+    with open(output, 'rb') as outfile:
+        assert outfile.read().count(b'/Helvetica') == 1
+    with PdfReader(output) as reader:
+        fonts = [reader.get(num)[b'Resources'][b'Font'][b'F1']
+                 for num, inherited in reader.pages()[0]]
+        assert fonts[0].num == fonts[1].num
+
+def test_reference_cycle(tmp_path):
+    objects = document()
+    objects[3] = b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R /Annots [5 0 R] >>'
+    objects[5] = b'<< /Type /Annot /P 3 0 R /Next 6 0 R >>'
+    objects[6] = b'<< /Type /Annot /Next 5 0 R >>'
+    path = write(tmp_path, 'a.pdf', classic(objects))
+    output = str(tmp_path / 'out.pdf')
+    assert merge([path], output) == 1
+    with PdfReader(output) as reader:
+        (page, inherited), = reader.pages()[0]
+        first = reader.get(page)[b'Annots'][0]
+        annotation = reader.get(first.num)
+        assert annotation[b'P'].num == page
+        assert reader.get(annotation[b'Next'].num)[b'Next'].num == first.num
+
+def test_long_reference_chain(tmp_path):
+    objects = document()
+    objects[3] = b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R /Annots [5 0 R] >>'
+    last = 5 + 5000
+    for num in range(5, last):
+        objects[num] = b'<< /Next %d 0 R >>' % (num + 1)
+    objects[last] = b'<< /Next 5 0 R >>'
+    path = write(tmp_path, 'a.pdf', classic(objects))
+    output = str(tmp_path / 'out.pdf')
+    assert merge([path], output) == 1
+    with PdfReader(output) as reader:
+        assert len(reader.xref) >= 5000
+
+def test_missing_reference_becomes_null(tmp_path):
+    objects = document()
+    objects[3] = b'<< /Type /Page /Parent 2 0 R /Contents 4 0 R /Thumb 9 0 R >>'
+    path = write(tmp_path, 'a.pdf', classic(objects))
+    output = str(tmp_path / 'out.pdf')
+    assert merge([path], output) == 1
+    with PdfReader(output) as reader:
+        (page, inherited), = reader.pages()[0]
+        assert reader.get(page)[b'Thumb'] is None
+
+def test_encrypted(tmp_path):
+    objects = document()
+    objects[5] = b'<< /Filter /Standard /V 1 >>'
+    path = write(tmp_path, 'a.pdf', classic(objects, trailer=b'/Encrypt 5 0 R '))
+    with pytest.raises(PdfError, match='Encrypted'):
+        PdfReader(path)
+    with pytest.raises(PdfError, match='Document 1: Encrypted'):
+        merge([path], str(tmp_path / 'out.pdf'))
+
+def test_not_pdf(tmp_path):
+    path = write(tmp_path, 'a.pdf', b'PK\x03\x04 not a PDF')
+    with pytest.raises(PdfError, match='Not a PDF file.'):
+        PdfReader(path)
+    good = write(tmp_path, 'b.pdf', classic(document()))
+    with pytest.raises(PdfError, match='Document 2: '):
+        merge([good, path], str(tmp_path / 'out.pdf'))
@@ -0,0 +1,172 @@
+import time
+
+import pytest
+
+from conftest import wait_for
+from DocumentConverter import DocumentConverter, DocumentConversionException
+from aeroo_docs_fncs import OfficePool, OfficeWorker, NoOfficeConnection, \
+                            OfficeBusy, endpoints
+
+REMOTE = '192.0.2.1'
+
+def test_endpoints():
+    assert endpoints('localhost', 8100) == [('localhost', 8100)]
+    assert endpoints('a:8200, b', 8100) == [('a', 8200), ('b', 8100)]
+    assert endpoints('::1', 8100) == [('::1', 8100)]
+    assert endpoints('[::1]:8200,[fe80::1]', 8100) == [('::1', 8200),
+                                                       ('fe80::1', 8100)]
+
+def test_workers_on_consecutive_ports():
+    pool = OfficePool('localhost', 8100, size=2, warm_up=False)
+    assert [worker.oo_port for worker in pool.workers] == [8100, 8101]
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats() == {'workers': 2, 'workers_idle': 2,
+                            'workers_ejected': 0, 'recycles': 0}
+
+def test_workers_of_every_host():
+    pool = OfficePool('localhost,other:8200', 8100, size=2, warm_up=False)
+    assert [(worker.oo_host, worker.oo_port) for worker in pool.workers] == \
+           [('localhost', 8100), ('localhost', 8101), ('other', 8200),
+            ('other', 8201)]
+    assert pool.stats() == {'workers': 4, 'workers_idle': 4,
+                            'workers_ejected': 0, 'recycles': 0}
+
+def test_least_loaded_host_first():
+    pool = OfficePool('a,b', 8100, size=2, warm_up=False)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first.oo_host != second.oo_host
+    pool.release(first)
+    pool.release(second)
+
+def test_busy_after_timeout():
+    pool = OfficePool('localhost', 8100, size=1, timeout=0.05, warm_up=False)
+    worker = pool.acquire()
+    with pytest.raises(OfficeBusy):
+        pool.acquire()
+    pool.release(worker)
+    assert pool.acquire() is worker
+
+def test_unreachable_office_is_ejected_and_probed_back(down):
+    down.add(8101)
+    pool = OfficePool('localhost', 8100, size=2, warm_up=False)
+    assert pool.stats()['workers_ejected'] == 1
+    assert pool.acquire().oo_port == 8100
+    down.clear()
+    wait_for(lambda: pool.stats()['workers_ejected'] == 0)
+    assert pool.stats()['workers_idle'] == 1
+
+def test_no_office_fails_fast(down):
+    down.update((8100, 8101))
+    pool = OfficePool('localhost', 8100, size=2, timeout=60, warm_up=False)
+    start = time.time()
+    with pytest.raises(NoOfficeConnection):
+        pool.acquire()
+    assert time.time() - start < 1
+
+def test_lost_connection_ejects_worker(down):
+    pool = OfficePool('localhost', 8100, size=1, warm_up=False)
+    down.add(8100)
+    with pytest.raises(DocumentConversionException):
+        with pool.worker():
+            raise DocumentConversionException('Lost connection.')
+    assert pool.stats()['workers_ejected'] == 1
+    with pytest.raises(NoOfficeConnection):
+        pool.acquire()
+    down.clear()
+    wait_for(lambda: pool.stats()['workers_idle'] == 1)
+
+def test_other_errors_keep_worker():
+    pool = OfficePool('localhost', 8100, size=1, warm_up=False)
+    with pytest.raises(ValueError):
+        with pool.worker():
+            raise ValueError('Bad document.')
+    assert pool.stats()['workers_idle'] == 1
+
+def test_recycle_after_max_conversions(restarts):
+    pool = OfficePool('localhost', 8100, size=1, warm_up=False,
+                      max_conversions=2, ooo_restart_cmd='restart {port}')
+    worker = pool.workers[0]
+    for i in range(2):
+        with pool.worker():
+            pass
+    wait_for(lambda: pool.stats()['recycles'] == 1)
+    assert restarts == ['restart 8100']
+    assert pool.stats()['workers_idle'] == 1
+    assert worker.conversions == 0
+    with pool.worker() as oservice:
+        assert oservice is worker.oservice
+
+def test_restart_command_keeps_other_braces(restarts):
+    converter = DocumentConverter('localhost', 8100, ooo_start_timeout=0,
+                                  ooo_restart_cmd="pkill -f '{port}' && ${SOFFICE} {port}")
+    assert converter._restart_ooo()
+    assert restarts == ["pkill -f '8100' && ${SOFFICE} 8100"]
+
+def test_no_recycle_without_restart_script(restarts):
+    pool = OfficePool('localhost', 8100, size=1, warm_up=False,
+                      max_conversions=1)
+    with pool.worker():
+        pass
+    assert pool.workers[0].recycle_reason() is None
+    assert pool.stats()['workers_idle'] == 1
+    assert restarts == []
+
+def test_restart_at_start_only(down, restarts):
+    down.add(8100)
+    pool = OfficePool('localhost', 8100, size=1, warm_up=False,
+                      ooo_restart_cmd='restart', ooo_start_timeout=0)
+    assert restarts == ['restart']
+    # office that is down is probed, but not restarted again
+    time.sleep(0.2)
+    assert restarts == ['restart']
+    assert pool.stats()['workers_ejected'] == 1
+
+def test_remote_office_is_not_restarted(down, restarts):
+    down.add(8100)
+    worker = OfficeWorker(REMOTE, 8100, warm_up=False, ooo_restart_cmd='restart')
+    assert worker.oservice is None
+    assert restarts == []
+
+def test_remote_office_restarted_by_host(down, restarts):
+    down.add(8100)
+    OfficeWorker(REMOTE, 8100, warm_up=False, ooo_restart_cmd='ssh {host} restart',
+                 ooo_start_timeout=0)
+    assert restarts == ['ssh %s restart' % REMOTE]
+
+def test_remote_office_is_not_recycled(restarts):
+    worker = OfficeWorker(REMOTE, 8100, warm_up=False, max_conversions=1,
+                          max_memory=1, ooo_restart_cmd='restart')
+    worker.record(0.1)
+    assert not worker.oservice.isLocal()
+    assert worker.oservice.officePid() is None
+    assert worker.oservice.officeMemory() is None
+    assert worker.recycle_reason() is None
+
+def test_local_office():
+    converter = DocumentConverter('localhost', 8100)
+    assert converter.isLocal()
+    assert DocumentConverter('127.0.1.1', 8100).isLocal()
+
+def test_warm_up(office, monkeypatch):
+    filters = []
+    store = office.Document.storeToURL
+    def record(self, url, props):
+        filters.append(dict((prop.Name, prop.Value) for prop in props)['FilterName'])
+        store(self, url, props)
+    monkeypatch.setattr(office.Document, 'storeToURL', record)
+    worker = OfficeWorker('localhost', 8100)
+    assert filters == ['writer_pdf_Export', 'writer8', 'MS Word 97', 'calc8',
+                       'MS Excel 97', 'Text - txt - csv (StarCalc)']
+    # warm up is not counted as conversion
+    assert worker.oservice.popTimings() == []
+    assert worker.oservice.popBridgeCalls() == 0
+
+def test_resolver_is_shared():
+    first = DocumentConverter('localhost', 8100)
+    second = DocumentConverter('localhost', 8101)
+    assert first._resolver is second._resolver
@@ -0,0 +1,131 @@
+import pytest
+
+import fake_office
+import DocumentConverter as converter_module
+from DocumentConverter import DocumentConverter, BridgeCounter, BridgeProxy
+
+SCRIPT = fake_office.USER_URL + '/Scripts/python/aeroo_docs_office.py'
+
+def converter(**options):
+    converter = DocumentConverter('localhost', 8100, office_scripts=True, **options)
+    converter.putDocument(b'a')
+    return converter
+
+def part_files(tmp_path, datas):
+    files = []
+    for i, data in enumerate(datas):
+        path = tmp_path / ('part%d' % i)
+        path.write_bytes(data)
+        files.append(open(str(path), 'rb'))
+    return files
+
+@pytest.fixture
+def batches(monkeypatch):
+    """
+    Number of documents every office script call appended.
+    """
+    sizes = []
+    append = DocumentConverter._appendBatch
+    def record(self, script, batch, filter_name):
+        sizes.append(len(batch))
+        append(self, script, batch, filter_name)
+    monkeypatch.setattr(DocumentConverter, '_appendBatch', record)
+    return sizes
+
+def test_join_in_office(office, batches):
+    oconv = converter()
+    oconv.appendDocuments([b'b', b'c'])
+    assert oconv.saveByStream('writer8') == b'abc'
+    assert oconv._office_scripts
+    assert SCRIPT in office.SimpleFileAccess.files
+    assert batches == [2]
+
+def test_documents_in_memory_are_batched(batches):
+    oconv = converter(spool_threshold=4)
+    oconv.appendDocuments([b'bb', b'ccc', b'd'])
+    assert oconv.saveByStream('writer8') == b'abbcccd'
+    assert batches == [2, 1]
+
+def test_files_are_batched(tmp_path, monkeypatch, batches):
+    monkeypatch.setattr(converter_module, 'MAX_BATCH_STREAMS', 2)
+    oconv = converter()
+    files = part_files(tmp_path, [b'b', b'c', b'd', b'e', b'f'])
+    oconv.appendDocuments(iter(files))
+    assert oconv.saveByStream('writer8') == b'abcdef'
+    assert batches == [2, 2, 1]
+    assert all(infile.closed for infile in files)
+
+def test_failed_batch_closes_files(tmp_path, office, monkeypatch):
+    monkeypatch.setattr(converter_module, 'MAX_BATCH_STREAMS', 2)
+    oconv = converter()
+    def fail(self, url, props):
+        raise office.IOException('Office crashed.')
+    monkeypatch.setattr(office.TextRange, 'insertDocumentFromURL', fail)
+    files = part_files(tmp_path, [b'b', b'c', b'd'])
+    with pytest.raises(office.IOException):
+        oconv.appendDocuments(iter(files))
+    # last one was never handed to office
+    assert [infile.closed for infile in files] == [True, True, False]
+    files[2].close()
+
+def test_script_deployed_once(office, monkeypatch):
+    converter()._officeScript('append_documents')
+    writes = []
+    monkeypatch.setattr(office.SimpleFileAccess, 'writeFile',
+                        lambda self, url, stream: writes.append(url))
+    converter()._officeScript('append_documents')
+    assert writes == []
+
+def test_changed_script_is_redeployed(office):
+    converter()._officeScript('append_documents')
+    source = office.SimpleFileAccess.files[SCRIPT]
+    # edited script of the same size
+    office.SimpleFileAccess.files[SCRIPT] = b'#' * len(source)
+    oconv = converter()
+    oconv.appendDocuments([b'b'])
+    assert office.SimpleFileAccess.files[SCRIPT] == source
+    assert oconv.saveByStream('writer8') == b'ab'
+
+def test_falls_back_without_scripts(office, monkeypatch, batches):
+    def fail(self, uri):
+        raise office.ScriptFrameworkErrorException('Python is not installed.')
+    monkeypatch.setattr(office.ScriptProvider, 'getScript', fail)
+    oconv = converter()
+    oconv.appendDocuments([b'b', b'c'], update=True)
+    assert oconv.saveByStream('writer8') == b'abc'
+    assert not oconv._office_scripts
+    assert batches == []
+
+def test_scripts_save_bridge_calls():
+    calls = []
+    for office_scripts in (False, True):
+        oconv = DocumentConverter('localhost', 8100, office_scripts=office_scripts)
+        # first join deploys scripts
+        for i in range(2):
+            oconv.putDocument(b'a')
+            oconv.popBridgeCalls()
+            oconv.appendDocuments([b'b'] * 10, update=True)
+            oconv.closeDocument()
+        calls.append(oconv.popBridgeCalls())
+    plain, scripts = calls
+    assert 0 < scripts < plain
+
+def test_bridge_proxy_counts_calls(office):
+    counter = BridgeCounter()
+    document = counter.wrap(office.Document(b'a'))
+    text = document.Text
+    assert isinstance(text, BridgeProxy)
+    assert counter.calls == 1
+    end = text.getEnd()
+    assert isinstance(end, BridgeProxy)
+    assert counter.calls == 2
+    # plain values are not proxied
+    assert counter.wrap(5) == 5
+    assert document.getTextFields().getCount() == 0
+    assert counter.calls == 4
+    cursor = text.createTextCursor()
+    cursor.TextSection = end
+    assert counter.calls == 6
+    # office gets its own object back, not the proxy
+    assert office.Cursor.TextSection is None
+    assert cursor._target.TextSection is end._target
@@ -0,0 +1,276 @@
+import base64
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from conftest import wait_for
+from aeroo_docs_fncs import AccessException, NoidentException, OfficeService
+from aeroo_docs_pdf import PdfReader
+from aeroo_docs_stats import Stats
+
+def encode(data):
+    return base64.b64encode(data).decode()
+
+def upload(oser, data):
+    return oser.upload(encode(data), is_last=True)['identifier']
+
+def spool_files(oser):
+    return sorted(os.listdir(oser.spool.spool_dir))
+
+def test_convert(service):
+    oser = service(auth=lambda username, password: password == 'secret')
+    assert oser.convert(encode(b'document'), in_mime='odt', out_mime='pdf',
+                        password='secret') == encode(b'document')
+    with pytest.raises(AccessException):
+        oser.convert(encode(b'document'), in_mime='odt', out_mime='pdf')
+
+def test_convert_spool_result(service):
+    oser = service()
+    identifier = upload(oser, b'document')
+    result = oser.convert(identifier=identifier, in_mime='odt', out_mime='pdf',
+                          spool_result=True)
+    assert result['size'] == 8
+    download = oser.download(result['identifier'])
+    assert base64.b64decode(download['data']) == b'document'
+
+def test_failed_store_leaves_no_spool_file(service, office, monkeypatch):
+    oser = service()
+    identifier = upload(oser, b'document')
+    def fail(self, url, props):
+        props[0].Value.writeBytes(office.ByteSequence(b'half'))
+        raise office.IOException('Disk full.')
+    monkeypatch.setattr(office.Document, 'storeToURL', fail)
+    with pytest.raises(office.IOException):
+        oser.convert(identifier=identifier, in_mime='odt', out_mime='pdf',
+                     spool_result=True)
+    assert spool_files(oser) == [os.path.basename(oser.spool.filename(identifier))]
+    assert oser.spool.stats()['files'] == 1
+
+def test_download_in_chunks(service):
+    oser = service()
+    identifier = upload(oser, b'document')
+    chunks = []
+    offset = 0
+    while True:
+        chunk = oser.download(identifier, offset, 3)
+        chunks.append(base64.b64decode(chunk['data']))
+        offset = chunk['offset']
+        if chunk['is_last']:
+            break
+    assert chunks == [b'doc', b'ume', b'nt']
+
+def test_batch_isolates_bad_items(service):
+    oser = service(workers=2)
+    identifier = upload(oser, b'uploaded')
+    results = oser.convert_batch([
+        {'data': encode(b'first'), 'in_mime': 'odt', 'out_mime': 'pdf'},
+        'not a dictionary',
+        {'data': 12345, 'in_mime': 'odt', 'out_mime': 'pdf'},
+        {'identifier': True, 'in_mime': 'odt', 'out_mime': 'pdf'},
+        {'identifier': ['list'], 'in_mime': 'odt', 'out_mime': 'pdf'},
+        {'identifier': 12345, 'in_mime': 'odt', 'out_mime': 'pdf'},
+        {'in_mime': 'odt', 'out_mime': 'pdf'},
+        {'identifier': identifier, 'in_mime': 'odt', 'out_mime': 'pdf'},
+        {'data': 'not base64!', 'in_mime': 'odt', 'out_mime': 'pdf'},
+    ])
+    assert results[0] == {'data': encode(b'first')}
+    assert results[1] == {'error': 'Item has to be a dictionary.'}
+    assert results[2] == {'error': 'Data has to be base64 string.'}
+    for result in results[3:7]:
+        assert result == {'error': 'Wrong or no identifier.'}
+    assert results[7] == {'data': encode(b'uploaded')}
+    assert list(results[8]) == ['error']
+
+def test_batch_spool_result(service):
+    oser = service(workers=2)
+    results = oser.convert_batch([{'data': encode(b'first')},
+                                  {'data': encode(b'second')}],
+                                 spool_result=True)
+    assert [result['size'] for result in results] == [5, 6]
+
+def test_join(service):
+    oser = service()
+    idents = [upload(oser, data) for data in (b'a', b'b', b'c')]
+    assert base64.b64decode(oser.join(idents, in_mime='odt', out_mime='odt')) == b'abc'
+
+def test_join_in_batches(service):
+    oser = service(workers=2)
+    idents = [upload(oser, data) for data in (b'a', b'b', b'c', b'd', b'e')]
+    inputs = spool_files(oser)
+    result = oser.join(idents, in_mime='odt', out_mime='odt', batch_size=2)
+    assert base64.b64decode(result) == b'abcde'
+    # intermediates of every level are gone
+    assert spool_files(oser) == inputs
+
+def test_failed_join_in_batches_leaves_no_intermediates(service, monkeypatch):
+    oser = service(workers=2)
+    idents = [upload(oser, data) for data in (b'a', b'b', b'c', b'd', b'e')]
+    inputs = spool_files(oser)
+    join = oser._join
+    calls = []
+    def fail_second_level(idents, *args):
+        calls.append(idents)
+        # five documents give three intermediates, joined in two batches
+        if len(calls) == 4:
+            raise IOError('Office crashed.')
+        return join(idents, *args)
+    monkeypatch.setattr(oser, '_join', fail_second_level)
+    with pytest.raises(IOError):
+        oser.join(idents, in_mime='odt', out_mime='odt', batch_size=2)
+    assert len(calls) == 5
+    assert spool_files(oser) == inputs
+
+@pytest.fixture
+def shared(monkeypatch):
+    """
+    Fails when document bytes would pass through the service.
+    """
+    def fail(self, *args):
+        raise AssertionError('Spool file read by the service.')
+    monkeypatch.setattr(OfficeService, '_readInput', fail)
+    monkeypatch.setattr(OfficeService, '_openFile', fail)
+
+def test_shared_spool_convert(service, shared):
+    oser = service(shared_spool=True)
+    identifier = upload(oser, b'document')
+    assert oser.convert(identifier=identifier, in_mime='odt',
+                        out_mime='pdf') == encode(b'document')
+    result = oser.convert(identifier=identifier, in_mime='odt', out_mime='pdf',
+                          spool_result=True)
+    assert result['size'] == 8
+    with oser.spool.open(result['identifier']) as infile:
+        assert infile.read() == b'document'
+    with pytest.raises(NoidentException):
+        oser.convert(identifier=12345, in_mime='odt', out_mime='pdf')
+
+def test_shared_spool_failed_store_leaves_no_spool_file(service, office, monkeypatch):
+    oser = service(shared_spool=True)
+    identifier = upload(oser, b'document')
+    def fail(self, url, props):
+        raise office.IOException('Disk full.')
+    monkeypatch.setattr(office.Document, 'storeToURL', fail)
+    with pytest.raises(office.IOException):
+        oser.convert(identifier=identifier, in_mime='odt', out_mime='pdf',
+                     spool_result=True)
+    assert spool_files(oser) == [os.path.basename(oser.spool.filename(identifier))]
+
+def test_shared_spool_join(service, shared):
+    oser = service(workers=2, shared_spool=True)
+    idents = [upload(oser, data) for data in (b'a', b'b', b'c', b'd', b'e')]
+    inputs = spool_files(oser)
+    assert base64.b64decode(oser.join(idents, in_mime='odt', out_mime='odt')) == b'abcde'
+    result = oser.join(idents, in_mime='odt', out_mime='odt', batch_size=2,
+                       spool_result=True)
+    with oser.spool.open(result['identifier']) as infile:
+        assert infile.read() == b'abcde'
+    oser.spool.remove(result['identifier'])
+    assert spool_files(oser) == inputs
+
+def test_join_reads_ahead(service, monkeypatch):
+    oser = service(workers=2, prefetch=2, spool_threshold=4)
+    # each of both workers can join with two files ahead and one waited for
+    assert oser._prefetcher._max_workers == 6
+    idents = [upload(oser, data) for data in (b'a', b'bb', b'ccccc', b'd', b'eeeeee')]
+    read = []
+    prefetch = oser._prefetchFile
+    def record(ident):
+        data = prefetch(ident)
+        read.append(data)
+        return data
+    monkeypatch.setattr(oser, '_prefetchFile', record)
+    result = oser.join(idents, in_mime='odt', out_mime='odt')
+    assert base64.b64decode(result) == b'abbcccccdeeeeee'
+    # small files are read into memory, bigger ones opened
+    assert [isinstance(data, bytes) for data in read] == [True, False, True, False]
+    assert all(data.closed for data in read if not isinstance(data, bytes))
+
+def test_failed_join_closes_files_read_ahead(service, office, monkeypatch):
+    oser = service(prefetch=2, spool_threshold=0)
+    idents = [upload(oser, b'part %d' % i) for i in range(6)]
+    opened = []
+    prefetch = oser._prefetchFile
+    def record(ident):
+        infile = prefetch(ident)
+        opened.append(infile)
+        return infile
+    monkeypatch.setattr(oser, '_prefetchFile', record)
+    insert = office.TextRange.insertDocumentFromURL
+    def fail_second(self, url, props):
+        if len(self.document.data) == 2:
+            raise office.IOException('Office crashed.')
+        insert(self, url, props)
+    monkeypatch.setattr(office.TextRange, 'insertDocumentFromURL', fail_second)
+    with pytest.raises(office.IOException):
+        oser.join(idents, in_mime='odt', out_mime='odt')
+    # not every part was read, files opened ahead get closed
+    wait_for(lambda: len(opened) >= 3 and all(infile.closed for infile in opened))
+    assert len(opened) < 5
+
+PDF = (b'%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n'
+       b'2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n'
+       b'3 0 obj\n<< /Type /Page /Parent 2 0 R >>\nendobj\n'
+       b'trailer\n<< /Root 1 0 R >>\n%%EOF\n')
+
+def joined_pages(oser, result, tmp_path):
+    outfile = tmp_path / 'joined.pdf'
+    outfile.write_bytes(base64.b64decode(oser.download(result['identifier'],
+                                                       size=result['size'])['data']))
+    with PdfReader(str(outfile)) as reader:
+        return len(reader.pages()[0])
+
+def test_join_pdf(service, tmp_path):
+    oser = service()
+    idents = [upload(oser, PDF) for i in range(3)]
+    inputs = spool_files(oser)
+    result = oser.join(idents, in_mime='pdf', out_mime='pdf', spool_result=True)
+    assert joined_pages(oser, result, tmp_path) == 3
+    oser.spool.remove(result['identifier'])
+    assert spool_files(oser) == inputs
+
+def test_join_unknown_identifier(service):
+    oser = service()
+    with pytest.raises(NoidentException):
+        oser.join([12345, 67890], in_mime='pdf', out_mime='pdf')
+    assert spool_files(oser) == []
+
+class BrokenPool():
+    def submit(self, *args):
+        raise BrokenProcessPool('Process died.')
+
+    def shutdown(self, wait=True):
+        pass
+
+def test_broken_pdf_pool_merges_in_thread(service, tmp_path):
+    oser = service()
+    oser._pdf_pool = BrokenPool()
+    idents = [upload(oser, PDF) for i in range(2)]
+    for i in range(2):
+        result = oser.join(idents, in_mime='pdf', out_mime='pdf', spool_result=True)
+        assert joined_pages(oser, result, tmp_path) == 2
+        assert oser._pdf_pool is None
+
+def test_metric_labels_are_bounded():
+    stats = Stats(['odt', 'pdf'])
+    for mime in ('odt', 'x1', 'x2'):
+        stats.timer('convert', mime, 'pdf').finish()
+    labels = sorted((item['in_mime'], item['out_mime']) for item in stats.stats())
+    assert labels == [('odt', 'pdf'), ('other', 'pdf')]
+
+def test_metric_labels_are_escaped():
+    stats = Stats()
+    stats.observe(('convert', 'a"b\\c\nd', ''), 'total', 0.1)
+    text = stats.prometheus({'spool_files': 2})
+    assert 'in_mime="a\\"b\\\\c\\nd"' in text
+    # newline in label does not break the line
+    for line in text.splitlines():
+        assert line.startswith(('# ', 'aeroo_docs_'))
+    assert 'aeroo_docs_spool_files 2' in text
+
+def test_service_metrics(service):
+    oser = service()
+    oser.convert(encode(b'document'), in_mime='unknown', out_mime='pdf')
+    text = oser.prometheus()
+    assert 'in_mime="other",out_mime="pdf"' in text
+    assert 'in_mime="unknown"' not in text
+    assert 'aeroo_docs_office_workers 1' in text
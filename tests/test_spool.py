@@ -0,0 +1,132 @@
+import base64
+import os
+import time
+
+import pytest
+
+import aeroo_docs_spool
+from aeroo_docs_fncs import NoidentException, NodataException
+from aeroo_docs_spool import Spool
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path))
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Seconds the spool clock is ahead of real time.
+    """
+    ahead = [0]
+    monkeypatch.setattr(aeroo_docs_spool, 'time', lambda: time.time() + ahead[0])
+    return ahead
+
+def test_create_and_update(spool):
+    identifier, outfile = spool.create()
+    with outfile:
+        outfile.write(b'result')
+    spool.update(identifier, 6)
+    with spool.open(identifier) as infile:
+        assert infile.read() == b'result'
+    assert spool.size(identifier) == 6
+    assert spool.stats() == {'files': 1, 'bytes': 6, 'expired_files': 0,
+                             'expired_bytes': 0}
+    spool.remove(identifier)
+    assert spool.size(identifier) == 0
+    assert spool.stats()['files'] == 0
+    with pytest.raises(FileNotFoundError):
+        spool.open(identifier)
+
+def test_upload_in_chunks(spool):
+    identifier = spool.append(b'abc')
+    assert spool.append(b'def', identifier) == identifier
+    with pytest.raises(FileNotFoundError):
+        spool.open(identifier)
+    assert spool.stats()['bytes'] == 6
+    assert spool.finish(identifier)
+    with spool.open(identifier) as infile:
+        assert infile.read() == b'abcdef'
+    assert spool.stats() == {'files': 1, 'bytes': 6, 'expired_files': 0,
+                             'expired_bytes': 0}
+    assert spool.append(b'ghi', 12345) is None
+    assert not spool.finish(12345)
+
+def test_upload_continues_after_restart(tmp_path):
+    identifier = Spool(str(tmp_path)).append(b'abc')
+    spool = Spool(str(tmp_path))
+    assert spool.append(b'def', identifier) == identifier
+    assert spool.finish(identifier)
+    with spool.open(identifier) as infile:
+        assert infile.read() == b'abcdef'
+
+def test_service_upload(service):
+    oser = service()
+    first = base64.b64encode(b'abc').decode()
+    identifier = oser.upload(first)['identifier']
+    oser.upload(base64.b64encode(b'def').decode(), is_last=True,
+                identifier=identifier)
+    with oser.spool.open(identifier) as infile:
+        assert infile.read() == b'abcdef'
+    with pytest.raises(NoidentException):
+        oser.upload(first, identifier=identifier)
+    with pytest.raises(NodataException):
+        oser.upload()
+
+def test_scan_indexes_files_of_previous_run(tmp_path):
+    previous = Spool(str(tmp_path))
+    for data in (b'a', b'bb'):
+        identifier, outfile = previous.create()
+        with outfile:
+            outfile.write(data)
+    spool = Spool(str(tmp_path))
+    assert spool.scan() == 2
+    assert spool.scan() == 0
+    assert spool.stats()['bytes'] == 3
+
+def test_expire_removes_due_files_only(tmp_path):
+    spool = Spool(str(tmp_path))
+    old, outfile = spool.create()
+    with outfile:
+        outfile.write(b'old')
+    new, outfile = spool.create()
+    with outfile:
+        outfile.write(b'new')
+    written = time.time() - 120
+    os.utime(spool.filename(old), (written, written))
+    spool = Spool(str(tmp_path))
+    spool.scan()
+    assert spool.expire(60) == 1
+    assert spool.size(old) == 0
+    assert spool.size(new) == 3
+    assert spool.stats() == {'files': 1, 'bytes': 3, 'expired_files': 1,
+                             'expired_bytes': 3}
+
+def test_expire_skips_upload_written_since(spool, clock):
+    identifier = spool.append(b'abc')
+    clock[0] = 50
+    spool.append(b'def', identifier)
+    clock[0] = 100
+    assert spool.expire(60) == 0
+    clock[0] = 200
+    assert spool.expire(60) == 1
+    assert not os.listdir(spool.spool_dir)
+
+def test_expire_skips_removed_files(spool, clock):
+    identifier, outfile = spool.create()
+    outfile.close()
+    spool.remove(identifier)
+    clock[0] = 100
+    assert spool.expire(60) == 0
+    assert spool.stats()['expired_files'] == 0
+
+def test_close_idle_uploads(spool, clock):
+    idle = spool.append(b'abc')
+    clock[0] = 100
+    active = spool.append(b'abc')
+    assert spool.close_idle(60) == 1
+    assert spool.append(b'def', active) == active
+    # upload is picked up again from its partial file
+    assert spool.append(b'def', idle) == idle
+    assert spool.finish(idle)
+    with spool.open(idle) as infile:
+        assert infile.read() == b'abcdef'